@@ -0,0 +1,144 @@
+"""
+Compares the adaptive depth subsampling mask generation against the previous
+implementation, which upsampled the factor map in float64, built a full resolution
+`cartesian_prod` coordinate grid and used exact quantiles over all depth values.
+
+Usage:
+    PYTHONPATH=. python benchmarks/adaptive_subsampling.py \
+        --device cuda --megapixels 1 2 4 8 12
+"""
+
+import argparse
+import math
+
+import torch
+
+from gs_init_compare.depth_subsampling.adaptive_subsampling import (
+    AdaptiveDepthSubsampler,
+    _map_to_range,
+    get_sample_mask,
+)
+from gs_init_compare.depth_subsampling.config import AdaptiveSubsamplingConfig
+from timing import print_table, time_fn
+
+
+def legacy_get_sample_mask(downsample_factor_map, image_size):
+    per_pixel_df = (
+        torch.nn.functional.interpolate(
+            downsample_factor_map[None, None].to(float), size=image_size, mode="nearest"
+        )
+        .squeeze()
+        .to(int)
+    )
+    pixel_coords = torch.cartesian_prod(
+        torch.arange(per_pixel_df.shape[0], device=per_pixel_df.device),
+        torch.arange(per_pixel_df.shape[1], device=per_pixel_df.device),
+    )
+
+    per_pixel_df[per_pixel_df == 0] = 1
+    return torch.logical_and(
+        (pixel_coords[:, 0] % per_pixel_df.view(-1)) == 0,
+        (pixel_coords[:, 1] % per_pixel_df.view(-1)) == 0,
+    )
+
+
+def legacy_get_mask(config: AdaptiveSubsamplingConfig, rgb, depth, depth_mask):
+    masked_depth = depth[depth_mask]
+    q1 = torch.quantile(masked_depth, 0.25)
+    q3 = torch.quantile(masked_depth, 0.75)
+    iqr = q3 - q1
+    input_range = (
+        max(masked_depth.min(), q1 - 1.5 * iqr),
+        min(masked_depth.max(), q3 + 1.5 * iqr),
+    )
+    multiplier_map = torch.clamp(_map_to_range(depth, input_range=input_range), 0, 1)
+    multiplier_map[~depth_mask] = 0.5
+    multiplier_map = 1.0 - multiplier_map
+    factor_map = torch.clamp(
+        _map_to_range(
+            multiplier_map, output_range=config.factor_range, input_range=(0.0, 1.0)
+        ),
+        config.factor_range[0],
+        config.factor_range[1],
+    )
+    return legacy_get_sample_mask(factor_map.to(int), rgb.shape[:2])
+
+
+def synthetic_inputs(megapixels: float, device: str):
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+    ys = torch.linspace(0, 1, height, device=device)[:, None]
+    xs = torch.linspace(0, 1, width, device=device)[None, :]
+    depth = 1.0 + 10.0 * ys + torch.sin(20 * xs) * torch.cos(13 * ys)
+    depth_mask = torch.rand((height, width), device=device) > 0.05
+    rgb = torch.rand((height, width, 3), device=device)
+    return rgb, depth, depth_mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument(
+        "--megapixels", type=float, nargs="+", default=[1, 2, 4, 8, 12]
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    config = AdaptiveSubsamplingConfig()
+    subsampler = AdaptiveDepthSubsampler(config)
+
+    rows = []
+    for megapixels in args.megapixels:
+        rgb, depth, depth_mask = synthetic_inputs(megapixels, args.device)
+
+        # The lattice construction must be exact, check it on the same factor map.
+        factor_map = torch.randint(
+            config.factor_range[0],
+            config.factor_range[1] + 1,
+            depth.shape,
+            device=args.device,
+        )
+        assert torch.equal(
+            get_sample_mask(factor_map, depth.shape),
+            legacy_get_sample_mask(factor_map, depth.shape),
+        )
+
+        legacy_time = time_fn(
+            lambda: legacy_get_mask(config, rgb, depth, depth_mask),
+            args.device,
+            args.repeats,
+        )
+        fast_time = time_fn(
+            lambda: subsampler.get_mask(rgb, depth, depth_mask),
+            args.device,
+            args.repeats,
+        )
+        legacy_count = legacy_get_mask(config, rgb, depth, depth_mask).sum().item()
+        fast_count = subsampler.get_mask(rgb, depth, depth_mask).sum().item()
+        rows.append(
+            [
+                f"{depth.shape[1]}x{depth.shape[0]}",
+                f"{legacy_time * 1e3:.1f}",
+                f"{fast_time * 1e3:.1f}",
+                f"{legacy_time / fast_time:.1f}x",
+                f"{legacy_count}",
+                f"{fast_count}",
+            ]
+        )
+
+    print(f"Adaptive subsampling mask generation on {args.device}")
+    print_table(
+        [
+            "resolution",
+            "legacy [ms]",
+            "fast [ms]",
+            "speedup",
+            "legacy #pts",
+            "fast #pts",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
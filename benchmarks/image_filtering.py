@@ -0,0 +1,105 @@
+"""
+Compares Gaussian filtering and Gaussian derivative gradients against the previous
+implementation, which rebuilt kernels with NumPy on every call, repeated them per
+channel and replicate-padded the input before each 1D pass.
+
+Usage:
+    PYTHONPATH=. python benchmarks/image_filtering.py \
+        --device cuda --sigmas 1.2 3 5 8 16
+"""
+
+import argparse
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.depth_prediction.utils.image_filtering import (
+    gaussian_filter2d,
+    get_gausskernel_size,
+    spatial_gradient_first_order,
+)
+from timing import print_table, time_fn
+
+
+def legacy_filter2d(x, kernel):
+    pad_x = kernel.size()[1] // 2
+    pad_y = kernel.size()[0] // 2
+    padded = F.pad(x, (pad_x, pad_x, pad_y, pad_y), mode="replicate")
+    kernel = kernel.flip(0, 1)[None, None].repeat(x.size(1), 1, 1, 1)
+    return F.conv2d(padded, kernel, stride=1, groups=x.size(1))
+
+
+def legacy_kernels(sigma, device):
+    half = get_gausskernel_size(sigma) // 2
+    x = torch.arange(-half, half + 1)
+    gaussian = (1 / (sigma * np.sqrt(2 * np.pi))) * np.exp(-x * x / (2 * sigma**2))
+    gderiv = -(x / sigma**2) * gaussian
+    return gaussian.float().to(device), gderiv.float().to(device)
+
+
+def legacy_gaussian_filter2d(x, sigma):
+    kernel, _ = legacy_kernels(sigma, x.device)
+    return legacy_filter2d(legacy_filter2d(x, kernel[:, None]), kernel[None, :])
+
+
+def legacy_spatial_gradient_first_order(x, sigma):
+    gaussian_k, gderiv_k = legacy_kernels(sigma, x.device)
+    blurred_y = legacy_filter2d(x, gaussian_k[:, None])
+    blurred_x = legacy_filter2d(x, gaussian_k[None, :])
+    return torch.stack(
+        [
+            legacy_filter2d(blurred_y, gderiv_k[None, :]),
+            legacy_filter2d(blurred_x, gderiv_k[:, None]),
+        ],
+        dim=2,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--megapixels", type=float, default=3)
+    parser.add_argument(
+        "--sigmas", type=float, nargs="+", default=[1.2, 3.0, 5.0, 8.0, 16.0]
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    width = int(math.sqrt(args.megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+    image = torch.rand((1, 3, height, width), device=args.device)
+
+    rows = []
+    for sigma in args.sigmas:
+        for name, legacy_fn, fn in (
+            ("blur", legacy_gaussian_filter2d, gaussian_filter2d),
+            ("gradient", legacy_spatial_gradient_first_order, spatial_gradient_first_order),
+        ):
+            expected = legacy_fn(image, sigma)
+            times = [time_fn(lambda: legacy_fn(image, sigma), args.device, args.repeats)]
+            for method in ("direct", "fft"):
+                result = fn(image, sigma, method=method)
+                assert torch.allclose(result, expected, atol=1e-5), (name, method)
+                times.append(
+                    time_fn(
+                        lambda: fn(image, sigma, method=method),
+                        args.device,
+                        args.repeats,
+                    )
+                )
+            rows.append(
+                [name, f"{sigma:g}"]
+                + [f"{t * 1e3:.1f}" for t in times]
+                + [f"{times[0] / min(times[1:]):.1f}x"]
+            )
+
+    print(f"Gaussian filtering of a 3x{height}x{width} image on {args.device}")
+    print_table(
+        ["filter", "sigma", "legacy [ms]", "direct [ms]", "fft [ms]", "speedup"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares initial Gaussian scales from pixel footprints (`--mdi.initial-scale
+footprint`) against the mean distance to the 3 nearest neighbours (the default),
+on depth maps rendered from random views of a synthetic room.
+
+Reports the time to compute the scales and the distribution of their ratio only.
+Whether footprint scales change how fast training converges has not been measured;
+`time_to_quality.py` can measure it by training with both options
+(`--initial-scales knn footprint`) and reporting the steps and time needed to reach
+a target validation PSNR.
+
+Usage:
+    PYTHONPATH=. python benchmarks/initial_scales.py --device cuda --num-views 50
+"""
+
+import argparse
+import math
+
+import torch
+
+from gs_init_compare.depth_prediction.points_from_depth import sample_spacing
+from gs_init_compare.point_cloud_postprocess.voxel_downsample import (
+    voxel_density_spacing,
+)
+from gs_init_compare.utils.runner_utils import knn
+from point_clouds import random_cameras, ray_cast_scene
+from timing import print_table, synchronize, time_fn
+
+
+def render_view(origin, yaw, height, width, focal):
+    """Rays (world space) and z-depths `[H * W]` of a horizontal pinhole camera."""
+    rows, cols = torch.meshgrid(
+        torch.arange(height) + 0.5, torch.arange(width) + 0.5, indexing="ij"
+    )
+    camera_dirs = torch.stack(
+        [(cols - width / 2) / focal, (rows - height / 2) / focal, torch.ones_like(rows)],
+        dim=-1,
+    ).reshape(-1, 3)
+    # Camera x to the right, y down, z forward, rotated by yaw around world z.
+    forward = torch.tensor([math.cos(yaw), math.sin(yaw), 0.0])
+    right = torch.tensor([math.sin(yaw), -math.cos(yaw), 0.0])
+    down = torch.tensor([0.0, 0.0, -1.0])
+    dirs = camera_dirs @ torch.stack([right, down, forward])
+    unit_dirs = dirs / dirs.norm(dim=1, keepdim=True)
+    t = ray_cast_scene(origin.expand_as(unit_dirs), unit_dirs)
+    return unit_dirs, t, t / dirs.norm(dim=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num-views", type=int, default=20)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--subsample-factor", type=int, default=10)
+    parser.add_argument("--clamp-voxel-size", type=float, default=0.25)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    gen = torch.Generator().manual_seed(0)
+    focal = 0.8 * args.width
+    cameras = random_cameras(args.num_views, gen)
+    yaws = 2 * math.pi * torch.rand(args.num_views, generator=gen)
+
+    mask = torch.zeros((args.height, args.width), dtype=torch.bool)
+    mask[:: args.subsample_factor, :: args.subsample_factor] = True
+    mask = mask.view(-1).to(args.device)
+    image_size = (args.height, args.width)
+
+    points, depths = [], []
+    for origin, yaw in zip(cameras, yaws.tolist()):
+        dirs, t, depth = render_view(origin, yaw, args.height, args.width, focal)
+        points.append((origin + dirs * t[:, None]).to(args.device)[mask])
+        depths.append(depth.to(args.device)[mask])
+    points = torch.cat(points)
+
+    def knn_scales():
+        return (knn(points, 4)[:, 1:] ** 2).mean(dim=-1).sqrt()
+
+    def footprint_scales():
+        # Per view, as in get_pts_from_depth.
+        return torch.cat(
+            [sample_spacing(mask, image_size) * depth / focal for depth in depths]
+        )
+
+    def clamped_footprint_scales():
+        return torch.minimum(
+            footprint_scales(), voxel_density_spacing(points, args.clamp_voxel_size)
+        )
+
+    reference = knn_scales()
+    rows = []
+    for name, fn in (
+        ("knn", knn_scales),
+        ("footprint", footprint_scales),
+        (f"footprint, clamp {args.clamp_voxel_size:g}", clamped_footprint_scales),
+    ):
+        scales = fn()
+        synchronize(args.device)
+        ratio = (scales / reference.clamp(min=1e-12)).cpu()
+        quantiles = torch.quantile(
+            ratio[torch.randperm(ratio.numel(), generator=gen)[: 2**24]],
+            torch.tensor([0.1, 0.5, 0.9]),
+        )
+        rows.append(
+            [
+                name,
+                f"{time_fn(fn, args.device, args.repeats):.3f}",
+                *(f"{q:.2f}" for q in quantiles.tolist()),
+            ]
+        )
+
+    print(
+        f"Initial scales of {points.shape[0]:,} points from {args.num_views} views, "
+        f"subsample factor {args.subsample_factor}, on {args.device}"
+    )
+    print_table(["scales", "time [s]", "ratio p10", "ratio p50", "ratio p90"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares the nearest neighbour search used for initial Gaussian scales against the
+previous implementation, which copied the points to NumPy and ran sklearn's
+`NearestNeighbors` over the full cloud.
+
+Usage:
+    PYTHONPATH=. python benchmarks/knn.py \
+        --device cuda --num-points 1e5 1e6 1e7 --eps 0 0.1
+"""
+
+import argparse
+
+import torch
+from sklearn.neighbors import NearestNeighbors
+
+from gs_init_compare.utils.runner_utils import knn
+from point_clouds import synthetic_scene
+from timing import print_table, time_fn
+
+
+def legacy_knn(x: torch.Tensor, K: int = 4) -> torch.Tensor:
+    x_np = x.cpu().numpy()
+    model = NearestNeighbors(n_neighbors=K, metric="euclidean").fit(x_np)
+    distances, _ = model.kneighbors(x_np)
+    return torch.from_numpy(distances).to(x)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num-points", type=float, nargs="+", default=[1e5, 1e6])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--eps", type=float, nargs="+", default=[0.0, 0.1])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for num_points in args.num_points:
+        pts = synthetic_scene(int(num_points))
+        expected = legacy_knn(pts, args.k)
+        legacy_time = time_fn(lambda: legacy_knn(pts, args.k), "cpu", args.repeats)
+
+        for eps in args.eps:
+            result = knn(pts, args.k, device=args.device, eps=eps)
+            if eps == 0:
+                assert torch.allclose(result, expected, atol=1e-5)
+            else:
+                assert (result <= (1 + eps) * expected + 1e-5).all()
+            relative_error = (result - expected).sum() / expected.sum()
+            t = time_fn(
+                lambda: knn(pts, args.k, device=args.device, eps=eps),
+                args.device,
+                args.repeats,
+            )
+            rows.append(
+                [
+                    f"{pts.shape[0]:,}",
+                    f"{eps:g}",
+                    f"{relative_error:.1e}",
+                    f"{legacy_time:.2f}",
+                    f"{t:.2f}",
+                    f"{legacy_time / t:.1f}x",
+                ]
+            )
+
+    print(
+        f"{args.k} nearest neighbours on {args.device}, "
+        f"{torch.get_num_threads()} CPU threads"
+    )
+    print_table(
+        ["points", "eps", "mean rel. error", "sklearn [s]", "ours [s]", "speedup"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares statistical outlier removal against Open3D's `remove_statistical_outlier`,
+which the point cloud postprocessing used before (requires `open3d`).
+
+Usage:
+    PYTHONPATH=. python benchmarks/outlier_removal.py --device cuda --num-points 1e6 1e7
+"""
+
+import argparse
+
+import open3d as o3d
+import torch
+
+from gs_init_compare.point_cloud_postprocess.outlier_removal import (
+    remove_statistical_outliers,
+)
+from point_clouds import synthetic_scene
+from timing import print_table, time_fn
+
+
+def open3d_inliers(pts: torch.Tensor) -> torch.Tensor:
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(pts.double().numpy())
+    _, indices = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.5)
+    mask = torch.zeros(pts.shape[0], dtype=torch.bool)
+    mask[torch.as_tensor(indices, dtype=torch.long)] = True
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num-points", type=float, nargs="+", default=[1e6, 1e7])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for num_points in args.num_points:
+        pts = synthetic_scene(int(num_points))
+        pts_device = pts.to(args.device)
+
+        expected = open3d_inliers(pts)
+        inliers = remove_statistical_outliers(pts_device).inliers.cpu()
+        mismatches = int((inliers != expected).sum())
+        # Only points whose mean neighbour distance is within rounding of the
+        # threshold may be classified differently.
+        assert mismatches <= 1e-5 * pts.shape[0], mismatches
+
+        times = [
+            time_fn(lambda: open3d_inliers(pts), "cpu", args.repeats),
+            time_fn(
+                lambda: remove_statistical_outliers(pts_device),
+                args.device,
+                args.repeats,
+            ),
+        ]
+        rows.append(
+            [
+                f"{pts.shape[0]:,}",
+                f"{int(expected.sum()):,}",
+                str(mismatches),
+                *(f"{t:.2f}" for t in times),
+                f"{times[0] / times[1]:.1f}x",
+            ]
+        )
+
+    print(
+        f"Statistical outlier removal (k=20, std ratio 2.5) on {args.device}, "
+        f"{torch.get_num_threads()} CPU threads"
+    )
+    print_table(
+        ["points", "inliers", "mismatches", "open3d [s]", "ours [s]", "speedup"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
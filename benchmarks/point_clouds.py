@@ -0,0 +1,48 @@
+"""
+Synthetic point clouds shared by the benchmark scripts.
+"""
+
+import torch
+
+
+def ray_cast_scene(origins: torch.Tensor, dirs: torch.Tensor) -> torch.Tensor:
+    """
+    Distances along unit rays `[N, 3]` to the first hit of the walls of the room
+    `[-5, 5] x [-5, 5] x [0, 3]` or the unit sphere at `(0, 0, 1)`. Origins must be
+    inside the room.
+    """
+    t = torch.full(origins.shape[:1], torch.inf)
+    for axis, bounds in enumerate(((-5, 5), (-5, 5), (0, 3))):
+        for bound in bounds:
+            t_wall = (bound - origins[:, axis]) / dirs[:, axis]
+            t = torch.where((t_wall > 0) & (t_wall < t), t_wall, t)
+
+    oc = origins - torch.tensor([0.0, 0.0, 1.0])
+    b = (oc * dirs).sum(dim=1)
+    disc = b * b - ((oc * oc).sum(dim=1) - 1)
+    t_sphere = -b - disc.clamp(min=0).sqrt()
+    return torch.where((disc > 0) & (t_sphere > 0) & (t_sphere < t), t_sphere, t)
+
+
+def random_cameras(num_cameras: int, gen: torch.Generator) -> torch.Tensor:
+    """Random camera positions `[num_cameras, 3]` inside the room."""
+    cameras = torch.rand((num_cameras, 3), generator=gen)
+    return cameras * torch.tensor([4.0, 4.0, 1.0]) + torch.tensor([-2.0, -2.0, 1.0])
+
+
+def synthetic_scene(num_points: int, seed: int = 0) -> torch.Tensor:
+    """
+    Imitates depth-based initialization: rays from a few cameras hitting the walls
+    of a room and a sphere, with depth-proportional noise and 1% floaters.
+    """
+    gen = torch.Generator().manual_seed(seed)
+    cameras = random_cameras(8, gen)
+    origins = cameras[torch.randint(8, (num_points,), generator=gen)]
+    dirs = torch.randn((num_points, 3), generator=gen)
+    dirs /= dirs.norm(dim=1, keepdim=True)
+
+    t = ray_cast_scene(origins, dirs)
+    t = t * (1 + 0.002 * torch.randn(num_points, generator=gen))
+    floaters = torch.rand(num_points, generator=gen) < 0.01
+    t[floaters] *= torch.rand(int(floaters.sum()), generator=gen)
+    return origins + dirs * t[:, None]
@@ -0,0 +1,117 @@
+"""
+Measures how many training steps (and how much training time) monocular depth
+initialization needs to reach a target validation PSNR with different initial GS
+orientations (random isotropic GSs versus surface-aligned discs,
+`--mdi.initial-orientation`) and initial scales (mean distance to the 3 nearest
+neighbours versus pixel footprints, `--mdi.initial-scale`).
+
+Each combination of `--orientations` and `--initial-scales` is trained with the
+trainer CLI, evaluating and saving stats every `--eval-every` steps (note that this
+also saves checkpoints). Arguments after `--` are passed to the trainer.
+
+Usage:
+    PYTHONPATH=. python benchmarks/time_to_quality.py \
+        --data-dir data/360_v2/garden --target-psnr 24 \
+        -- --mdi.predictor metric3d --mdi.subsample-factor 10
+    PYTHONPATH=. python benchmarks/time_to_quality.py \
+        --data-dir data/360_v2/garden --target-psnr 24 \
+        --orientations random --initial-scales knn footprint \
+        -- --mdi.predictor metric3d --mdi.subsample-factor 10
+"""
+
+import argparse
+import itertools
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+from timing import print_table
+
+
+def read_stats(stats_dir: Path, step: int, stage: str) -> Optional[dict]:
+    """Stats the runner saved after `step` steps, `stage` is "train" or "val"."""
+    suffix = "_rank0" if stage == "train" else ""
+    path = stats_dir / f"{stage}_step{step - 1:04d}{suffix}.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--result-dir", default="results/time_to_quality")
+    parser.add_argument("--target-psnr", type=float, required=True)
+    parser.add_argument("--max-steps", type=int, default=7_000)
+    parser.add_argument("--eval-every", type=int, default=500)
+    parser.add_argument("--orientations", nargs="+", default=["random", "normal"])
+    parser.add_argument("--initial-scales", nargs="+", default=["knn"])
+    args, trainer_args = parser.parse_known_args()
+    trainer_args = [a for a in trainer_args if a != "--"]
+
+    steps = list(range(args.eval_every, args.max_steps + 1, args.eval_every))
+    rows = []
+    for orientation, initial_scale in itertools.product(
+        args.orientations, args.initial_scales
+    ):
+        result_dir = Path(args.result_dir) / f"{orientation}_{initial_scale}"
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "gs_init_compare.trainer",
+                "default",
+                "--disable-viewer",
+                "--data-dir",
+                args.data_dir,
+                "--result-dir",
+                str(result_dir),
+                "--init-type",
+                "monocular_depth",
+                "--max-steps",
+                str(args.max_steps),
+                "--eval-steps",
+                *map(str, steps),
+                "--save-steps",
+                *map(str, steps),
+                "--mdi.initial-orientation",
+                orientation,
+                "--mdi.initial-scale",
+                initial_scale,
+                *trainer_args,
+            ],
+            check=True,
+        )
+
+        reached = None
+        final_psnr = float("nan")
+        for step in steps:
+            val_stats = read_stats(result_dir / "stats", step, "val")
+            if val_stats is None:
+                continue
+            final_psnr = val_stats["psnr"]
+            if reached is None and val_stats["psnr"] >= args.target_psnr:
+                train_stats = read_stats(result_dir / "stats", step, "train")
+                reached = (step, train_stats["ellipse_time"])
+
+        rows.append(
+            [
+                orientation,
+                initial_scale,
+                str(reached[0]) if reached else "-",
+                f"{reached[1]:.0f}" if reached else "-",
+                f"{final_psnr:.2f}",
+            ]
+        )
+
+    print(f"Time to reach {args.target_psnr} dB validation PSNR on {args.data_dir}")
+    print_table(
+        ["orientation", "initial scale", "steps", "time [s]", "final PSNR"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Small timing helpers shared by the benchmark scripts.
+"""
+
+import time
+from typing import Callable, List
+
+import torch
+
+
+def synchronize(device: str):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn: Callable[[], object], device: str, repeats: int = 5, warmup: int = 1):
+    """
+    Runs `fn` `warmup` times untimed, then `repeats` times timed.
+
+    Returns:
+        Median wall clock time of a single call in seconds.
+    """
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+
+    times: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def print_table(header: List[str], rows: List[List[str]]):
+    widths = [
+        max(len(header[i]), *(len(row[i]) for row in rows)) for i in range(len(header))
+    ]
+    print(" | ".join(h.rjust(w) for h, w in zip(header, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for row in rows:
+        print(" | ".join(c.rjust(w) for c, w in zip(row, widths)))
@@ -4,11 +4,21 @@ from typing_extensions import assert_never
 
 from gsplat.strategy import DefaultStrategy, MCMCStrategy
 
+from gs_init_compare.depth_fusion.config import (
+    DepthConsistencyConfig,
+    TsdfFusionConfig,
+)
 from gs_init_compare.point_cloud_postprocess.config import PointCloudPostprocessConfig
 
 
 from .depth_alignment.config import DepthAlignmentStrategyEnum
-from .depth_subsampling.config import AdaptiveSubsamplingConfig
+from .depth_subsampling.config import (
+    AdaptiveSubsamplingConfig,
+    BlueNoiseSubsamplingConfig,
+    BudgetSubsamplingConfig,
+    EdgeAwareSubsamplingConfig,
+    ViewSelectionConfig,
+)
 from .depth_prediction.configs import (
     Metric3dV2Config,
     DepthAnythingV2Config,
@@ -35,15 +45,82 @@ class MonocularDepthInitConfig:
     depth_alignment_strategy: DepthAlignmentStrategyEnum = (
         DepthAlignmentStrategyEnum.ransac
     )
+    # If set, depth is only predicted for a subset of the training views which
+    # together see most SfM points, see --mdi.view-selection. Cuts prediction time
+    # and the number of points of dense captures with nearly redundant views.
+    select_views: bool = False
+    # Configuration for view selection. Ignored unless select_views is set.
+    view_selection: ViewSelectionConfig = ViewSelectionConfig()
+    # If set, depth of images of COLMAP cameras with distortion is predicted on the
+    # original (distorted) images and their pixels are unprojected through the
+    # camera's distortion model, so no undistorted images are needed. Ignored for
+    # nerfbaselines datasets, which only have pinhole cameras.
+    unproject_distorted: bool = False
     # How depth is subsampled to temper the number of generated 3D points.
     # If set to an int, a constant subsampling factor is used. If set to
     # "adaptive", adaptive subsampling is used, which can be further
-    # configured using --mdi.adaptive-subsampling.
-    subsample_factor: Union[int, Literal["adaptive"]] = 10
+    # configured using --mdi.adaptive-subsampling. If set to "budget", the
+    # total number of points over all images is fixed and split between images
+    # based on their estimated importance, see --mdi.budget-subsampling. If set
+    # to "edge_aware", images are sampled densely around colour and depth edges
+    # and sparsely in flat regions, see --mdi.edge-aware-subsampling. If set
+    # to "blue_noise", pixels are selected by thresholding a blue-noise mask
+    # with a (optionally modulated) density, see --mdi.blue-noise-subsampling.
+    subsample_factor: Union[
+        int, Literal["adaptive", "budget", "edge_aware", "blue_noise"]
+    ] = 10
     # Configuration for adaptive subsampling. Ignored if not using "adaptive" subsampling.
     adaptive_subsampling: AdaptiveSubsamplingConfig = AdaptiveSubsamplingConfig()
+    # Configuration for point budget subsampling. Ignored if not using "budget" subsampling.
+    budget_subsampling: BudgetSubsamplingConfig = BudgetSubsamplingConfig()
+    # Configuration for edge-aware subsampling. Ignored if not using "edge_aware" subsampling.
+    edge_aware_subsampling: EdgeAwareSubsamplingConfig = EdgeAwareSubsamplingConfig()
+    # Configuration for blue-noise subsampling. Ignored if not using "blue_noise" subsampling.
+    blue_noise_subsampling: BlueNoiseSubsamplingConfig = BlueNoiseSubsamplingConfig()
+
+    # If set, points whose depth is not confirmed by the aligned depth of enough
+    # of the views sharing most SfM points with their view are dropped, see
+    # --mdi.depth-consistency. The points of each view are then kept in memory until
+    # the depth maps of those views are aligned.
+    depth_consistency_filter: bool = False
+    # Configuration for the depth consistency filter.
+    depth_consistency: DepthConsistencyConfig = DepthConsistencyConfig()
+
+    # How the points of all images are combined. "concatenate" keeps the points
+    # unprojected from each image. "tsdf" fuses the aligned depth maps, sampled at a
+    # density tied to the voxel size instead of --mdi.subsample-factor, into a
+    # sparse truncated signed distance volume and extracts surface points from it,
+    # see --mdi.tsdf; the number of points then depends on the surface area rather
+    # than the number of views, and points get the voxel size as footprint.
+    fusion: Literal["concatenate", "tsdf"] = "concatenate"
+    # Configuration for TSDF fusion. Ignored unless fusion is "tsdf".
+    tsdf: TsdfFusionConfig = TsdfFusionConfig()
 
     postprocess: PointCloudPostprocessConfig = PointCloudPostprocessConfig()
+    # If set, points falling into voxels (of this size, as a fraction of the scene
+    # extent) already occupied by points of previously processed images are dropped
+    # as they are produced, removing redundant points of overlapping views before
+    # they are accumulated. Ignored if fusion is "tsdf".
+    redundancy_voxel_size_wrt_scene_extent: Optional[float] = None
+
+    # How initial GS scales are set. "knn" uses the mean distance to the 3 nearest
+    # neighbours, like the other init types. "footprint" uses the world space size
+    # of the image area each point was sampled from (depth * sample spacing / focal
+    # length), which needs no neighbour search. Its effect on convergence has not
+    # been measured, see benchmarks/time_to_quality.py.
+    initial_scale: Literal["knn", "footprint"] = "knn"
+    # If set, footprints are clamped to the point spacing estimated from the number
+    # of points in voxels of this size (as a fraction of the scene extent), which
+    # accounts for overlapping views. Ignored unless initial_scale is "footprint".
+    footprint_clamp_voxel_size_wrt_scene_extent: Optional[float] = None
+    # How initial GS orientations are set. "random" initializes isotropic GSs with
+    # random rotations. "normal" initializes flat discs aligned with the surface,
+    # using normals predicted by the model if available (Metric3D), otherwise
+    # normals estimated from the aligned depth.
+    initial_orientation: Literal["random", "normal"] = "random"
+    # Thickness of the discs as a fraction of their radius. Ignored unless
+    # initial_orientation is "normal".
+    disc_thickness: float = 0.1
 
     # If set, point clouds from monocular depth init are saved to this directory.
     pts_output_dir: Optional[str] = None
@@ -81,6 +158,14 @@ class Config:
     result_dir: str = "results/garden"
     # Every N images there is a test image
     test_every: int = 8
+    # If set, parsed COLMAP reconstructions are cached in this directory and reused
+    # while the reconstruction and images are unchanged. None parses on every run.
+    parser_cache_dir: Optional[str] = None
+    # Decode and undistort images once into a memory-mapped file in
+    # parser_cache_dir, shared by all data loader workers. The file stores all
+    # images uncompressed (width * height * 3 bytes each, many GB for large scenes
+    # at data_factor 1). Ignored if parser_cache_dir is None.
+    cache_images: bool = False
     # Random crop size for training  (experimental)
     patch_size: Optional[int] = None
     # A global scaler that applies to the scene size related parameters
@@ -95,6 +180,14 @@ class Config:
 
     # Batch size for training. Learning rates are scaled automatically
     batch_size: int = 1
+    # Upload all training images, intrinsics and poses to the training device once
+    # and sample batches (and patches) there instead of loading them with a
+    # DataLoader. Falls back to the DataLoader on non-CUDA devices and when the
+    # images would take more than `device_dataset_max_memory_fraction` of the
+    # device memory.
+    device_dataset: bool = False
+    # Fraction of the device memory the images of the device dataset may take.
+    device_dataset_max_memory_fraction: float = 0.3
     # A global factor to scale the number of training steps
     steps_scaler: float = 1.0
 
@@ -122,6 +215,11 @@ class Config:
     init_opa: float = 0.1
     # Initial scale of GS
     init_scale: float = 1.0
+    # Device for the nearest neighbour search that sets initial GS scales,
+    # None to search on the training device.
+    init_knn_device: Optional[str] = None
+    # Allowed relative error of the initial GS scale neighbour distances, 0 for exact.
+    init_knn_eps: float = 0.0
     # Weight for SSIM loss
     ssim_lambda: float = 0.2
 
@@ -194,6 +292,13 @@ class Config:
     # Background color for rendering
     background_color: Optional[Tuple[float, float, float]] = None
 
+    # Training images are converted to sRGB uint8 on access, keeping this many
+    # converted images in memory.
+    image_cache_size: int = 64
+    # If > 0, all training images are converted up front on this many threads
+    # instead.
+    image_preprocess_threads: int = 0
+
     def adjust_steps(self, factor: float):
         self.eval_steps = [int(i * factor) for i in self.eval_steps]
         self.save_steps = [int(i * factor) for i in self.save_steps]
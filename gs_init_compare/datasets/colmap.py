@@ -1,6 +1,6 @@
 import os
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import pycolmap
 from typing_extensions import assert_never
 
@@ -8,22 +8,15 @@ import cv2
 import imageio.v2 as imageio
 import numpy as np
 import torch
+from PIL import Image
 
-from .normalize import (
-    align_principle_axes,
-    similarity_from_cameras,
-    transform_cameras,
-    transform_points,
-)
-
-
-def _get_rel_paths(path_dir: str) -> List[str]:
-    """Recursively get relative paths of files in a directory."""
-    paths = []
-    for dp, dn, fn in os.walk(path_dir):
-        for f in fn:
-            paths.append(os.path.relpath(os.path.join(dp, f), path_dir))
-    return paths
+from .depth_samples import DepthSamples
+from .distortion import CameraDistortion
+from .image_metadata import probe_directory, scan_directory
+from .image_store import ImageStore
+from .parser_cache import load_parser_state, parser_fingerprint, save_parser_state
+from .visibility import PointVisibility
+from .normalize import normalize_inplace
 
 
 class Parser:
@@ -35,7 +28,17 @@ class Parser:
         factor: int = 1,
         normalize: bool = False,
         test_every: int = 8,
+        cache_dir: Optional[str] = None,
+        cache_images: bool = False,
     ):
+        """
+        Args:
+            cache_dir: If set, the parsed state is cached in this directory and
+                restored from it while the COLMAP model, images and arguments are
+                unchanged.
+            cache_images: If set (and cache_dir is set), images are decoded and
+                undistorted once into a memory-mapped `ImageStore` in cache_dir.
+        """
         self.data_dir = data_dir
         self.factor = factor
         self.normalize = normalize
@@ -48,6 +51,66 @@ class Parser:
             f"COLMAP directory {colmap_dir} does not exist."
         )
 
+        # Load extended metadata. Used by Bilarf dataset.
+        self.extconf = {
+            "spiral_radius_scale": 1.0,
+            "no_factor_suffix": False,
+        }
+        extconf_file = os.path.join(data_dir, "ext_metadata.json")
+        if os.path.exists(extconf_file):
+            with open(extconf_file) as f:
+                self.extconf.update(json.load(f))
+
+        if factor > 1 and not self.extconf["no_factor_suffix"]:
+            image_dir_suffix = f"_{factor}"
+        else:
+            image_dir_suffix = ""
+        self.colmap_image_dir = os.path.join(data_dir, "images")
+        self.image_dir = os.path.join(data_dir, "images" + image_dir_suffix)
+        for d in [self.image_dir, self.colmap_image_dir]:
+            if not os.path.exists(d):
+                raise ValueError(f"Image folder {d} does not exist.")
+        # Listed once, for both the cache fingerprint and the image probe.
+        image_dir_files = {
+            d: scan_directory(d) for d in {self.image_dir, self.colmap_image_dir}
+        }
+
+        if cache_dir is None:
+            self._parse(colmap_dir, cache_dir, image_dir_files)
+        else:
+            cache_name = f"{self.dataset_name}_{factor}"
+            if normalize:
+                cache_name += "_normalized"
+            fingerprint = parser_fingerprint(
+                data_dir, colmap_dir, factor, normalize, image_dir_files
+            )
+            if load_parser_state(self, cache_dir, cache_name, fingerprint):
+                print(f"[Parser] Restored from cache {cache_dir}/{cache_name}.")
+            else:
+                self._parse(colmap_dir, cache_dir, image_dir_files)
+                save_parser_state(self, cache_dir, cache_name, fingerprint)
+
+        # Images don't depend on normalization, so the store is shared.
+        self.image_store: Optional[ImageStore] = None
+        if cache_dir is not None and cache_images:
+            self.image_store = ImageStore.open_or_build(
+                cache_dir,
+                f"{self.dataset_name}_{factor}_images",
+                {k: v for k, v in fingerprint.items() if k != "normalize"},
+                len(self.image_paths),
+                self.load_image,
+            )
+
+    def _parse(
+        self,
+        colmap_dir: str,
+        cache_dir: Optional[str],
+        image_dir_files: Dict[str, Dict[str, Tuple[int, int]]],
+    ):
+        data_dir = self.data_dir
+        factor = self.factor
+        normalize = self.normalize
+
         reconstruction = pycolmap.Reconstruction(colmap_dir)
 
         # Extract extrinsic matrices in world-to-camera format.
@@ -142,80 +205,81 @@ class Parser:
         camtoworlds = camtoworlds[inds]
         camera_ids = [camera_ids[i] for i in inds]
 
-        # Load extended metadata. Used by Bilarf dataset.
-        self.extconf = {
-            "spiral_radius_scale": 1.0,
-            "no_factor_suffix": False,
-        }
-        extconf_file = os.path.join(data_dir, "ext_metadata.json")
-        if os.path.exists(extconf_file):
-            with open(extconf_file) as f:
-                self.extconf.update(json.load(f))
-
         # Load bounds if possible (only used in forward facing scenes).
         self.bounds = np.array([0.01, 1.0])
         posefile = os.path.join(data_dir, "poses_bounds.npy")
         if os.path.exists(posefile):
             self.bounds = np.load(posefile)[:, -2:]
 
-        # Load images.
-        if factor > 1 and not self.extconf["no_factor_suffix"]:
-            image_dir_suffix = f"_{factor}"
-        else:
-            image_dir_suffix = ""
-        colmap_image_dir = os.path.join(data_dir, "images")
-        image_dir = os.path.join(data_dir, "images" + image_dir_suffix)
-        for d in [image_dir, colmap_image_dir]:
-            if not os.path.exists(d):
-                raise ValueError(f"Image folder {d} does not exist.")
+        # Load images. Sizes and EXIF data are read from the image headers.
+        colmap_image_dir = self.colmap_image_dir
+        image_dir = self.image_dir
+        image_metadata = probe_directory(
+            image_dir, cache_dir, files=image_dir_files[image_dir]
+        )
+        colmap_image_metadata = (
+            image_metadata
+            if colmap_image_dir == image_dir
+            else probe_directory(
+                colmap_image_dir, cache_dir, files=image_dir_files[colmap_image_dir]
+            )
+        )
 
         # Downsampled images may have different names vs images used for COLMAP,
         # so we need to map between the two sorted lists of files.
-        colmap_files = sorted(_get_rel_paths(colmap_image_dir))
-        image_files = sorted(_get_rel_paths(image_dir))
+        colmap_files = sorted(colmap_image_metadata)
+        image_files = sorted(image_metadata)
         colmap_to_image = dict(zip(colmap_files, image_files))
         image_paths = [os.path.join(image_dir, colmap_to_image[f]) for f in image_names]
 
+        # The EXIF data of the original images is preferred, downsampling often drops
+        # it and the 35mm equivalent focal length doesn't depend on the resolution.
+        exif_focals_35mm = {}
+        for name in image_names:
+            for metadata in [
+                colmap_image_metadata[name],
+                image_metadata[colmap_to_image[name]],
+            ]:
+                if metadata is not None and metadata.focal_35mm is not None:
+                    exif_focals_35mm[name] = metadata.focal_35mm
+                    break
+
         # 3D points and {image_name -> [point_idx]}
         points = np.empty([reconstruction.num_points3D(), 3], dtype=np.float32)
         points_err = np.empty(reconstruction.num_points3D(), dtype=np.float32)
         points_rgb = np.empty([reconstruction.num_points3D(), 3], dtype=np.uint8)
         point3D: pycolmap.Point3D
 
-        point3d_id_to_idx = {
-            id: i for i, id in enumerate(reconstruction.points3D.keys())
-        }
-
-        for point3d_id, point3D in reconstruction.points3D.items():
-            i = point3d_id_to_idx[point3d_id]
+        for i, point3D in enumerate(reconstruction.points3D.values()):
             points[i] = point3D.xyz
             points_err[i] = point3D.error
             points_rgb[i] = point3D.color
 
-        point_indices = dict()
-
-        point_indices = {
-            image.name: np.array(
-                [
-                    point3d_id_to_idx[point2d.point3D_id]
-                    for point2d in image.points2D
-                    if point2d.has_point3D()
-                ]
-            ).astype(np.int32)
+        # Point indices are the positions of the point ids in points3D.
+        point3d_ids = np.fromiter(
+            reconstruction.points3D.keys(),
+            dtype=np.int64,
+            count=reconstruction.num_points3D(),
+        )
+        id_order = np.argsort(point3d_ids)
+        visible_ids = [
+            np.fromiter(
+                (p.point3D_id for p in image.points2D if p.has_point3D()),
+                dtype=np.int64,
+            )
             for image in reconstruction.images.values()
-        }
+        ]
+        flat_ids = np.concatenate(visible_ids)
+        point_indices = PointVisibility(
+            [image.name for image in reconstruction.images.values()],
+            np.cumsum([0] + [len(ids) for ids in visible_ids]),
+            id_order[np.searchsorted(point3d_ids[id_order], flat_ids)],
+            num_points=reconstruction.num_points3D(),
+        )
 
         # Normalize the world space.
         if normalize:
-            T1 = similarity_from_cameras(camtoworlds)
-            camtoworlds = transform_cameras(T1, camtoworlds)
-            points = transform_points(T1, points)
-
-            T2 = align_principle_axes(points)
-            camtoworlds = transform_cameras(T2, camtoworlds)
-            points = transform_points(T2, points)
-
-            transform = T2 @ T1
+            camtoworlds, transform = normalize_inplace(camtoworlds, points)
         else:
             transform = np.eye(4)
 
@@ -230,14 +294,19 @@ class Parser:
         self.points = points  # np.ndarray, (num_points, 3)
         self.points_err = points_err  # np.ndarray, (num_points,)
         self.points_rgb = points_rgb  # np.ndarray, (num_points, 3)
-        # Dict[str, np.ndarray], image_name -> [M,]
+        # PointVisibility, behaves as Dict[str, np.ndarray], image_name -> [M,]
         self.point_indices = point_indices
         self.transform = transform  # np.ndarray, (4, 4)
+        self.exif_focals_35mm = exif_focals_35mm  # Dict of image_name -> focal
 
-        # load one image to check the size. In the case of tanksandtemples dataset, the
+        # check the size of one image. In the case of tanksandtemples dataset, the
         # intrinsics stored in COLMAP corresponds to 2x upsampled images.
-        actual_image = imageio.imread(self.image_paths[0])[..., :3]
-        actual_height, actual_width = actual_image.shape[:2]
+        first_metadata = image_metadata[colmap_to_image[image_names[0]]]
+        if first_metadata is not None:
+            actual_width, actual_height = first_metadata.width, first_metadata.height
+        else:
+            actual_image = imageio.imread(self.image_paths[0])[..., :3]
+            actual_height, actual_width = actual_image.shape[:2]
         colmap_width, colmap_height = self.imsize_dict[self.camera_ids[0]]
         s_height, s_width = actual_height / colmap_height, actual_width / colmap_width
         for camera_id, K in self.Ks_dict.items():
@@ -251,6 +320,9 @@ class Parser:
         self.mapx_dict = dict()
         self.mapy_dict = dict()
         self.roi_undist_dict = dict()
+        # Intrinsics of the distorted images of cameras with distortion.
+        self.Ks_distorted_dict = dict()
+        self.camtype = camtype
         for camera_id in self.params_dict.keys():
             params = self.params_dict[camera_id]
             if len(params) == 0:
@@ -311,6 +383,7 @@ class Parser:
 
             self.mapx_dict[camera_id] = mapx
             self.mapy_dict[camera_id] = mapy
+            self.Ks_distorted_dict[camera_id] = K
             self.Ks_dict[camera_id] = K_undist
             self.roi_undist_dict[camera_id] = roi_undist
             self.imsize_dict[camera_id] = (roi_undist[2], roi_undist[3])
@@ -326,6 +399,50 @@ class Parser:
     def dataset_name(self):
         return self.data_dir.removeprefix("data/").replace("/", "_")
 
+    def camera_distortion(self, index: int) -> Optional[CameraDistortion]:
+        """Distortion model of image `index`, None if its camera has no distortion."""
+        camera_id = self.camera_ids[index]
+        params = self.params_dict[camera_id]
+        if len(params) == 0:
+            return None
+        height, width = self.mapx_dict[camera_id].shape[:2]
+        return CameraDistortion(
+            self.camtype, self.Ks_distorted_dict[camera_id], params, (width, height)
+        )
+
+    def load_image(self, index: int, undistort: bool = True) -> np.ndarray:
+        """
+        Decodes image `index` and, if `undistort` is set, undistorts it if needed,
+        `[H, W, 3]` uint8.
+        """
+        image = imageio.imread(self.image_paths[index])[..., :3]
+        camera_id = self.camera_ids[index]
+        params = self.params_dict[camera_id]
+        if undistort and len(params) > 0:
+            # Images are distorted. Undistort them.
+            mapx, mapy = (
+                self.mapx_dict[camera_id],
+                self.mapy_dict[camera_id],
+            )
+            image = cv2.remap(image, mapx, mapy, cv2.INTER_LINEAR)
+            x, y, w, h = self.roi_undist_dict[camera_id]
+            image = image[y : y + h, x : x + w]
+        return image
+
+    def load_thumbnail(self, index: int, max_size: int) -> np.ndarray:
+        """
+        Decodes image `index` downscaled by an integer factor to a longest side of
+        at least `max_size`, `[H, W, 3]` uint8. JPEGs are decoded directly at the
+        reduced resolution. The image is not undistorted.
+        """
+        with Image.open(self.image_paths[index]) as image:
+            image.draft("RGB", (max_size, max_size))
+            image = image.convert("RGB")
+            factor = max(image.size) // max_size
+            if factor > 1:
+                image = image.reduce(factor)
+            return np.asarray(image)
+
 
 class Dataset:
     """A simple dataset class."""
@@ -336,39 +453,91 @@ class Dataset:
         split: str = "train",
         patch_size: Optional[int] = None,
         load_depths: bool = False,
+        undistort: bool = True,
     ):
+        """
+        Args:
+            undistort: If False, images of cameras with distortion are returned as
+                they are, with the intrinsics of the distorted images (see
+                `Parser.camera_distortion`).
+        """
+        if load_depths and not undistort:
+            raise ValueError("Depths can only be loaded for undistorted images.")
         self.parser = parser
         self.split = split
         self.patch_size = patch_size
         self.load_depths = load_depths
+        self.undistort = undistort
         indices = np.arange(len(self.parser.image_names))
         if split == "train":
             self.indices = indices[indices % self.parser.test_every != 0]
         else:
             self.indices = indices[indices % self.parser.test_every == 0]
 
+        self.depth_samples: Optional[DepthSamples] = None
+        if load_depths:
+            # SfM points are projected once, not on every access.
+            self.depth_samples = DepthSamples.project(
+                self.parser.points,
+                [
+                    self.parser.point_indices[self.parser.image_names[index]]
+                    for index in self.indices
+                ],
+                self.parser.cam_to_worlds[self.indices],
+                np.stack(
+                    [
+                        self.parser.Ks_dict[self.parser.camera_ids[index]]
+                        for index in self.indices
+                    ]
+                ),
+                [self._image_size(index) for index in self.indices],
+            )
+
+    @property
+    def image_names(self) -> List[str]:
+        """Names of the images of the dataset, in order."""
+        return [self.parser.image_names[index] for index in self.indices]
+
+    def _image_size(self, index: int) -> Tuple[int, int]:
+        """Width and height of image `index`."""
+        if self.parser.image_store is not None:
+            height, width = self.parser.image_store.shapes[index][:2]
+            return width, height
+        return self.parser.imsize_dict[self.parser.camera_ids[index]]
+
     def __len__(self):
         return len(self.indices)
 
+    def camera(self, item: int) -> Tuple[np.ndarray, np.ndarray, Tuple[int, int]]:
+        """
+        Camera to world transform, (undistorted) intrinsics and image width and
+        height of item `item`, without loading its image.
+        """
+        index = self.indices[item]
+        K = self.parser.Ks_dict[self.parser.camera_ids[index]]
+        return self.parser.cam_to_worlds[index], K, self._image_size(index)
+
+    def load_thumbnail(self, item: int, max_size: int) -> np.ndarray:
+        """See `Parser.load_thumbnail`."""
+        return self.parser.load_thumbnail(self.indices[item], max_size)
+
     def __getitem__(self, item: int) -> Dict[str, Any]:
         index = self.indices[item]
-        image = imageio.imread(self.parser.image_paths[index])[..., :3]
+        if not self.undistort:
+            image = self.parser.load_image(index, undistort=False)
+        elif self.parser.image_store is not None:
+            image = self.parser.image_store[index]
+        else:
+            image = self.parser.load_image(index)
         camera_id = self.parser.camera_ids[index]
         K = self.parser.Ks_dict[camera_id].copy()  # undistorted K
-        params = self.parser.params_dict[camera_id]
         camtoworlds = self.parser.cam_to_worlds[index]
         mask = self.parser.mask_dict[camera_id]
+        if not self.undistort and camera_id in self.parser.Ks_distorted_dict:
+            K = self.parser.Ks_distorted_dict[camera_id].copy()
+            mask = None
 
-        if len(params) > 0:
-            # Images are distorted. Undistort them.
-            mapx, mapy = (
-                self.parser.mapx_dict[camera_id],
-                self.parser.mapy_dict[camera_id],
-            )
-            image = cv2.remap(image, mapx, mapy, cv2.INTER_LINEAR)
-            x, y, w, h = self.parser.roi_undist_dict[camera_id]
-            image = image[y : y + h, x : x + w]
-
+        x = y = 0
         if self.patch_size is not None:
             # Random crop.
             h, w = image.shape[:2]
@@ -388,28 +557,15 @@ class Dataset:
         if mask is not None:
             data["mask"] = torch.from_numpy(mask).bool()
 
-        if self.load_depths:
-            # projected points to image plane to get depths
-            worldtocams = np.linalg.inv(camtoworlds)
-            image_name = self.parser.image_names[index]
-            point_indices = self.parser.point_indices[image_name]
-            points_world = self.parser.points[point_indices]
-            points_cam = (worldtocams[:3, :3] @ points_world.T + worldtocams[:3, 3:4]).T
-            points_proj = (K @ points_cam.T).T
-            points = points_proj[:, :2] / points_proj[:, 2:3]  # (M, 2)
-            depths = points_cam[:, 2]  # (M,)
-            # filter out points outside the image
-            selector = (
-                (points[:, 0] >= 0)
-                & (points[:, 0] < image.shape[1])
-                & (points[:, 1] >= 0)
-                & (points[:, 1] < image.shape[0])
-                & (depths > 0)
-            )
-            points = points[selector]
-            depths = depths[selector]
-            data["points"] = torch.from_numpy(points).float()
-            data["depths"] = torch.from_numpy(depths).float()
+        if self.depth_samples is not None:
+            if self.patch_size is not None:
+                points, depths = self.depth_samples.crop(
+                    item, x, y, image.shape[1], image.shape[0]
+                )
+            else:
+                points, depths = self.depth_samples[item]
+            data["points"] = torch.from_numpy(points)  # (M, 2)
+            data["depths"] = torch.from_numpy(depths)  # (M,)
 
         return data
 
@@ -0,0 +1,94 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+
+
+class DepthSamples:
+    """
+    SfM points projected into a set of images, with their depths, used for depth
+    supervision. The samples of all images are packed into ragged buffers: the pixel
+    coordinates of the points visible in image `i` are
+    `points[offsets[i] : offsets[i + 1]]`.
+    """
+
+    def __init__(self, offsets: np.ndarray, points: np.ndarray, depths: np.ndarray):
+        """
+        Args:
+            offsets: Start of each image's samples, `[I + 1]`.
+            points: Pixel coordinates of the samples of all images, `[M, 2]`.
+            depths: Depths of the samples of all images, `[M]`.
+        """
+        self.offsets = offsets
+        self.points = points
+        self.depths = depths
+
+    @classmethod
+    def project(
+        cls,
+        points_world: np.ndarray,
+        point_indices: Sequence[np.ndarray],
+        camtoworlds: np.ndarray,
+        Ks: np.ndarray,
+        image_sizes: Sequence[Tuple[int, int]],
+    ) -> "DepthSamples":
+        """
+        Projects the SfM points visible in each image into it, keeping the points in
+        front of the camera which project inside the image.
+
+        Args:
+            points_world: SfM points `[P, 3]`.
+            point_indices: Indices of the points visible in each image.
+            camtoworlds: Camera to world transforms `[I, 4, 4]`.
+            Ks: Camera intrinsics `[I, 3, 3]`.
+            image_sizes: Width and height of each image.
+        """
+        offsets = np.zeros(len(point_indices) + 1, dtype=np.int64)
+        all_points, all_depths = [], []
+        for i, indices in enumerate(point_indices):
+            worldtocams = np.linalg.inv(camtoworlds[i])
+            points_cam = points_world[indices] @ worldtocams[:3, :3].T
+            points_cam += worldtocams[:3, 3]
+            points_proj = points_cam @ Ks[i].T
+            points = points_proj[:, :2] / points_proj[:, 2:3]  # (M, 2)
+            depths = points_cam[:, 2]  # (M,)
+            width, height = image_sizes[i]
+            selector = (
+                (points[:, 0] >= 0)
+                & (points[:, 0] < width)
+                & (points[:, 1] >= 0)
+                & (points[:, 1] < height)
+                & (depths > 0)
+            )
+            all_points.append(points[selector].astype(np.float32))
+            all_depths.append(depths[selector].astype(np.float32))
+            offsets[i + 1] = offsets[i] + len(all_depths[-1])
+        return cls(
+            offsets,
+            np.concatenate(all_points) if all_points else np.zeros((0, 2), np.float32),
+            np.concatenate(all_depths) if all_depths else np.zeros(0, np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Pixel coordinates `[M, 2]` and depths `[M]` of the samples of image `i`."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.points[start:end], self.depths[start:end]
+
+    def crop(
+        self, i: int, x: int, y: int, width: int, height: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Samples of image `i` inside the `width` x `height` patch at `(x, y)`, with
+        pixel coordinates relative to the patch.
+        """
+        points, depths = self[i]
+        points = points - np.array([x, y], dtype=points.dtype)
+        selector = (
+            (points[:, 0] >= 0)
+            & (points[:, 0] < width)
+            & (points[:, 1] >= 0)
+            & (points[:, 1] < height)
+        )
+        return points[selector], depths[selector]
@@ -0,0 +1,174 @@
+import copy
+import logging
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from gs_init_compare.utils.cuda_memory import human_readable_memory_size
+
+_LOGGER = logging.getLogger(__name__)
+
+# Per-image keys of dataset items that are cropped to random patches.
+_IMAGE_KEYS = ("image", "mask", "sampling_mask")
+
+
+class DeviceDataset:
+    """
+    All items of a dataset (`Dataset` or the nerfbaselines `gs_Dataset`) uploaded to
+    the training device once, with images kept as uint8 and masks kept once per
+    camera. Shuffled batches, and random patches if the dataset has a patch size, are
+    sampled with on-device indexing and have the same layout as batches of a
+    `DataLoader` over the dataset, except that images are already normalized to
+    [0, 1].
+    """
+
+    def __init__(self, dataset, device: str, batch_size: int, seed: int = 42):
+        self.device = device
+        self.batch_size = batch_size
+        self.patch_size: Optional[int] = dataset.patch_size
+        self._generator = torch.Generator().manual_seed(seed)
+
+        # Items are loaded without cropping, patches are cropped when sampling.
+        full_dataset = copy.copy(dataset)
+        full_dataset.patch_size = None
+
+        self.image_names: List[str] = []
+        self.image_ids: List[int] = []
+        self.items: List[Dict[str, torch.Tensor]] = []
+        # Masks are per camera and datasets return the camera's mask without
+        # copying it, so masks are uploaded once per distinct buffer.
+        masks: Dict[int, torch.Tensor] = {}
+        Ks, camtoworlds = [], []
+        for i in range(len(full_dataset)):
+            data = full_dataset[i]
+            self.image_names.append(data["image_name"])
+            self.image_ids.append(data["image_id"])
+            Ks.append(data["K"])
+            camtoworlds.append(data["camtoworld"])
+            item = {}
+            for key, value in data.items():
+                if key in ("K", "camtoworld", "image_name", "image_id"):
+                    continue
+                if key == "mask":
+                    if value.data_ptr() not in masks:
+                        masks[value.data_ptr()] = value.to(device)
+                    item[key] = masks[value.data_ptr()]
+                    continue
+                if key == "image":
+                    value = value.to(torch.uint8)
+                item[key] = value.to(device)
+            self.items.append(item)
+        self.Ks = torch.stack(Ks).to(device)
+        self.camtoworlds = torch.stack(camtoworlds).to(device)
+        self.image_ids_tensor = torch.tensor(self.image_ids, device=device)
+
+        self._order = torch.zeros(0, dtype=torch.long)
+        self._cursor = 0
+
+    @classmethod
+    def create_if_fits(
+        cls, dataset, device: str, batch_size: int, max_memory_fraction: float
+    ) -> Optional["DeviceDataset"]:
+        """
+        Creates the device dataset if its images and per-image masks (estimated from
+        the first item), camera masks and depth samples take at most
+        `max_memory_fraction` of the device memory, otherwise returns None.
+        """
+        if not str(device).startswith("cuda"):
+            _LOGGER.info("Device dataset is only used on CUDA devices.")
+            return None
+        if len(dataset) == 0:
+            return None
+        # Full images are uploaded even if patches are sampled.
+        full_dataset = copy.copy(dataset)
+        full_dataset.patch_size = None
+        first = full_dataset[0]
+        # Images are stored as uint8.
+        per_item = first["image"].numel()
+        if "sampling_mask" in first:
+            per_item += first["sampling_mask"].numel() * (
+                first["sampling_mask"].element_size()
+            )
+        estimate = len(dataset) * per_item
+        if "mask" in first:
+            # One bool mask per camera.
+            estimate += sum(
+                mask.size
+                for mask in getattr(dataset.parser, "mask_dict", {}).values()
+                if mask is not None
+            )
+        depth_samples = getattr(dataset, "depth_samples", None)
+        if depth_samples is not None:
+            estimate += depth_samples.points.nbytes + depth_samples.depths.nbytes
+        budget = max_memory_fraction * torch.cuda.get_device_properties(
+            torch.device(device)
+        ).total_memory
+        if estimate > budget:
+            _LOGGER.warning(
+                f"Training data needs about {human_readable_memory_size(estimate)}, "
+                f"more than {human_readable_memory_size(budget)} allowed on "
+                f"{device}, falling back to a DataLoader."
+            )
+            return None
+        return cls(dataset, device, batch_size)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _randint(self, high: int) -> int:
+        return int(torch.randint(high, (), generator=self._generator))
+
+    def _next_indices(self) -> torch.Tensor:
+        if self._cursor >= len(self._order):
+            self._order = torch.randperm(len(self.items), generator=self._generator)
+            self._cursor = 0
+        # Like a DataLoader without drop_last, the last batch of an epoch may be
+        # smaller.
+        indices = self._order[self._cursor : self._cursor + self.batch_size]
+        self._cursor += self.batch_size
+        return indices
+
+    def next_batch(self) -> Dict[str, Any]:
+        indices = self._next_indices()
+        device_indices = indices.to(self.device)
+        Ks = self.Ks[device_indices]
+
+        items = [self.items[i] for i in indices.tolist()]
+        if self.patch_size is not None:
+            offsets = []
+            cropped = []
+            for item in items:
+                h, w = item["image"].shape[:2]
+                x = self._randint(max(w - self.patch_size, 1))
+                y = self._randint(max(h - self.patch_size, 1))
+                item = dict(item)
+                for key in _IMAGE_KEYS:
+                    if key in item:
+                        item[key] = item[key][
+                            y : y + self.patch_size, x : x + self.patch_size
+                        ]
+                if "points" in item:
+                    points = item["points"] - item["points"].new_tensor([x, y])
+                    inside = (
+                        (points >= 0).all(dim=-1)
+                        & (points[:, 0] < item["image"].shape[1])
+                        & (points[:, 1] < item["image"].shape[0])
+                    )
+                    item["points"] = points[inside]
+                    item["depths"] = item["depths"][inside]
+                offsets.append([x, y])
+                cropped.append(item)
+            items = cropped
+            Ks = Ks.clone()
+            Ks[:, :2, 2] -= torch.tensor(offsets, dtype=Ks.dtype, device=self.device)
+
+        batch = {
+            "K": Ks,
+            "camtoworld": self.camtoworlds[device_indices],
+            "image_name": [self.image_names[i] for i in indices.tolist()],
+            "image_id": self.image_ids_tensor[device_indices],
+        }
+        for key in items[0]:
+            values = torch.stack([item[key] for item in items])
+            batch[key] = values.float().div_(255.0) if key == "image" else values
+        return batch
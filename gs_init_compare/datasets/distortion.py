@@ -0,0 +1,105 @@
+from typing import Literal, NamedTuple, Tuple
+
+import numpy as np
+import torch
+
+# Iterations used to invert the distortion models.
+_UNDISTORT_ITERATIONS = 20
+
+
+class CameraDistortion(NamedTuple):
+    """
+    Distortion model of a camera, the same one `Parser` uses to undistort its images.
+    Maps between pixel coordinates of an ideal pinhole camera with intrinsics `K` and
+    pixel coordinates in the original (distorted) image.
+    """
+
+    camtype: Literal["perspective", "fisheye"]
+    K: np.ndarray
+    """ Intrinsics of the distorted image. (3, 3) """
+    params: np.ndarray
+    """ (k1, k2, p1, p2) for perspective cameras, (k1, k2, k3, k4) for fisheye ones. """
+    image_size: Tuple[int, int]
+    """ Width and height of the distorted image. """
+
+    def _intrinsics(self, like: torch.Tensor):
+        K = torch.as_tensor(self.K, dtype=like.dtype, device=like.device)
+        return K[:2, :2].diagonal(), K[:2, 2]
+
+    def _fisheye_center(self, like: torch.Tensor) -> torch.Tensor:
+        # The fisheye undistortion maps are centred on the image, not the principal
+        # point.
+        width, height = self.image_size
+        return like.new_tensor([width // 2, height // 2])
+
+    def _radial_tangential(self, xy: torch.Tensor):
+        """
+        Radial `[N, 1]` and tangential `[N, 2]` distortion of normalized camera
+        coordinates `[N, 2]`, distorted as `xy * radial + tangential`.
+        """
+        r2 = (xy**2).sum(dim=-1, keepdim=True)
+        if self.camtype == "fisheye":
+            k1, k2, k3, k4 = self.params.tolist()
+            radial = 1 + r2 * (k1 + r2 * (k2 + r2 * (k3 + r2 * k4)))
+            return radial, torch.zeros_like(xy)
+        k1, k2, p1, p2 = self.params.tolist()
+        x, y = xy.unbind(dim=-1)
+        r2_flat = r2[..., 0]
+        tangential = torch.stack(
+            [
+                2 * p1 * x * y + p2 * (r2_flat + 2 * x**2),
+                p1 * (r2_flat + 2 * y**2) + 2 * p2 * x * y,
+            ],
+            dim=-1,
+        )
+        return 1 + r2 * (k1 + r2 * k2), tangential
+
+    def distort(self, pixels: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            pixels: Pinhole pixel coordinates `[N, 2]`.
+
+        Returns:
+            Pixel coordinates in the distorted image `[N, 2]`.
+        """
+        focal, principal_point = self._intrinsics(pixels)
+        xy = (pixels - principal_point) / focal
+        radial, tangential = self._radial_tangential(xy)
+        distorted = xy * radial + tangential
+        if self.camtype == "fisheye":
+            return focal * distorted + self._fisheye_center(pixels)
+        return focal * distorted + principal_point
+
+    def undistort(self, pixels: torch.Tensor) -> torch.Tensor:
+        """
+        Inverse of `distort`, computed iteratively.
+
+        Args:
+            pixels: Pixel coordinates in the distorted image `[N, 2]`.
+
+        Returns:
+            Pinhole pixel coordinates `[N, 2]`.
+        """
+        focal, principal_point = self._intrinsics(pixels)
+        if self.camtype == "fisheye":
+            distorted = (pixels - self._fisheye_center(pixels)) / focal
+            # The fisheye model only scales the radius theta, so theta is found
+            # with Newton's method for theta * (1 + k1 theta^2 + ...) = rho.
+            k1, k2, k3, k4 = self.params.tolist()
+            rho = distorted.norm(dim=-1, keepdim=True)
+            theta = rho.clone()
+            for _ in range(_UNDISTORT_ITERATIONS):
+                t2 = theta**2
+                f = theta * (1 + t2 * (k1 + t2 * (k2 + t2 * (k3 + t2 * k4))))
+                df = 1 + t2 * (3 * k1 + t2 * (5 * k2 + t2 * (7 * k3 + t2 * 9 * k4)))
+                theta = theta - (f - rho) / df
+            scale = torch.where(rho > 0, theta / rho.clamp(min=1e-12), 1.0)
+            return focal * distorted * scale + principal_point
+
+        # Fixed point iteration, like OpenCV's undistortPoints.
+        distorted = (pixels - principal_point) / focal
+        xy = distorted.clone()
+        for _ in range(_UNDISTORT_ITERATIONS):
+            radial, tangential = self._radial_tangential(xy)
+            xy = (distorted - tangential) / radial
+        return focal * xy + principal_point
@@ -0,0 +1,148 @@
+"""
+Image metadata (size and EXIF focal length) read from the image file headers only,
+without decoding the images.
+
+Directories are probed on a thread pool. The result is kept for the process and
+cached on disk (next to the parser cache, see `parser_cache`), so later probes only
+stat the files and read the headers of files whose modification time or size
+changed.
+"""
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+from .parser_cache import read_cache_entry, write_json_atomic
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bump whenever the probed metadata changes.
+IMAGE_METADATA_VERSION = 2
+
+_DEFAULT_NUM_THREADS = min(16, 4 * (os.cpu_count() or 1))
+
+
+class ImageMetadata(NamedTuple):
+    width: int
+    height: int
+    focal_35mm: Optional[float] = None
+    """ 35mm film equivalent focal length from the EXIF data, if available. """
+
+
+def probe_image(path: str) -> Optional[ImageMetadata]:
+    """
+    Reads the metadata of an image from its header.
+
+    Returns:
+        The metadata, or None if the file isn't an image PIL can identify.
+    """
+    try:
+        # PIL only reads the header (including the EXIF data of JPEGs) on open.
+        with Image.open(path) as image:
+            width, height = image.size
+            exif = image.getexif().get_ifd(ExifTags.IFD.Exif)
+    except (OSError, UnidentifiedImageError):
+        return None
+    focal_35mm = exif.get(ExifTags.Base.FocalLengthIn35mmFilm)
+    if focal_35mm is not None and float(focal_35mm) > 0:
+        return ImageMetadata(width, height, float(focal_35mm))
+    return ImageMetadata(width, height)
+
+
+def probe_images(
+    paths: Sequence[str], num_threads: int = _DEFAULT_NUM_THREADS
+) -> List[Optional[ImageMetadata]]:
+    """`probe_image` of all `paths`, on `num_threads` threads."""
+    with ThreadPoolExecutor(num_threads) as pool:
+        return list(pool.map(probe_image, paths))
+
+
+def scan_directory(image_dir: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Modification times and sizes of all files in `image_dir` (recursively), keyed by
+    their path relative to it.
+    """
+    files = {}
+    for dp, _, fn in os.walk(image_dir):
+        rel_dir = os.path.relpath(dp, image_dir)
+        for f in fn:
+            stat = os.stat(os.path.join(dp, f))
+            files[os.path.normpath(os.path.join(rel_dir, f))] = (
+                stat.st_mtime_ns,
+                stat.st_size,
+            )
+    return files
+
+
+# Directories probed by this process, absolute path -> (files, metadata).
+_PROBED: Dict[
+    str, Tuple[Dict[str, Tuple[int, int]], Dict[str, Optional[ImageMetadata]]]
+] = {}
+
+
+def probe_directory(
+    image_dir: str,
+    cache_dir: Optional[str] = None,
+    num_threads: int = _DEFAULT_NUM_THREADS,
+    files: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> Dict[str, Optional[ImageMetadata]]:
+    """
+    Metadata of all files in `image_dir` (recursively), keyed by their path relative
+    to it. Files which aren't images have None metadata.
+
+    Only files whose modification time or size changed since the directory was last
+    probed by this process (or cached in `cache_dir`, if set) are probed again.
+
+    Args:
+        files: `scan_directory` of `image_dir`, if the caller already listed it.
+    """
+    image_dir = os.path.abspath(image_dir)
+    if files is None:
+        files = scan_directory(image_dir)
+    previous_files, previous = _PROBED.get(image_dir, ({}, {}))
+
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(image_dir.encode()).hexdigest()[:16]
+        cache_path = Path(cache_dir) / f"image_metadata_{digest}.json"
+        if image_dir not in _PROBED:
+            entry = read_cache_entry(cache_path, {"version": IMAGE_METADATA_VERSION})
+            if entry is not None:
+                previous_files = {
+                    path: tuple(stat) for path, stat in entry["files"].items()
+                }
+                previous = {
+                    path: ImageMetadata(*values) if values is not None else None
+                    for path, values in entry["metadata"].items()
+                }
+
+    metadata = {}
+    to_probe = []
+    for path, stat in files.items():
+        if previous_files.get(path) == stat:
+            metadata[path] = previous[path]
+        else:
+            to_probe.append(path)
+    if to_probe:
+        probed = probe_images(
+            [os.path.join(image_dir, f) for f in to_probe], num_threads
+        )
+        metadata.update(zip(to_probe, probed))
+    _PROBED[image_dir] = (files, metadata)
+
+    if cache_path is None or (files == previous_files and cache_path.exists()):
+        return metadata
+    write_json_atomic(
+        cache_path,
+        {
+            "fingerprint": {"version": IMAGE_METADATA_VERSION},
+            "files": files,
+            "metadata": metadata,
+        },
+    )
+    return metadata
@@ -0,0 +1,99 @@
+"""
+Store of decoded (and undistorted) images in a single memory-mapped uint8 file.
+
+Images are decoded once and read back as views into the memory map, so all DataLoader
+workers and the monocular depth initialization share the page cache instead of
+decoding every image on every access. The file is written next to the parser cache
+(see `parser_cache`) and is rebuilt whenever the parser inputs change.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .parser_cache import read_cache_entry, write_json_atomic
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bump whenever the stored images or their layout change.
+IMAGE_STORE_VERSION = 1
+
+
+class ImageStore:
+    """
+    Read-only sequence of `[H, W, 3]` uint8 images stored back to back in one file.
+
+    Images are returned as copy-on-write views into the memory map, so they can be
+    modified without affecting the file or other processes.
+    """
+
+    def __init__(self, path: Path, offsets: List[int], shapes: List[Tuple[int, ...]]):
+        self.path = Path(path)
+        self.offsets = offsets
+        self.shapes = [tuple(shape) for shape in shapes]
+        self._data: Optional[np.memmap] = None
+
+    @classmethod
+    def open_or_build(
+        cls,
+        cache_dir: str,
+        name: str,
+        fingerprint: Dict[str, Any],
+        num_images: int,
+        load_image: Callable[[int], np.ndarray],
+        num_threads: int = min(8, os.cpu_count() or 1),
+    ) -> "ImageStore":
+        """
+        Opens store `name` if it was built from inputs with the same `fingerprint`,
+        otherwise builds it by calling `load_image` for all image indices (on
+        `num_threads` threads).
+        """
+        data_path = Path(cache_dir) / f"{name}.u8"
+        manifest_path = Path(cache_dir) / f"{name}.json"
+        fingerprint = {"store_version": IMAGE_STORE_VERSION, **fingerprint}
+
+        manifest = read_cache_entry(manifest_path, fingerprint)
+        if manifest is not None and data_path.exists():
+            return cls(data_path, manifest["offsets"], manifest["shapes"])
+
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_data_path = Path(cache_dir) / f"{name}.tmp.u8"
+        offsets: List[int] = []
+        shapes: List[Tuple[int, ...]] = []
+        offset = 0
+        _LOGGER.info(f"Decoding {num_images} images into {data_path}...")
+        with open(tmp_data_path, "wb") as f, ThreadPoolExecutor(num_threads) as pool:
+            for image in pool.map(load_image, range(num_images)):
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+                f.write(image.data)
+                offsets.append(offset)
+                shapes.append(image.shape)
+                offset += image.nbytes
+        os.replace(tmp_data_path, data_path)
+
+        # The manifest is written last, so it always refers to a complete file.
+        write_json_atomic(
+            manifest_path,
+            {"fingerprint": fingerprint, "offsets": offsets, "shapes": shapes},
+        )
+        return cls(data_path, offsets, shapes)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if self._data is None:
+            # Opened lazily, so every DataLoader worker maps the file itself.
+            self._data = np.memmap(self.path, dtype=np.uint8, mode="c")
+        shape = self.shapes[index]
+        start = self.offsets[index]
+        return self._data[start : start + int(np.prod(shape))].reshape(shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
@@ -1,5 +1,8 @@
 import numpy as np
 
+# Number of points processed at once by the chunked point cloud operations.
+_CHUNK_SIZE = 1 << 20
+
 
 def similarity_from_cameras(c2w, strict_scaling=False, center_method="focus"):
     """
@@ -63,15 +66,33 @@ def similarity_from_cameras(c2w, strict_scaling=False, center_method="focus"):
     return transform
 
 
-def align_principle_axes(point_cloud):
-    # Compute centroid
-    centroid = np.median(point_cloud, axis=0)
+def _median(point_cloud):
+    # Per axis, so that only one column is copied at a time.
+    return np.array([np.median(point_cloud[:, i]) for i in range(3)], np.float64)
 
-    # Translate point cloud to centroid
-    translated_point_cloud = point_cloud - centroid
 
-    # Compute covariance matrix
-    covariance_matrix = np.cov(translated_point_cloud, rowvar=False)
+def _covariance(point_cloud, centroid, chunk_size=_CHUNK_SIZE):
+    """
+    Covariance matrix of the points, accumulated in float64 over chunks of points
+    (shifted by `centroid` to avoid cancellation).
+    """
+    num_points = point_cloud.shape[0]
+    sum_ = np.zeros(3)
+    sum_outer = np.zeros((3, 3))
+    for start in range(0, num_points, chunk_size):
+        chunk = point_cloud[start : start + chunk_size].astype(np.float64)
+        chunk -= centroid
+        sum_ += chunk.sum(axis=0)
+        sum_outer += chunk.T @ chunk
+    return (sum_outer - np.outer(sum_, sum_) / num_points) / (num_points - 1)
+
+
+def align_principle_axes(point_cloud, chunk_size=_CHUNK_SIZE):
+    # Compute centroid
+    centroid = _median(point_cloud)
+
+    # Compute covariance matrix of the point cloud translated to the centroid
+    covariance_matrix = _covariance(point_cloud, centroid, chunk_size)
 
     # Compute eigenvectors and eigenvalues
     eigenvalues, eigenvectors = np.linalg.eigh(covariance_matrix)
@@ -112,6 +133,27 @@ def transform_points(matrix, points):
     return points @ matrix[:3, :3].T + matrix[:3, 3]
 
 
+def transform_points_inplace(matrix, points, chunk_size=_CHUNK_SIZE):
+    """Transform points using an SE(3) matrix in place.
+
+    Points are transformed in float64 in chunks of `chunk_size` points, so no
+    full size temporary arrays are allocated and float32 points stay float32.
+
+    Args:
+        matrix: 4x4 SE(3) matrix
+        points: Nx3 array of points, overwritten with the transformed points
+
+    Returns:
+        points
+    """
+    assert matrix.shape == (4, 4)
+    assert len(points.shape) == 2 and points.shape[1] == 3
+    for start in range(0, points.shape[0], chunk_size):
+        chunk = points[start : start + chunk_size]
+        chunk[:] = chunk.astype(np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+    return points
+
+
 def transform_cameras(matrix, camtoworlds):
     """Transform cameras using an SE(3) matrix.
 
@@ -141,3 +183,28 @@ def normalize(camtoworlds, points=None):
         return camtoworlds, points, T2 @ T1
     else:
         return camtoworlds, T1
+
+
+def normalize_inplace(camtoworlds, points=None, transform=None):
+    """
+    Like `normalize`, but `points` are transformed in place (see
+    `transform_points_inplace`). If `transform` is given, it is applied instead of
+    being estimated.
+
+    Returns:
+        Transformed cameras and the applied transform.
+    """
+    if transform is not None:
+        if points is not None:
+            transform_points_inplace(transform, points)
+        return transform_cameras(transform, camtoworlds), transform
+
+    T1 = similarity_from_cameras(camtoworlds)
+    camtoworlds = transform_cameras(T1, camtoworlds)
+    if points is None:
+        return camtoworlds, T1
+    transform_points_inplace(T1, points)
+    T2 = align_principle_axes(points)
+    camtoworlds = transform_cameras(T2, camtoworlds)
+    transform_points_inplace(T2, points)
+    return camtoworlds, T2 @ T1
@@ -0,0 +1,266 @@
+"""
+On-disk cache of the state of a COLMAP `Parser`.
+
+The state is stored as an uncompressed `.npz` file next to a JSON manifest. The
+manifest records the cache version and a fingerprint of the parser inputs (the
+sparse model files, image directories and metadata files, and the parser arguments),
+so the cache is ignored whenever any of them changes.
+
+Parsers of datasets loaded elsewhere (nerfbaselines) only cache their world space
+normalization transform, fingerprinted by the input poses and points.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .visibility import PointVisibility
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bump whenever the cached state or the parsing code changes.
+PARSER_CACHE_VERSION = 3
+
+# Parser attributes cached as single arrays.
+_ARRAY_FIELDS = [
+    "cam_to_worlds",
+    "points",
+    "points_err",
+    "points_rgb",
+    "transform",
+    "bounds",
+    "scene_scale",
+]
+# Parser attributes cached as lists of strings.
+_STRING_LIST_FIELDS = ["image_names", "image_paths"]
+# Parser attributes that are dicts from camera id to arrays or None.
+_CAMERA_DICT_FIELDS = [
+    "Ks_dict",
+    "params_dict",
+    "mask_dict",
+    "mapx_dict",
+    "mapy_dict",
+    "roi_undist_dict",
+    "Ks_distorted_dict",
+]
+
+
+def write_json_atomic(path: Path, data: Any):
+    """
+    Writes `data` as JSON to `path` through a temporary file, so readers never see
+    a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f"{path.stem}.tmp.json"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_cache_entry(path: Path, fingerprint: Any) -> Optional[Dict[str, Any]]:
+    """
+    Returns:
+        The JSON cache entry (manifest) at `path`, or None if it doesn't exist, is
+        unreadable or wasn't written with the same `fingerprint`.
+    """
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        _LOGGER.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+    if entry.get("fingerprint") != fingerprint:
+        return None
+    return entry
+
+
+def _file_fingerprint(path: Path) -> Optional[List[int]]:
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _directory_digest(files: Dict[str, Tuple[int, int]]) -> str:
+    return hashlib.sha1(json.dumps(sorted(files.items())).encode()).hexdigest()
+
+
+def parser_fingerprint(
+    data_dir: str,
+    colmap_dir: str,
+    factor: int,
+    normalize: bool,
+    image_dir_files: Dict[str, Dict[str, Tuple[int, int]]],
+) -> Dict[str, Any]:
+    """
+    Fingerprint of the inputs of a `Parser`: modification times and sizes of the
+    sparse model files, metadata files and all files in the image directories the
+    parser uses (so images overwritten in place are detected too), and the arguments
+    affecting the parsed state.
+
+    Args:
+        image_dir_files: Files of the used image directories, see
+            `image_metadata.scan_directory`.
+    """
+    data_path = Path(data_dir)
+    files = {
+        path.name: _file_fingerprint(path)
+        for path in sorted(Path(colmap_dir).iterdir())
+        if path.is_file()
+    }
+    for name in ["ext_metadata.json", "poses_bounds.npy"]:
+        files[name] = _file_fingerprint(data_path / name)
+    image_dirs = {
+        os.path.basename(image_dir): _directory_digest(files)
+        for image_dir, files in sorted(image_dir_files.items())
+    }
+    return {
+        "version": PARSER_CACHE_VERSION,
+        "factor": factor,
+        "normalize": normalize,
+        "files": files,
+        "image_dirs": image_dirs,
+    }
+
+
+def normalization_fingerprint(
+    camtoworlds: np.ndarray, points: Optional[np.ndarray]
+) -> Dict[str, Any]:
+    """Fingerprint of the inputs of the world space normalization."""
+    digest = hashlib.sha1(np.ascontiguousarray(camtoworlds).data)
+    if points is not None:
+        digest.update(np.ascontiguousarray(points).data)
+    return {"version": PARSER_CACHE_VERSION, "digest": digest.hexdigest()}
+
+
+def save_normalization_transform(
+    transform: np.ndarray, cache_dir: str, name: str, fingerprint: Dict[str, Any]
+):
+    """Saves a world space normalization transform as cache entry `name`."""
+    write_json_atomic(
+        Path(cache_dir) / f"{name}_transform.json",
+        {"fingerprint": fingerprint, "transform": transform.tolist()},
+    )
+
+
+def load_normalization_transform(
+    cache_dir: str, name: str, fingerprint: Dict[str, Any]
+) -> Optional[np.ndarray]:
+    """
+    Returns:
+        The transform of cache entry `name`, or None if it doesn't exist or doesn't
+        match `fingerprint`.
+    """
+    entry = read_cache_entry(Path(cache_dir) / f"{name}_transform.json", fingerprint)
+    if entry is None:
+        return None
+    return np.array(entry["transform"])
+
+
+def _cache_paths(cache_dir: str, name: str):
+    return Path(cache_dir) / f"{name}.npz", Path(cache_dir) / f"{name}.json"
+
+
+def save_parser_state(parser, cache_dir: str, name: str, fingerprint: Dict[str, Any]):
+    """Saves the state of `parser` as cache entry `name`."""
+    arrays_path, manifest_path = _cache_paths(cache_dir, name)
+    arrays_path.parent.mkdir(parents=True, exist_ok=True)
+
+    arrays: Dict[str, np.ndarray] = {}
+    for field in _ARRAY_FIELDS:
+        arrays[field] = np.asarray(getattr(parser, field))
+    for field in _STRING_LIST_FIELDS:
+        arrays[field] = np.array(getattr(parser, field), dtype=str)
+    arrays["camera_ids"] = np.array(parser.camera_ids, dtype=np.int64)
+
+    camera_dicts: Dict[str, List[int]] = {}
+    for field in _CAMERA_DICT_FIELDS:
+        values = getattr(parser, field)
+        camera_dicts[field] = [int(camera_id) for camera_id in values]
+        for camera_id, value in values.items():
+            if value is not None:
+                arrays[f"{field}/{camera_id}"] = np.asarray(value)
+    imsize_dict = {
+        str(camera_id): [int(v) for v in size]
+        for camera_id, size in parser.imsize_dict.items()
+    }
+
+    visibility: PointVisibility = parser.point_indices
+    arrays["point_indices_names"] = np.array(visibility.image_names, dtype=str)
+    arrays["point_indices_offsets"] = visibility.offsets
+    arrays["point_indices"] = visibility.indices
+
+    manifest = {
+        "fingerprint": fingerprint,
+        "camtype": parser.camtype,
+        "camera_dicts": camera_dicts,
+        "imsize_dict": imsize_dict,
+        "exif_focals_35mm": parser.exif_focals_35mm,
+    }
+    # Write to temporary files first, so a valid manifest always refers to a
+    # complete array file.
+    tmp_arrays_path = arrays_path.parent / f"{name}.tmp.npz"
+    np.savez(tmp_arrays_path, **arrays)
+    os.replace(tmp_arrays_path, arrays_path)
+    write_json_atomic(manifest_path, manifest)
+
+
+def load_parser_state(
+    parser, cache_dir: str, name: str, fingerprint: Dict[str, Any]
+) -> bool:
+    """
+    Restores the state of `parser` from cache entry `name`.
+
+    Returns:
+        Whether the entry exists and matches `fingerprint`.
+    """
+    arrays_path, manifest_path = _cache_paths(cache_dir, name)
+    manifest = read_cache_entry(manifest_path, fingerprint)
+    if manifest is None or not arrays_path.exists():
+        return False
+
+    with np.load(arrays_path, allow_pickle=False) as arrays:
+        for field in _ARRAY_FIELDS:
+            setattr(parser, field, arrays[field])
+        parser.scene_scale = parser.scene_scale.item()
+        for field in _STRING_LIST_FIELDS:
+            setattr(parser, field, arrays[field].tolist())
+        parser.camera_ids = arrays["camera_ids"].tolist()
+
+        for field, camera_ids in manifest["camera_dicts"].items():
+            setattr(
+                parser,
+                field,
+                {
+                    camera_id: (
+                        arrays[f"{field}/{camera_id}"]
+                        if f"{field}/{camera_id}" in arrays
+                        else None
+                    )
+                    for camera_id in camera_ids
+                },
+            )
+        parser.roi_undist_dict = {
+            camera_id: roi.tolist() for camera_id, roi in parser.roi_undist_dict.items()
+        }
+        parser.imsize_dict = {
+            int(camera_id): tuple(size)
+            for camera_id, size in manifest["imsize_dict"].items()
+        }
+
+        parser.point_indices = PointVisibility(
+            arrays["point_indices_names"].tolist(),
+            arrays["point_indices_offsets"],
+            arrays["point_indices"],
+            num_points=len(parser.points),
+        )
+    parser.camtype = manifest["camtype"]
+    parser.exif_focals_35mm = manifest["exif_focals_35mm"]
+    return True
@@ -0,0 +1,120 @@
+from typing import Iterator, List, Mapping, Optional, Sequence
+
+import numpy as np
+import scipy.sparse
+
+
+class PointVisibility(Mapping[str, np.ndarray]):
+    """
+    Which SfM points are visible in which image, in compressed sparse row (CSR) form:
+    the indices of the points visible in image `i` are
+    `indices[offsets[i] : offsets[i + 1]]`.
+
+    Behaves like a read-only dict from image name to the indices of the points visible
+    in it (views into `indices`), which is how the parsers exposed it originally.
+    """
+
+    def __init__(
+        self,
+        image_names: Sequence[str],
+        offsets: np.ndarray,
+        indices: np.ndarray,
+        num_points: Optional[int] = None,
+    ):
+        """
+        Args:
+            image_names: Names of the images, `[I]`.
+            offsets: Start of each image's point indices in `indices`, `[I + 1]`.
+            indices: Point indices of all images, `[offsets[-1]]`.
+            num_points: Total number of SfM points, inferred from `indices` if None.
+        """
+        if len(offsets) != len(image_names) + 1 or offsets[-1] != len(indices):
+            raise ValueError("Offsets don't match the image names and indices.")
+        self.image_names: List[str] = list(image_names)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.num_points = (
+            int(self.indices.max(initial=-1)) + 1 if num_points is None else num_points
+        )
+        self._image_index = {name: i for i, name in enumerate(self.image_names)}
+        self._point_offsets: Optional[np.ndarray] = None
+        self._point_images: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_arrays(
+        cls,
+        image_names: Sequence[str],
+        point_indices: Sequence[np.ndarray],
+        num_points: Optional[int] = None,
+    ) -> "PointVisibility":
+        """Builds the CSR structure from per-image arrays of point indices."""
+        offsets = np.zeros(len(point_indices) + 1, dtype=np.int64)
+        np.cumsum([len(indices) for indices in point_indices], out=offsets[1:])
+        indices = (
+            np.concatenate(point_indices)
+            if len(point_indices) > 0
+            else np.zeros(0, dtype=np.int32)
+        )
+        return cls(image_names, offsets, indices, num_points)
+
+    def image_index(self, image_name: str) -> int:
+        return self._image_index[image_name]
+
+    def __getitem__(self, image_name: str) -> np.ndarray:
+        i = self._image_index[image_name]
+        return self.indices[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.image_names)
+
+    def __len__(self) -> int:
+        return len(self.image_names)
+
+    def __contains__(self, image_name: object) -> bool:
+        return image_name in self._image_index
+
+    def counts(self) -> np.ndarray:
+        """Number of points visible in each image, `[I]`."""
+        return np.diff(self.offsets)
+
+    def image_of_entries(self) -> np.ndarray:
+        """Image index of each entry of `indices`, `[offsets[-1]]`."""
+        return np.repeat(np.arange(len(self.image_names)), self.counts())
+
+    def _build_reverse_index(self):
+        order = np.argsort(self.indices, kind="stable")
+        self._point_images = self.image_of_entries()[order].astype(np.int32)
+        self._point_offsets = np.zeros(self.num_points + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.indices, minlength=self.num_points),
+            out=self._point_offsets[1:],
+        )
+
+    def images_of_point(self, point_index: int) -> np.ndarray:
+        """Indices of the images the point is visible in (reverse index)."""
+        if self._point_offsets is None:
+            self._build_reverse_index()
+        start, end = self._point_offsets[point_index : point_index + 2]
+        return self._point_images[start:end]
+
+    def track_lengths(self) -> np.ndarray:
+        """Number of images each point is visible in, `[num_points]`."""
+        return np.bincount(self.indices, minlength=self.num_points)
+
+    def incidence_matrix(self) -> scipy.sparse.csr_matrix:
+        """Sparse `[I, num_points]` matrix with ones where a point is visible."""
+        return scipy.sparse.csr_matrix(
+            (np.ones(len(self.indices), dtype=np.float32), self.indices, self.offsets),
+            shape=(len(self.image_names), self.num_points),
+        )
+
+    def covisibility(self) -> scipy.sparse.csr_matrix:
+        """
+        Co-visibility graph of the images, a sparse `[I, I]` matrix of the number of
+        points each pair of images shares, with zero diagonal.
+        """
+        incidence = self.incidence_matrix()
+        shared = (incidence @ incidence.T).tocsr()
+        shared -= scipy.sparse.diags(shared.diagonal())
+        shared.eliminate_zeros()
+        return shared.astype(np.int64)
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class TsdfFusionConfig:
+    """
+    Configures fusion of aligned depth maps into a sparse truncated signed distance
+    volume, from which the init point cloud is extracted.
+    """
+
+    # Voxel side length as a fraction of the scene extent. Surface points are
+    # extracted at roughly this spacing.
+    voxel_size_wrt_scene_extent: float = 2e-3
+    # Truncation distance of the signed distance, in voxels. Should cover the
+    # remaining depth noise after alignment.
+    truncation_voxels: float = 4.0
+    # Aligned depth maps are integrated with samples spaced at most the voxel size
+    # divided by this apart (at their depth), --mdi.subsample-factor is ignored.
+    samples_per_voxel: float = 2.0
+    # Voxels observed by fewer rays are ignored when extracting surface points.
+    min_weight: float = 1.0
+    # Voxels observed by fewer views are ignored when extracting surface points,
+    # which drops surfaces (and depth artifacts) no other view confirms. Set to 1
+    # if views barely overlap.
+    min_views: int = 2
+    # Upper bound on the number of signed distance samples integrated at once.
+    max_chunk_elements: int = 2**24
+
+
+@dataclass
+class DepthConsistencyConfig:
+    """
+    Configures filtering of points whose aligned depth is not confirmed by other
+    views. Each view's points are projected into the views sharing most SfM points
+    with it and compared to their aligned depth.
+    """
+
+    # Number of neighbouring views each view's points are checked against.
+    num_neighbours: int = 4
+    # Points are kept if their depth agrees with at least this many neighbours.
+    min_consistent_views: int = 1
+    # Relative depth difference up to which a neighbour's depth agrees.
+    depth_tolerance: float = 0.05
+    # Aligned depth maps are kept downscaled to this size of their longer side.
+    resolution: int = 256
@@ -0,0 +1,172 @@
+"""
+Multi-view consistency filtering of points unprojected from aligned monocular depth.
+
+A point is confirmed by a neighbouring view if its depth in that view agrees with the
+view's own aligned depth at the pixel it projects to. Flying pixels at depth
+discontinuities and views with misaligned depth are not confirmed by other views.
+"""
+
+from typing import Dict, List, Mapping, Optional, Sequence, Set
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.datasets.distortion import CameraDistortion
+from gs_init_compare.datasets.visibility import PointVisibility
+
+from .config import DepthConsistencyConfig
+
+
+def select_neighbour_views(
+    point_indices: Mapping[str, np.ndarray], image_names: Sequence[str], k: int
+) -> Dict[str, List[str]]:
+    """
+    Selects for each image the (at most) `k` other images that share the most SfM
+    points with it, ignoring images that share none.
+
+    Args:
+        point_indices: Indices of SfM points visible in each image.
+        image_names: Images to select from.
+    """
+    shared = (
+        PointVisibility.from_arrays(
+            image_names, [point_indices[name] for name in image_names]
+        )
+        .covisibility()
+        .toarray()
+    )
+
+    neighbours = {}
+    for i, name in enumerate(image_names):
+        order = np.argsort(-shared[i], kind="stable")[:k]
+        neighbours[name] = [image_names[j] for j in order if shared[i, j] > 0]
+    return neighbours
+
+
+class DepthConsistencyFilter:
+    """
+    Collects the aligned depth maps of the views (downscaled) and filters each view's
+    points by projecting them into its neighbouring views. Neighbours are selected
+    upfront, so a view can be filtered as soon as all of its neighbours are added
+    (or skipped, if their depth couldn't be aligned).
+
+    Usage:
+        filter = DepthConsistencyFilter(parser.point_indices, config, image_names)
+        for each view:
+            filter.add_view(image_name, aligned_depth, valid_mask, K, cam2world)
+            (or filter.skip_view(image_name))
+            for each view with points, once filter.is_ready(image_name):
+                pts = pts[filter.consistent(image_name, pts)]
+    """
+
+    def __init__(
+        self,
+        point_indices: Mapping[str, np.ndarray],
+        config: DepthConsistencyConfig,
+        image_names: Sequence[str],
+    ):
+        """
+        Args:
+            image_names: Views that will be added, neighbours are selected from them.
+        """
+        self.config = config
+        self._depths: Dict[str, torch.Tensor] = {}
+        self._projections: Dict[str, torch.Tensor] = {}
+        self._scales: Dict[str, torch.Tensor] = {}
+        self._distortions: Dict[str, Optional[CameraDistortion]] = {}
+        self._neighbours = select_neighbour_views(
+            point_indices, image_names, config.num_neighbours
+        )
+        self._done: Set[str] = set()
+
+    def add_view(
+        self,
+        image_name: str,
+        aligned_depth: torch.Tensor,
+        valid_mask: torch.Tensor,
+        K: torch.Tensor,
+        cam2world: torch.Tensor,
+        distortion: Optional[CameraDistortion] = None,
+    ):
+        """
+        Args:
+            aligned_depth: Aligned depth `[H, W]`.
+            valid_mask: Mask `[H, W]` of valid depth values.
+            K: Camera intrinsics `[3, 3]`.
+            cam2world: Camera to world transform `[4, 4]`.
+            distortion: Distortion model, if the depth is of a distorted image.
+        """
+        height, width = aligned_depth.shape
+        scale = self.config.resolution / max(height, width)
+        size = (max(1, round(height * scale)), max(1, round(width * scale)))
+        depth = torch.where(valid_mask, aligned_depth.float(), torch.nan)
+        # Nearest neighbour downscaling, averaging would create depths in between
+        # surfaces at discontinuities.
+        depth = F.interpolate(depth[None, None], size=size, mode="nearest-exact")[0, 0]
+
+        w2c = torch.linalg.inv(cam2world.float().cpu())
+        self._depths[image_name] = depth.half().cpu()
+        # Points are projected at full resolution (where the distortion model
+        # applies), then scaled to the downscaled depth map.
+        self._projections[image_name] = K.float().cpu() @ w2c[:3]
+        self._scales[image_name] = torch.tensor([size[1] / width, size[0] / height])
+        self._distortions[image_name] = distortion
+        self._done.add(image_name)
+
+    def skip_view(self, image_name: str):
+        """Marks a view that won't be added, its neighbours are checked without it."""
+        self._done.add(image_name)
+
+    def is_ready(self, image_name: str) -> bool:
+        """Whether all neighbours of the view were added or skipped."""
+        return all(name in self._done for name in self._neighbours[image_name])
+
+    def consistent(self, image_name: str, pts: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            image_name: View the points were unprojected from, which must be ready.
+            pts: World space points `[N, 3]`.
+
+        Returns:
+            Mask `[N]` of points whose depth agrees with at least
+            `config.min_consistent_views` neighbouring views.
+        """
+        if not self.is_ready(image_name):
+            raise RuntimeError(f"Neighbours of view {image_name} weren't all added.")
+        neighbours = [n for n in self._neighbours[image_name] if n in self._depths]
+        num_consistent = pts.new_zeros(pts.shape[0], dtype=torch.int32)
+        if len(neighbours) == 0:
+            return num_consistent >= self.config.min_consistent_views
+
+        # All neighbours are checked at once, padding the depth maps to a common size.
+        height = max(self._depths[name].shape[0] for name in neighbours)
+        width = max(self._depths[name].shape[1] for name in neighbours)
+        depths = torch.full(
+            (len(neighbours), height, width), torch.nan, device=pts.device
+        )
+        for i, name in enumerate(neighbours):
+            depth = self._depths[name]
+            depths[i, : depth.shape[0], : depth.shape[1]] = depth.to(pts.device)
+        projections = torch.stack([self._projections[n] for n in neighbours])
+        projections = projections.to(pts.device)
+        scales = torch.stack([self._scales[n] for n in neighbours]).to(pts.device)
+
+        projected = pts @ projections[:, :, :3].transpose(1, 2)
+        projected += projections[:, None, :, 3]
+        z = projected[..., 2]
+        coords = projected[..., :2] / z[..., None]
+        for i, name in enumerate(neighbours):
+            if self._distortions[name] is not None:
+                coords[i] = self._distortions[name].distort(coords[i])
+        coords = torch.floor(coords * scales[:, None]).long()
+        cols, rows = coords[..., 0], coords[..., 1]
+        inside = (z > 0) & (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+        pixels = (rows * width + cols).where(inside, 0)
+        observed = torch.gather(depths.view(len(neighbours), -1), 1, pixels)
+
+        # Comparisons with NaN depths (invalid or padding) are false.
+        error = (z - observed).abs()
+        agrees = inside & (error <= self.config.depth_tolerance * observed)
+        num_consistent += agrees.sum(dim=0, dtype=torch.int32)
+        return num_consistent >= self.config.min_consistent_views
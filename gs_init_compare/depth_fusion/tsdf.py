@@ -0,0 +1,173 @@
+"""
+Fusion of aligned depth maps into a sparse truncated signed distance (TSDF) volume.
+
+Each depth sample is integrated along its camera ray: the voxels within the truncation
+distance in front of and behind the sample get the signed distance of their center to
+the plane through the sample (perpendicular to its normal, positive on the camera
+side), along with the sample's colour and normal. Voxels are hashed by
+`sparse_voxel_keys` and accumulated with torch operations on the samples' device.
+Besides the sample weights, the number of distinct views observing each voxel is
+counted, so that surfaces seen by a single view can be left out.
+"""
+
+import math
+from typing import List, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.utils.spatial_hash import (
+    DEFAULT_MAX_CHUNK_ELEMENTS,
+    sparse_voxel_centers,
+    sparse_voxel_keys,
+)
+
+# Columns of accumulated voxel values, weighted by the sample weights except for
+# the number of views.
+_WEIGHT = 0
+_SDF = 1
+_RGB = slice(2, 5)
+_NORMAL = slice(5, 8)
+_VIEWS = 8
+_NUM_VALUES = 9
+
+
+def _reduce_by_key(
+    keys: torch.Tensor, values: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Sums values `[N, C]` with equal keys `[N]`, returns sorted unique keys."""
+    unique_keys, inverse = torch.unique(keys, return_inverse=True)
+    sums = values.new_zeros((unique_keys.shape[0], values.shape[1]))
+    return unique_keys, sums.index_add_(0, inverse, values)
+
+
+class TsdfVolume:
+    """
+    Sparse TSDF volume of a grid anchored at the origin, which is updated as the
+    depth samples of each view are integrated.
+
+    Accumulated voxels are kept in runs sorted by key, of geometrically decreasing
+    size, the last runs are merged whenever a new run would be similarly large.
+    """
+
+    def __init__(
+        self,
+        voxel_size: float,
+        truncation: float,
+        max_chunk_elements: int = DEFAULT_MAX_CHUNK_ELEMENTS,
+    ):
+        if truncation < voxel_size:
+            raise ValueError("Truncation distance must be at least the voxel size.")
+        self.voxel_size = voxel_size
+        self.truncation = truncation
+        self.max_chunk_elements = max_chunk_elements
+        self._runs: List[Tuple[torch.Tensor, torch.Tensor]] = []
+
+    @property
+    def num_voxels(self) -> int:
+        """Upper bound on the number of observed voxels, runs may share voxels."""
+        return sum(keys.shape[0] for keys, _ in self._runs)
+
+    def integrate(
+        self,
+        pts: torch.Tensor,
+        rgbs: torch.Tensor,
+        normals: torch.Tensor,
+        camera_center: torch.Tensor,
+    ):
+        """
+        Integrates the depth samples of a single view, each view must be integrated
+        by one call.
+
+        Args:
+            pts: World space depth samples `[N, 3]` of the view.
+            rgbs: Their colours `[N, 3]`.
+            normals: Their unit normals `[N, 3]`, facing the camera.
+            camera_center: World space position of the camera `[3]`.
+        """
+        num_steps = 2 * math.ceil(self.truncation / self.voxel_size) + 1
+        offsets = torch.linspace(
+            -self.truncation, self.truncation, num_steps, device=pts.device
+        )
+        dirs = F.normalize(pts - camera_center.to(pts), dim=-1)
+        chunk_size = max(1, self.max_chunk_elements // num_steps)
+
+        keys_list: List[torch.Tensor] = []
+        values_list: List[torch.Tensor] = []
+        for start in range(0, pts.shape[0], chunk_size):
+            chunk = slice(start, start + chunk_size)
+            p, n = pts[chunk, None], normals[chunk, None]
+            samples = p + offsets[:, None] * dirs[chunk, None]
+            keys, in_grid = sparse_voxel_keys(samples, self.voxel_size)
+            # Consecutive samples of a ray may fall into the same voxel.
+            in_grid[:, 1:] &= keys[:, 1:] != keys[:, :-1]
+
+            centers = sparse_voxel_centers(keys, self.voxel_size)
+            sdf = ((centers - p) * n).sum(dim=-1)
+            sdf = sdf.clamp(-self.truncation, self.truncation)
+            values = torch.cat(
+                [
+                    torch.ones_like(sdf)[..., None],
+                    sdf[..., None],
+                    rgbs[chunk, None].expand(-1, num_steps, -1),
+                    n.expand(-1, num_steps, -1),
+                    torch.ones_like(sdf)[..., None],
+                ],
+                dim=-1,
+            )
+            chunk_keys, chunk_values = _reduce_by_key(keys[in_grid], values[in_grid])
+            keys_list.append(chunk_keys)
+            values_list.append(chunk_values)
+
+        if len(keys_list) == 0:
+            return
+        keys, values = (
+            _reduce_by_key(torch.cat(keys_list), torch.cat(values_list))
+            if len(keys_list) > 1
+            else (keys_list[0], values_list[0])
+        )
+        values[:, _VIEWS] = 1
+        self._runs.append((keys, values))
+        while (
+            len(self._runs) > 1
+            and self._runs[-2][0].shape[0] <= 2 * self._runs[-1][0].shape[0]
+        ):
+            keys, values = self._runs.pop()
+            prev_keys, prev_values = self._runs[-1]
+            self._runs[-1] = _reduce_by_key(
+                torch.cat([prev_keys, keys]), torch.cat([prev_values, values])
+            )
+
+    def extract_points(
+        self, min_weight: float = 1.0, min_views: int = 1
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Extracts a point from each voxel whose center is within half a voxel of the
+        fused surface, by projecting the center onto the surface along the fused
+        normal. This gives about one point per voxel size squared of surface area.
+
+        Args:
+            min_weight: Voxels with a lower total sample weight are ignored.
+            min_views: Voxels observed by fewer views are ignored.
+
+        Returns:
+            Points `[M, 3]`, their colours `[M, 3]` and unit normals `[M, 3]`.
+        """
+        if len(self._runs) == 0:
+            empty = torch.zeros((0, 3))
+            return empty, empty, empty
+        keys = torch.cat([keys for keys, _ in self._runs])
+        values = torch.cat([values for _, values in self._runs])
+        if len(self._runs) > 1:
+            keys, values = _reduce_by_key(keys, values)
+
+        weights = values[:, _WEIGHT]
+        sdf = values[:, _SDF] / weights
+        surface = (weights >= min_weight) & (values[:, _VIEWS] >= min_views)
+        surface &= sdf.abs() < self.voxel_size / 2
+        values, weights, sdf = values[surface], weights[surface, None], sdf[surface]
+
+        normals = F.normalize(values[:, _NORMAL], dim=-1)
+        centers = sparse_voxel_centers(keys[surface], self.voxel_size)
+        pts = centers - sdf[:, None] * normals
+        return pts, values[:, _RGB] / weights, normals
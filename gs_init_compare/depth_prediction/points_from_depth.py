@@ -1,10 +1,14 @@
 import logging
+import math
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 from gs_init_compare.datasets.colmap import Parser
+from gs_init_compare.datasets.distortion import CameraDistortion
 from gs_init_compare.depth_alignment import (
     DepthAlignmentStrategyEnum,
     DepthAlignmentStrategy,
@@ -17,12 +21,20 @@ from gs_init_compare.depth_subsampling.interface import DepthSubsampler
 from gs_init_compare.nerfbaselines_integration.method import (
     gs_Parser as NerfbaselinesParser,
 )
+from gs_init_compare.depth_fusion.consistency import DepthConsistencyFilter
+from gs_init_compare.depth_prediction.utils.image_filtering import gaussian_filter2d
 from gs_init_compare.depth_prediction.utils.point_cloud_export import (
+    BackgroundWriter,
     export_point_cloud_to_ply,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+# Side of the pixel blocks in which depth samples are counted to estimate their spacing.
+_SPACING_BLOCK_SIZE = 8
+# Standard deviation (in blocks) of the Gaussian smoothing the sample counts.
+_SPACING_SIGMA_BLOCKS = 2.0
+
 
 class LowDepthAlignmentConfidenceError(Exception):
     pass
@@ -135,7 +147,13 @@ def get_valid_sfm_pts(sfm_pts_camera, sfm_pts_camera_depth, mask, imsize):
 
 
 def align_depth(
-    sfm_points, P, imsize, depth, mask, strategy: DepthAlignmentStrategy
+    sfm_points,
+    P,
+    imsize,
+    depth,
+    mask,
+    strategy: DepthAlignmentStrategy,
+    distortion: Optional[CameraDistortion] = None,
 ) -> DepthAlignmentParams:
     device = sfm_points.device
 
@@ -144,6 +162,8 @@ def align_depth(
     )
     sfm_points_depth = sfm_points_camera[2]
     sfm_points_camera = sfm_points_camera[:2] / sfm_points_camera[2]
+    if distortion is not None:
+        sfm_points_camera = distortion.distort(sfm_points_camera.T).T
 
     sfm_points_camera = torch.round(sfm_points_camera).to(int)
     sfm_points_camera, sfm_points_depth = get_valid_sfm_pts(
@@ -153,6 +173,88 @@ def align_depth(
     return strategy.estimate_alignment(predicted_depth, sfm_points_depth)
 
 
+def sample_spacing(
+    subsampling_mask: torch.Tensor, image_size: Tuple[int, int]
+) -> torch.Tensor:
+    """
+    Estimates the local distance between sampled pixels, in pixels, for any
+    subsampler. Samples are counted in blocks and the counts are smoothed with a
+    Gaussian, normalized by the smoothed block areas so that image borders are not
+    biased. For a static subsample factor, this gives the factor.
+
+    Args:
+        subsampling_mask: Flat boolean mask of sampled pixels `[H * W]`.
+        image_size: `(H, W)`.
+
+    Returns:
+        Spacing at each sampled pixel, in the order of the mask `[N]`.
+    """
+    height, width = image_size
+    mask = subsampling_mask.view(1, 1, height, width).float()
+
+    def block_sums(values: torch.Tensor) -> torch.Tensor:
+        return F.avg_pool2d(
+            values, _SPACING_BLOCK_SIZE, ceil_mode=True, divisor_override=1
+        )
+
+    def smooth(values: torch.Tensor) -> torch.Tensor:
+        # Zero padding, so that the replicate padding of the filter sees no samples.
+        pad = math.ceil(3 * _SPACING_SIGMA_BLOCKS)
+        blurred = gaussian_filter2d(
+            F.pad(values, (pad, pad, pad, pad)), _SPACING_SIGMA_BLOCKS
+        )
+        return blurred[..., pad:-pad, pad:-pad]
+
+    density = smooth(block_sums(mask)) / smooth(block_sums(torch.ones_like(mask)))
+    rows, cols = torch.nonzero(mask[0, 0], as_tuple=True)
+    block_density = density[
+        0, 0, rows // _SPACING_BLOCK_SIZE, cols // _SPACING_BLOCK_SIZE
+    ]
+    return block_density.clamp(min=1.0 / (height * width)).rsqrt()
+
+
+def normals_from_depth(
+    depth: torch.Tensor,
+    K: torch.Tensor,
+    pixels: torch.Tensor,
+    distortion: Optional[CameraDistortion] = None,
+) -> torch.Tensor:
+    """
+    Estimates camera space surface normals at some pixels of a depth map from the
+    cross product of central differences of the unprojected depth (one-sided at
+    image borders).
+
+    Args:
+        depth: Depth map `[H, W]`.
+        K: Camera intrinsics `[3, 3]`.
+        pixels: Flat indices of the pixels `[N]`.
+        distortion: If set, the depth map is of a distorted image and pixels are
+            unprojected through the distortion model.
+
+    Returns:
+        Unit normals `[N, 3]`, not consistently oriented.
+    """
+    height, width = depth.shape
+    rows, cols = pixels // width, pixels % width
+    K_inv = torch.linalg.inv(K)
+
+    def unproject(r: torch.Tensor, c: torch.Tensor) -> torch.Tensor:
+        z = depth[r, c][:, None]
+        # Pixel centres, undistorted if the depth map is of a distorted image.
+        xy = torch.stack([c, r], dim=-1).to(z.dtype) + 0.5
+        if distortion is not None:
+            xy = distortion.undistort(xy)
+        return torch.cat([xy * z, z], dim=-1) @ K_inv.T
+
+    d_cols = unproject(rows, (cols + 1).clamp(max=width - 1)) - unproject(
+        rows, (cols - 1).clamp(min=0)
+    )
+    d_rows = unproject((rows + 1).clamp(max=height - 1), cols) - unproject(
+        (rows - 1).clamp(min=0), cols
+    )
+    return F.normalize(torch.linalg.cross(d_cols, d_rows), dim=-1)
+
+
 def get_pts_from_depth(
     predicted_depth: PredictedDepth,
     image: torch.Tensor,
@@ -163,11 +265,24 @@ def get_pts_from_depth(
     K: torch.Tensor,
     depth_alignment_strategy: DepthAlignmentStrategyEnum,
     debug_point_cloud_export_dir: Optional[Path] = None,
+    debug_export_writer: Optional[BackgroundWriter] = None,
+    depth_consistency_filter: Optional[DepthConsistencyFilter] = None,
+    distortion: Optional[CameraDistortion] = None,
 ):
     """
+    Args:
+        debug_point_cloud_export_dir: If set, debug point clouds are exported here.
+        debug_export_writer: If set, debug point clouds are exported on its thread.
+        depth_consistency_filter: If set, the aligned depth is added to it.
+        distortion: If set, the image is distorted, `K` are the intrinsics of the
+            distorted image and pixels are unprojected through the distortion model.
+
     Returns:
         pts_world: torch.Tensor on depth.device of shape [N, 3] where N is the number of points in the world space
-        valid_indices: torch.Tensor on depth.device of shape [N] where N is the number of points in the world space
+        subsampling_mask: torch.Tensor on CPU of shape [H * W], pixels the points (before filtering by the predictor mask) come from
+        valid_indices: torch.Tensor on CPU of shape [M], which of the subsampled pixels are valid points
+        footprints: torch.Tensor on depth.device of shape [N], world space size of the image area each point represents (`depth * sample spacing / focal length`)
+        normals: torch.Tensor on depth.device of shape [N, 3], world space unit surface normals facing the camera, predicted if available, otherwise estimated from the aligned depth
     """
     depth = predicted_depth.depth.float()
     if predicted_depth.mask is not None:
@@ -212,8 +327,13 @@ def get_pts_from_depth(
         depth,
         mask_from_predictor,
         depth_alignment_strategy.get_implementation(),
+        distortion,
     )
     aligned_depth = depth_alignment.scale * depth + depth_alignment.shift
+    if depth_consistency_filter is not None:
+        depth_consistency_filter.add_view(
+            image_name, aligned_depth, mask_from_predictor, K, cam2world, distortion
+        )
 
     subsampling_mask = subsampler.get_mask(
         image, aligned_depth, mask_from_predictor
@@ -234,15 +354,44 @@ def get_pts_from_depth(
 
     subsampled_mask_from_predictor = mask_from_predictor.reshape(-1)[subsampling_mask]
 
-    pts_camera[:, 0] = (pts_camera[:, 0] + 0.5) * pts_camera[:, 2]
-    pts_camera[:, 1] = (pts_camera[:, 1] + 0.5) * pts_camera[:, 2]
+    # Pixel centres are undistorted in the distorted image.
+    pts_camera[:, :2] += 0.5
+    if distortion is not None:
+        pts_camera[:, :2] = distortion.undistort(pts_camera[:, :2])
+    pts_camera[:, 0] = pts_camera[:, 0] * pts_camera[:, 2]
+    pts_camera[:, 1] = pts_camera[:, 1] * pts_camera[:, 2]
+
+    spacing = sample_spacing(subsampling_mask.to(depth.device), depth.shape)
+    footprints = (
+        spacing * pts_camera[:, 2].abs() / torch.sqrt(K[0, 0] * K[1, 1])
+    )[subsampled_mask_from_predictor]
+
+    sampled_pixels = torch.nonzero(subsampling_mask).squeeze(1).to(depth.device)
+    if predicted_depth.normal is not None:
+        normals_camera = predicted_depth.normal.float().reshape(-1, 3)[sampled_pixels]
+    else:
+        normals_camera = normals_from_depth(
+            aligned_depth, K, sampled_pixels, distortion
+        )
+    facing_away = (normals_camera * (pts_camera @ torch.linalg.inv(K).T)).sum(
+        dim=-1, keepdim=True
+    ) > 0
+    normals_camera = torch.where(facing_away, -normals_camera, normals_camera)
+    normals = F.normalize(
+        normals_camera[subsampled_mask_from_predictor] @ cam2world[:3, :3].T, dim=-1
+    )
 
     pts_world_unfiltered = transform_camera_to_world_space(pts_camera)
     pts_world = pts_world_unfiltered[subsampled_mask_from_predictor]
 
     if debug_point_cloud_export_dir is not None:
         masked_out_world = pts_world_unfiltered[~subsampled_mask_from_predictor]
-        debug_export_point_clouds(
+        export = (
+            debug_export_point_clouds
+            if debug_export_writer is None
+            else partial(debug_export_writer.submit, debug_export_point_clouds)
+        )
+        export(
             imsize,
             cam2world,
             P,
@@ -261,4 +410,6 @@ def get_pts_from_depth(
         pts_world.reshape([-1, 3]).float(),
         subsampling_mask,
         subsampled_mask_from_predictor.cpu(),
+        footprints,
+        normals,
     )
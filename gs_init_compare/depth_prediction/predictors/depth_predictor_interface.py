@@ -9,6 +9,8 @@ class PredictedDepth(NamedTuple):
     """ Float tensor of shape (H, W) """
     mask: Optional[torch.Tensor]
     """ Bool tensor indicating valid pixels. (H, W) """
+    normal: Optional[torch.Tensor] = None
+    """ Float tensor of unit surface normals in camera space (x right, y down, z forward). (H, W, 3) """
 
 
 class PredictedPoints(NamedTuple):
@@ -22,6 +24,8 @@ class PredictedPoints(NamedTuple):
 
 class CameraIntrinsics(NamedTuple):
     K: torch.Tensor
+    focal_35mm: Optional[float] = None
+    """ 35mm film equivalent focal length from the image EXIF data, if available. """
 
     @property
     def fx(self):
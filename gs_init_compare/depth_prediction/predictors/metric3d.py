@@ -115,10 +115,10 @@ class Metric3d(DepthPredictor):
         pred_depth = pred_depth.squeeze()
         pred_depth[pred_depth < 0] = 0
 
-        # pred_normal = torch.nn.functional.interpolate(
-        #     pred_normal, [img.shape[0], img.shape[1]], mode="bilinear"
-        # ).squeeze()
-        # pred_normal = pred_normal.permute(1, 2, 0)
-        # pred_normal = pred_normal.cpu().numpy()
+        pred_normal = torch.nn.functional.interpolate(
+            pred_normal, [img.shape[0], img.shape[1]], mode="bilinear"
+        ).squeeze(0)
+        pred_normal = torch.nn.functional.normalize(pred_normal, dim=0)
+        pred_normal = pred_normal.permute(1, 2, 0)
 
-        return PredictedDepth(pred_depth, None)
+        return PredictedDepth(pred_depth, None, pred_normal)
@@ -1,8 +1,25 @@
-import numpy as np
+"""
+Gaussian filtering of image batches.
+
+Kernels are built once per (sigma, device, dtype) and cached. Separable filters
+run as 1D convolutions over a single replicate-padded copy of the input with
+channels folded into the batch dimension, so a single channel kernel serves all
+channels. Large sigmas are filtered in the frequency domain instead.
+"""
+
+import functools
 import math
+from typing import Literal, Tuple
+
 import torch
 import torch.nn.functional as F
 
+FilterMethod = Literal["auto", "direct", "fft"]
+
+# Sigma from which "auto" filtering switches to FFT convolution. Below it, the
+# direct separable convolution is faster.
+FFT_MIN_SIGMA = 5.0
+
 
 def get_gausskernel_size(sigma, force_odd=True):
     ksize = 2 * math.ceil(sigma * 3.0) + 1
@@ -13,7 +30,7 @@ def get_gausskernel_size(sigma, force_odd=True):
 
 def gaussian1d(x: torch.Tensor, sigma: float) -> torch.Tensor:
     """Function that computes values of a (1D) Gaussian with zero mean and variance sigma^2"""
-    return (1 / (sigma * np.sqrt(2 * np.pi))) * np.exp(-x * x / (2 * sigma * sigma))
+    return torch.exp(-x * x / (2 * sigma * sigma)) / (sigma * math.sqrt(2 * math.pi))
 
 
 def gaussian_deriv1d(x: torch.Tensor, sigma: float) -> torch.Tensor:
@@ -21,13 +38,146 @@ def gaussian_deriv1d(x: torch.Tensor, sigma: float) -> torch.Tensor:
     return -(x / (sigma * sigma)) * gaussian1d(x, sigma)
 
 
+def _gaussian_input_range(sigma: float) -> torch.Tensor:
+    ksize_half = get_gausskernel_size(sigma) // 2
+    return torch.arange(-ksize_half, ksize_half + 1, dtype=torch.float64)
+
+
+@functools.lru_cache(maxsize=None)
+def _gaussian_taps(sigma: float) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    """
+    Returns the taps of the 1D Gaussian and Gaussian derivative kernels for `sigma`.
+    Taps are plain floats, so applying them needs neither kernel tensors on the
+    device nor host synchronization.
+    """
+    gaussian_input = _gaussian_input_range(sigma)
+    return (
+        tuple(gaussian1d(gaussian_input, sigma).tolist()),
+        tuple(gaussian_deriv1d(gaussian_input, sigma).tolist()),
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _kernel_spectrum(
+    taps: Tuple[float, ...],
+    size: int,
+    onesided: bool,
+    device: torch.device,
+    dtype: torch.dtype,
+) -> torch.Tensor:
+    """
+    Spectrum of a centered 1D kernel zero-padded (with wrap-around) to `size`.
+    Cached per kernel, size and device.
+    """
+    padded = torch.zeros(size, dtype=dtype)
+    padded[: len(taps)] = torch.tensor(taps, dtype=dtype)
+    padded = padded.roll(-(len(taps) // 2)).to(device)
+    return torch.fft.rfft(padded) if onesided else torch.fft.fft(padded)
+
+
+def _as_planes(x: torch.Tensor, channels_last: bool) -> torch.Tensor:
+    """Folds channels into the batch dimension, giving `(B * C, 1, H, W)`."""
+    if channels_last:
+        x = x.permute(0, 3, 1, 2)
+    return x.reshape(-1, 1, *x.shape[-2:])
+
+
+def _from_planes(
+    planes: torch.Tensor, shape: torch.Size, channels_last: bool
+) -> torch.Tensor:
+    if channels_last:
+        batch, height, width, channels = shape
+        return planes.reshape(batch, channels, height, width).permute(0, 2, 3, 1)
+    return planes.reshape(shape)
+
+
+@functools.lru_cache(maxsize=32)
+def _conv_kernel(
+    taps: Tuple[float, ...], dim: int, device: torch.device, dtype: torch.dtype
+) -> torch.Tensor:
+    """
+    `conv2d` weight applying the 1D kernel `taps` along `dim` (-2 or -1) of single
+    channel planes. Cached per kernel, direction and device.
+    """
+    # conv2d computes a correlation, so the kernel is flipped.
+    kernel = torch.tensor(taps[::-1], dtype=dtype, device=device)
+    return kernel.view(1, 1, -1, 1) if dim == -2 else kernel.view(1, 1, 1, -1)
+
+
+def _conv1d_valid(x: torch.Tensor, taps: Tuple[float, ...], dim: int) -> torch.Tensor:
+    """
+    Valid convolution of `(N, 1, H, W)` planes with a 1D kernel along `dim`.
+
+    On CPU, it is computed as a weighted sum of shifted views, which is several times
+    faster than `conv2d` for the small kernels used here (see
+    `benchmarks/image_filtering.py`). Other devices run a single `conv2d` with a
+    cached `(k, 1)` or `(1, k)` kernel.
+    """
+    if x.device.type != "cpu":
+        return F.conv2d(x, _conv_kernel(taps, dim, x.device, x.dtype))
+    size = x.shape[dim] - len(taps) + 1
+    # Convolution flips the kernel, so the last tap weights the first shift.
+    out = x.narrow(dim, 0, size) * taps[-1]
+    for shift, tap in enumerate(reversed(taps[:-1]), start=1):
+        out.add_(x.narrow(dim, shift, size), alpha=tap)
+    return out
+
+
+def _fast_fft_size(size: int) -> int:
+    """Smallest integer >= `size` with no prime factors other than 2, 3 and 5."""
+    while True:
+        remainder = size
+        for factor in (2, 3, 5):
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return size
+        size += 1
+
+
+def _fft_separable(
+    padded: torch.Tensor,
+    taps_y: Tuple[float, ...],
+    taps_x: Tuple[float, ...],
+    pad: int,
+) -> torch.Tensor:
+    """
+    Convolves replicate-padded planes with a separable kernel in the frequency
+    domain and crops the padding. Wrap-around only reaches into the padding since
+    the kernel radius does not exceed `pad`. Transforms are zero-padded to sizes
+    that FFT implementations handle efficiently.
+    """
+    height, width = padded.shape[-2:]
+    fft_height, fft_width = _fast_fft_size(height), _fast_fft_size(width)
+    spectrum_y = _kernel_spectrum(
+        taps_y, fft_height, False, padded.device, padded.dtype
+    )
+    spectrum_x = _kernel_spectrum(
+        taps_x, fft_width, True, padded.device, padded.dtype
+    )
+    filtered = torch.fft.irfft2(
+        torch.fft.rfft2(padded, s=(fft_height, fft_width))
+        * (spectrum_y[:, None] * spectrum_x[None, :]),
+        s=(fft_height, fft_width),
+    )
+    return filtered[..., pad : height - pad, pad : width - pad]
+
+
+def _use_fft(sigma: float, method: FilterMethod) -> bool:
+    if method == "auto":
+        return sigma >= FFT_MIN_SIGMA
+    if method not in ("direct", "fft"):
+        raise ValueError(f"Unsupported filter method: {method}")
+    return method == "fft"
+
+
 def filter2d(x: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
     """Function that convolves a tensor with a kernel.
 
     The function applies a given kernel to a tensor. The kernel is applied
     independently at each depth channel of the tensor. Before applying the
-    kernel, the function applies padding according to the specified mode so
-    that the output remains in the same shape.
+    kernel, the function applies replicate padding so that the output remains
+    in the same shape.
 
     Args:
         input (torch.Tensor): the input tensor with shape of
@@ -38,33 +188,27 @@ def filter2d(x: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
         torch.Tensor: the convolved tensor of same size and numbers of channels
         as the input.
     """
-
     pad_x = kernel.size()[1] // 2
     pad_y = kernel.size()[0] // 2
 
-    padded = F.pad(x, (pad_x, pad_x, pad_y, pad_y), mode="replicate")
-    kernel = kernel.flip(0, 1)[None, None]
-    kernel = kernel.repeat(x.size(1), 1, 1, 1)
-
-    return F.conv2d(padded, kernel, stride=1, groups=x.size(1))
-
-
-def _separable_conv(x: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
-    """Function that applies a separable convolution kernel to a 2D tensor."""
-    return filter2d(filter2d(x, kernel[:, None]), kernel[None, :])
-
-
-def _gaussian_input_range(sigma: float) -> torch.Tensor:
-    ksize = get_gausskernel_size(sigma)
-    ksize_half = math.floor(ksize / 2)
-    return torch.arange(-ksize_half, ksize_half + 1)
+    planes = F.pad(_as_planes(x, False), (pad_x, pad_x, pad_y, pad_y), mode="replicate")
+    filtered = F.conv2d(planes, kernel.flip(0, 1)[None, None].to(x.dtype))
+    return _from_planes(filtered, x.shape, False)
 
 
-def gaussian_filter2d(x: torch.Tensor, sigma: float) -> torch.Tensor:
+def gaussian_filter2d(
+    x: torch.Tensor,
+    sigma: float,
+    method: FilterMethod = "auto",
+    channels_last: bool = False,
+) -> torch.Tensor:
     """Function that blurs a tensor using a Gaussian filter.
 
     Arguments:
-        sigma (Tuple[float, float]): the standard deviation of the kernel.
+        sigma (float): the standard deviation of the kernel.
+        method: "direct" for separable 1D convolutions, "fft" for frequency
+          domain filtering or "auto" to pick based on sigma.
+        channels_last: if set, the input and output are :math:`(B, H, W, C)`.
 
     Returns:
         Tensor: the blurred tensor.
@@ -74,13 +218,32 @@ def gaussian_filter2d(x: torch.Tensor, sigma: float) -> torch.Tensor:
         - Output: :math:`(B, C, H, W)`
 
     """
-    kernel_1d = gaussian1d(_gaussian_input_range(sigma), sigma)
-    return _separable_conv(x, kernel_1d)
+    taps, _ = _gaussian_taps(sigma)
+    pad = len(taps) // 2
+    padded = F.pad(_as_planes(x, channels_last), (pad,) * 4, mode="replicate")
 
+    if _use_fft(sigma, method):
+        blurred = _fft_separable(padded, taps, taps, pad)
+    else:
+        blurred = _conv1d_valid(_conv1d_valid(padded, taps, -2), taps, -1)
+    return _from_planes(blurred, x.shape, channels_last)
 
-def spatial_gradient_first_order(x: torch.Tensor, sigma: float) -> torch.Tensor:
+
+def spatial_gradient_first_order(
+    x: torch.Tensor,
+    sigma: float,
+    method: FilterMethod = "auto",
+    channels_last: bool = False,
+) -> torch.Tensor:
     """Computes the first order image derivative in both x and y directions using Gaussian derivative
 
+    Arguments:
+        sigma (float): the standard deviation of the Gaussian.
+        method: "direct" for separable 1D convolutions, "fft" for frequency
+          domain filtering or "auto" to pick based on sigma.
+        channels_last: if set, the input is :math:`(B, H, W, C)` and the output
+          :math:`(B, H, W, C, 2)`.
+
     Return:
         torch.Tensor: spatial gradients
 
@@ -89,17 +252,17 @@ def spatial_gradient_first_order(x: torch.Tensor, sigma: float) -> torch.Tensor:
         - Output: :math:`(B, C, 2, H, W)`
 
     """
-    gaussian_input = _gaussian_input_range(sigma)
-    gderiv_k = gaussian_deriv1d(gaussian_input, sigma).to(x.device)
-    gaussian_k = gaussian1d(gaussian_input, sigma).to(x.device)
-
-    blurred_y = filter2d(x, gaussian_k[:, None])
-    blurred_x = filter2d(x, gaussian_k[None, :])
-
-    return torch.stack(
-        [
-            filter2d(blurred_y, gderiv_k[None, :]),
-            filter2d(blurred_x, gderiv_k[:, None]),
-        ],
-        dim=2,
-    )
+    gaussian_k, gderiv_k = _gaussian_taps(sigma)
+    pad = len(gaussian_k) // 2
+    padded = F.pad(_as_planes(x, channels_last), (pad,) * 4, mode="replicate")
+
+    if _use_fft(sigma, method):
+        grad_x = _fft_separable(padded, gaussian_k, gderiv_k, pad)
+        grad_y = _fft_separable(padded, gderiv_k, gaussian_k, pad)
+    else:
+        grad_x = _conv1d_valid(_conv1d_valid(padded, gaussian_k, -2), gderiv_k, -1)
+        grad_y = _conv1d_valid(_conv1d_valid(padded, gaussian_k, -1), gderiv_k, -2)
+
+    grad_x = _from_planes(grad_x, x.shape, channels_last)
+    grad_y = _from_planes(grad_y, x.shape, channels_last)
+    return torch.stack([grad_x, grad_y], dim=-1 if channels_last else 2)
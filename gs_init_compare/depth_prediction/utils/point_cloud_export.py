@@ -1,9 +1,84 @@
+"""
+Binary PLY export of point clouds, with support for writing a cloud incrementally and
+for offloading the writing to a background thread.
+"""
+
 import logging
+import queue
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Any, BinaryIO, Callable, Optional
 
 import numpy as np
-import open3d
+
+_LOGGER = logging.getLogger(__name__)
+
+_VERTEX_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+_COLORED_VERTEX_DTYPE = np.dtype(
+    _VERTEX_DTYPE.descr + [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+)
+_PLY_TYPE_NAMES = {"f": "float", "u": "uchar"}
+# The vertex count is zero padded to this width, so it can be patched in place.
+_COUNT_WIDTH = 12
+
+
+class PlyWriter:
+    """
+    Writes a binary little-endian PLY point cloud, appending points in chunks.
+    The vertex count in the header is updated when the writer is closed.
+
+    Usage:
+        with PlyWriter(path, with_colors=True) as writer:
+            for pts, rgbs in chunks:
+                writer.append(pts, rgbs)
+    """
+
+    def __init__(self, path: Path, with_colors: bool):
+        self.path = Path(path)
+        self.num_points = 0
+        self._dtype = _COLORED_VERTEX_DTYPE if with_colors else _VERTEX_DTYPE
+        self._file: BinaryIO = open(self.path, "wb")
+        header = ["ply", "format binary_little_endian 1.0"]
+        header.append(f"element vertex {0:0{_COUNT_WIDTH}d}")
+        header.extend(
+            f"property {_PLY_TYPE_NAMES[self._dtype[name].kind]} {name}"
+            for name in self._dtype.names
+        )
+        header.append("end_header")
+        header_bytes = ("\n".join(header) + "\n").encode("ascii")
+        self._count_offset = header_bytes.index(b"element vertex ") + len(
+            b"element vertex "
+        )
+        self._file.write(header_bytes)
+
+    def append(self, pts: np.ndarray, rgbs: Optional[np.ndarray] = None):
+        """
+        Args:
+            pts: Points `[N, 3]`.
+            rgbs: Colours in `[0, 1]` `[N, 3]`, required iff the writer has colours.
+        """
+        if (rgbs is not None) != (self._dtype is _COLORED_VERTEX_DTYPE):
+            raise ValueError("Colours must be given iff the PLY file has colours.")
+        vertices = np.empty(pts.shape[0], dtype=self._dtype)
+        vertices["x"], vertices["y"], vertices["z"] = np.asarray(pts, np.float32).T
+        if rgbs is not None:
+            colors = np.clip(np.rint(np.asarray(rgbs) * 255), 0, 255).astype(np.uint8)
+            vertices["red"], vertices["green"], vertices["blue"] = colors.T
+        vertices.tofile(self._file)
+        self.num_points += pts.shape[0]
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(self._count_offset)
+        self._file.write(f"{self.num_points:0{_COUNT_WIDTH}d}".encode("ascii"))
+        self._file.close()
+
+    def __enter__(self) -> "PlyWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def export_point_cloud_to_ply(
@@ -23,11 +98,69 @@ def export_point_cloud_to_ply(
         if rgbs is not None:
             rgbs = rgbs[mask]
 
-    pcd = open3d.geometry.PointCloud()
-    pcd.points = open3d.utility.Vector3dVector(pts)
-    if rgbs is not None:
-        pcd.colors = open3d.utility.Vector3dVector(rgbs)
-    open3d.io.write_point_cloud(
-        str(output_dir / f"{depth_pts_filename}.ply"), pcd, write_ascii=False
-    )
-    logging.info(f"Saved point cloud to {output_dir / depth_pts_filename}.ply")
+    path = Path(output_dir) / f"{depth_pts_filename}.ply"
+    with PlyWriter(path, with_colors=rgbs is not None) as writer:
+        writer.append(pts, rgbs)
+    logging.info(f"Saved point cloud to {path}")
+
+
+class BackgroundWriter:
+    """
+    Runs (file writing) tasks in order on a background thread. The queue of pending
+    tasks is bounded, so producers block instead of accumulating unbounded memory
+    when writing can't keep up. Errors of tasks are re-raised by `close`.
+
+    Usage:
+        with BackgroundWriter() as writer:
+            writer.submit(export_point_cloud_to_ply, pts, rgbs, output_dir, name)
+    """
+
+    def __init__(self, max_pending: int = 8):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name="BackgroundWriter", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            fn, args, kwargs = task
+            if self._error is not None:
+                continue
+            try:
+                fn(*args, **kwargs)
+            except BaseException as e:
+                _LOGGER.error(f"Background write failed: {e}")
+                self._error = e
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs):
+        """Queues `fn(*args, **kwargs)`, blocking while the queue is full."""
+        if not self._thread.is_alive():
+            raise RuntimeError("BackgroundWriter is closed.")
+        self._queue.put((fn, args, kwargs))
+
+    def close(self):
+        """Waits for all queued tasks to finish."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original exception with one from the writer.
+            try:
+                self.close()
+            except BaseException:
+                pass
@@ -1,10 +1,6 @@
 from dataclasses import dataclass
-from typing import Sequence, Tuple, Union
+from typing import Callable, Optional, Sequence, Tuple, Union
 import torch
-from gs_init_compare.depth_prediction.utils.image_filtering import (
-    gaussian_filter2d,
-    spatial_gradient_first_order,
-)
 from gs_init_compare.depth_subsampling.config import AdaptiveSubsamplingConfig
 from gs_init_compare.depth_subsampling.interface import DepthSubsampler
 
@@ -22,26 +18,51 @@ def _map_to_closest_discrete_value(data: torch.Tensor, values: Sequence[int | fl
     return range[torch.argmin(torch.abs(dists), dim=-1)]
 
 
-def _color_grad_intensity_map(
-    rgb: torch.Tensor,
-    grad_approx_gauss_sigma: float = 1.2,
+def _nearest_source_indices(
+    step: int, output_size: int, input_size: int, device: torch.device
 ) -> torch.Tensor:
     """
-    Args:
-        `rgb`                        input RGB image `[H, W, 3]`
-        `possible_subsample_factors` range of possible subsample factors in increasing order
-        `grad_approx_gauss_sigma`    sigma for gaussian kernel used to approximate
-                                     gradient of the image
+    Indices of every `step`-th output pixel along one axis, mapped to the closest
+    (nearest neighbour) input pixel if the input and output sizes differ.
     """
-    color_grad = (
-        spatial_gradient_first_order(
-            rgb.permute(2, 0, 1)[None], sigma=grad_approx_gauss_sigma
-        )
-        .sum(1)
-        .sum(1)
-    )
-    intensity_0_to_1 = _map_to_range(color_grad.abs())
-    return gaussian_filter2d(intensity_0_to_1[None], 5).squeeze()
+    indices = torch.arange(0, output_size, step, device=device)
+    if input_size != output_size:
+        indices = indices * input_size // output_size
+    return indices
+
+
+def _lattice_values(
+    tensor: torch.Tensor, step: int, output_size: Tuple[int, int]
+) -> torch.Tensor:
+    """
+    Values of `tensor` `[H', W']` at every `step`-th pixel of an `output_size` image,
+    using nearest neighbour lookup if the sizes differ. Returns a strided view
+    (no copy) if they don't.
+    """
+    if tuple(tensor.shape) == tuple(output_size):
+        return tensor[::step, ::step]
+    rows = _nearest_source_indices(step, output_size[0], tensor.shape[0], tensor.device)
+    cols = _nearest_source_indices(step, output_size[1], tensor.shape[1], tensor.device)
+    return tensor.index_select(0, rows).index_select(1, cols)
+
+
+def _lattice_union_mask(
+    image_size: Tuple[int, int],
+    factor_range: Tuple[int, int],
+    lattice_factors: Callable[[int], torch.Tensor],
+    device: torch.device,
+) -> torch.Tensor:
+    """
+    Builds the sampling mask as a union of strided lattices, one per factor in
+    `factor_range` (inclusive). `lattice_factors(f)` must return the integer
+    subsample factors at every `f`-th pixel (a `[ceil(H / f), ceil(W / f)]` tensor),
+    a lattice position is kept if its factor equals `f`.
+    """
+    height, width = image_size
+    mask = torch.zeros((height, width), dtype=torch.bool, device=device)
+    for factor in range(factor_range[0], factor_range[1] + 1):
+        mask[::factor, ::factor] |= lattice_factors(factor) == factor
+    return mask.view(-1)
 
 
 def get_sample_mask(
@@ -51,65 +72,127 @@ def get_sample_mask(
     """
     Generates a tensor of boolean values indicating which pixel indices should be sampled
     based on the provided downsample factor map and the desired image size.
+
+    A pixel `(y, x)` with downsample factor `f` is sampled if both `y` and `x` are
+    divisible by `f`. The mask is therefore built as a union of per-factor strided
+    lattices and only lattice positions of the factor map are ever read, so no full
+    resolution coordinate or factor grids are created.
+
     Args:
         downsample_factor_map (torch.Tensor): A tensor representing the downsample factors
-            for each pixel in the original image.
+            for each pixel in the original image. Fractional factors are truncated and
+            factors smaller than 1 are treated as 1.
         image_size (Union[torch.Size, Tuple[int, int]]): The size of the image to which the
-            downsample factor map should be interpolated.
+            downsample factor map should be interpolated (nearest neighbour).
     Returns:
         torch.Tensor: A boolean 1D tensor of length width * hight which can be used to index, e.g. img.view(-1, 3)
     """
-    per_pixel_df: torch.Tensor = (
-        torch.nn.functional.interpolate(
-            downsample_factor_map[None, None].to(float), size=image_size, mode="nearest"
-        )
-        .squeeze()
-        .to(int)
-    )
-    pixel_coords = torch.cartesian_prod(
-        torch.arange(per_pixel_df.shape[0], device=per_pixel_df.device),
-        torch.arange(per_pixel_df.shape[1], device=per_pixel_df.device),
+    image_size = (int(image_size[0]), int(image_size[1]))
+    factor_range = (
+        max(int(downsample_factor_map.min()), 1),
+        max(int(downsample_factor_map.max()), 1),
     )
 
-    per_pixel_df[per_pixel_df == 0] = 1
-    return torch.logical_and(
-        (pixel_coords[:, 0] % per_pixel_df.view(-1)) == 0,
-        (pixel_coords[:, 1] % per_pixel_df.view(-1)) == 0,
+    def lattice_factors(step: int) -> torch.Tensor:
+        values = _lattice_values(downsample_factor_map, step, image_size)
+        return values.to(torch.int64).clamp_(min=1)
+
+    return _lattice_union_mask(
+        image_size, factor_range, lattice_factors, downsample_factor_map.device
     )
 
 
 def iqr_outlier_bounds(data: torch.Tensor):
-    q1 = torch.quantile(data, 0.25)
-    q3 = torch.quantile(data, 0.75)
+    q1, q3 = torch.quantile(
+        data, torch.tensor([0.25, 0.75], device=data.device, dtype=data.dtype)
+    )
     iqr = q3 - q1
     return q1 - 1.5 * iqr, q3 + 1.5 * iqr
 
 
-def get_depth_multipler_map(depth: torch.Tensor, mask: torch.Tensor):
-    masked_depth = depth[mask]
+def _sample_masked_values(
+    data: torch.Tensor, mask: torch.Tensor, num_samples: int
+) -> torch.Tensor:
+    """
+    Draws `num_samples` random pixels and returns the values of those inside `mask`.
+    Uses a fixed seed, so results are deterministic and the global RNG is untouched.
+    """
+    generator = torch.Generator(device=data.device).manual_seed(0)
+    indices = torch.randint(
+        data.numel(), (num_samples,), device=data.device, generator=generator
+    )
+    return data.reshape(-1)[indices][mask.reshape(-1)[indices]]
+
+
+def _valid_depth_range(
+    depth: torch.Tensor, mask: torch.Tensor, quantile_sample_size: Optional[int]
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Range of masked depth values with IQR outliers excluded. If `quantile_sample_size`
+    is set, quartiles and extremes are estimated from a random subset of pixels
+    instead of compacting the full masked depth map.
+    """
+    masked_depth = None
+    if quantile_sample_size is not None and depth.numel() > quantile_sample_size:
+        masked_depth = _sample_masked_values(depth, mask, quantile_sample_size)
+    if masked_depth is None or masked_depth.numel() == 0:
+        masked_depth = depth[mask]
+
     outlier_bounds = iqr_outlier_bounds(masked_depth)
-    input_range = (
-        max(masked_depth.min(), outlier_bounds[0]),
-        min(masked_depth.max(), outlier_bounds[1]),
+    depth_min, depth_max = torch.aminmax(masked_depth)
+    return (
+        torch.maximum(depth_min, outlier_bounds[0]),
+        torch.minimum(depth_max, outlier_bounds[1]),
     )
+
+
+def _depth_multiplier(
+    depth: torch.Tensor,
+    mask: torch.Tensor,
+    input_range: Tuple[torch.Tensor, torch.Tensor],
+) -> torch.Tensor:
     multiplier_map = torch.clamp(_map_to_range(depth, input_range=input_range), 0, 1)
-    multiplier_map[~mask] = 0.5
+    multiplier_map.masked_fill_(~mask, 0.5)
     return 1.0 - multiplier_map
 
 
+def get_depth_multipler_map(
+    depth: torch.Tensor,
+    mask: torch.Tensor,
+    quantile_sample_size: Optional[int] = None,
+):
+    return _depth_multiplier(
+        depth, mask, _valid_depth_range(depth, mask, quantile_sample_size)
+    )
+
+
 @dataclass
 class AdaptiveDepthSubsampler(DepthSubsampler):
     config: AdaptiveSubsamplingConfig
 
     def get_mask(self, rgb, depth, depth_mask):
-        multiplier_map = get_depth_multipler_map(depth, depth_mask)
-        factor_map = torch.clamp(
-            _map_to_range(
-                multiplier_map,
-                output_range=self.config.factor_range,
-                input_range=(0.0, 1.0),
-            ),
-            self.config.factor_range[0],
-            self.config.factor_range[1],
+        depth_range = _valid_depth_range(
+            depth, depth_mask, self.config.quantile_sample_size
+        )
+        image_size = rgb.shape[:2]
+        factor_range = self.config.factor_range
+
+        # The factor is an elementwise function of depth, so it only has to be
+        # evaluated at the lattice positions that can actually be sampled.
+        def lattice_factors(step: int) -> torch.Tensor:
+            multiplier = _depth_multiplier(
+                _lattice_values(depth, step, image_size),
+                _lattice_values(depth_mask, step, image_size),
+                depth_range,
+            )
+            return torch.clamp(
+                _map_to_range(
+                    multiplier, output_range=factor_range, input_range=(0.0, 1.0)
+                ),
+                factor_range[0],
+                factor_range[1],
+            ).to(torch.int64)
+
+        return _lattice_union_mask(
+            image_size, factor_range, lattice_factors, depth.device
         )
-        return get_sample_mask(factor_map.to(int), rgb.shape[:2])
@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+import functools
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.depth_subsampling.adaptive_subsampling import (
+    get_depth_multipler_map,
+)
+from gs_init_compare.depth_subsampling.config import (
+    BlueNoiseSubsamplingConfig,
+    EdgeAwareSubsamplingConfig,
+)
+from gs_init_compare.depth_subsampling.edge_aware_subsampling import (
+    edge_importance_map,
+)
+from gs_init_compare.depth_subsampling.interface import DepthSubsampler
+
+_VOID_AND_CLUSTER_SIGMA = 1.5
+_DEPTH_QUANTILE_SAMPLE_SIZE = 100_000
+
+
+@functools.lru_cache(maxsize=None)
+def blue_noise_ranks(tile_size: int, seed: int = 0) -> np.ndarray:
+    """
+    Generates a tileable blue-noise threshold mask using the void-and-cluster
+    method (Ulichney, 1993). Energies use a Gaussian kernel on a torus, so the
+    mask tiles seamlessly.
+
+    Returns:
+        Rank of each pixel, a permutation of `0 .. tile_size**2 - 1` `[T, T]`.
+        Pixels with rank below `p * tile_size**2` form a blue-noise pattern of
+        density `p` for any `p`.
+    """
+    num_pixels = tile_size * tile_size
+    wrapped = np.minimum(np.arange(tile_size), tile_size - np.arange(tile_size))
+    kernel = np.exp(
+        -(wrapped[:, None] ** 2 + wrapped[None, :] ** 2)
+        / (2 * _VOID_AND_CLUSTER_SIGMA**2)
+    )
+
+    def splat(index: int) -> np.ndarray:
+        return np.roll(kernel, divmod(index, tile_size), axis=(0, 1)).reshape(-1)
+
+    def tightest_cluster(pattern, energy) -> int:
+        return int(np.argmax(np.where(pattern, energy, -np.inf)))
+
+    def largest_void(pattern, energy) -> int:
+        return int(np.argmin(np.where(pattern, np.inf, energy)))
+
+    rng = np.random.default_rng(seed)
+    pattern = np.zeros(num_pixels, dtype=bool)
+    pattern[rng.choice(num_pixels, num_pixels // 10, replace=False)] = True
+    energy = np.real(
+        np.fft.ifft2(
+            np.fft.fft2(pattern.reshape(tile_size, tile_size)) * np.fft.fft2(kernel)
+        )
+    ).reshape(-1)
+
+    # Move points from the tightest clusters to the largest voids until stable.
+    for _ in range(num_pixels):
+        cluster = tightest_cluster(pattern, energy)
+        pattern[cluster] = False
+        energy -= splat(cluster)
+        void = largest_void(pattern, energy)
+        pattern[void] = True
+        energy += splat(void)
+        if void == cluster:
+            break
+
+    ranks = np.empty(num_pixels, dtype=np.int64)
+    num_initial = int(pattern.sum())
+
+    # Rank initial points by repeatedly removing the tightest cluster.
+    removal_pattern, removal_energy = pattern.copy(), energy.copy()
+    for rank in range(num_initial - 1, -1, -1):
+        cluster = tightest_cluster(removal_pattern, removal_energy)
+        removal_pattern[cluster] = False
+        removal_energy -= splat(cluster)
+        ranks[cluster] = rank
+
+    # Rank the rest by repeatedly filling the largest void.
+    for rank in range(num_initial, num_pixels):
+        void = largest_void(pattern, energy)
+        pattern[void] = True
+        energy += splat(void)
+        ranks[void] = rank
+
+    return ranks.reshape(tile_size, tile_size)
+
+
+@functools.lru_cache(maxsize=4)
+def _tiled_rank_map(
+    height: int, width: int, tile_size: int, device: torch.device
+) -> torch.Tensor:
+    """
+    Blue-noise ranks tiled to cover `[height + tile_size, width + tile_size]`, so
+    that any toroidal offset of the tile is a view `[y : y + height, x : x + width]`.
+    Cached per resolution and device.
+    """
+    ranks = torch.from_numpy(blue_noise_ranks(tile_size))
+    dtype = torch.int16 if tile_size**2 <= torch.iinfo(torch.int16).max else torch.int32
+    reps = (height // tile_size + 2, width // tile_size + 2)
+    return ranks.to(dtype).repeat(reps)[: height + tile_size, : width + tile_size].to(
+        device
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _offset_generator(seed: int) -> torch.Generator:
+    """
+    Generator of the tile offsets, shared by all subsamplers with the same seed
+    (one is created per view), so the global RNG is untouched.
+    """
+    return torch.Generator().manual_seed(seed)
+
+
+def _factor_to_density(factor_map: torch.Tensor) -> torch.Tensor:
+    return 1.0 / factor_map.square()
+
+
+@dataclass
+class BlueNoiseDepthSubsampler(DepthSubsampler):
+    config: BlueNoiseSubsamplingConfig
+    # Edge importance parameters, used with "gradient" modulation.
+    edge_aware_config: EdgeAwareSubsamplingConfig = field(
+        default_factory=EdgeAwareSubsamplingConfig
+    )
+
+    def density_map(self, rgb, depth, depth_mask):
+        """
+        Returns:
+            Per-pixel sampling probability, `[H, W]` or a scalar tensor if the
+            density is not modulated.
+        """
+        low, high = self.config.factor_range
+        if self.config.modulation == "none":
+            return _factor_to_density(
+                torch.tensor(float(self.config.subsample_factor), device=depth.device)
+            )
+        elif self.config.modulation == "depth":
+            multiplier = get_depth_multipler_map(
+                depth, depth_mask, _DEPTH_QUANTILE_SAMPLE_SIZE
+            )
+            return _factor_to_density(low + (high - low) * multiplier)
+        elif self.config.modulation == "gradient":
+            importance = edge_importance_map(
+                rgb, depth, depth_mask, self.edge_aware_config
+            )
+            if importance.shape != depth.shape:
+                importance = F.interpolate(
+                    importance[None, None], size=depth.shape, mode="bilinear"
+                )[0, 0]
+            return _factor_to_density(high - (high - low) * importance)
+        else:
+            raise ValueError(f"Unsupported density modulation: {self.config.modulation}")
+
+    def get_mask(self, rgb, depth, depth_mask):
+        height, width = depth.shape
+        tile_size = self.config.tile_size
+        # Random toroidal offset, so that views do not share the same pattern.
+        offset_y, offset_x = torch.randint(
+            tile_size, (2,), generator=_offset_generator(self.config.seed)
+        ).tolist()
+        ranks = _tiled_rank_map(height, width, tile_size, depth.device)[
+            offset_y : offset_y + height, offset_x : offset_x + width
+        ]
+        thresholds = self.density_map(rgb, depth, depth_mask) * tile_size**2
+        return (ranks < thresholds).view(-1)
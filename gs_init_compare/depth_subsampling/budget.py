@@ -0,0 +1,195 @@
+import logging
+import math
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.depth_subsampling.config import BudgetSubsamplingConfig
+from gs_init_compare.depth_subsampling.interface import DepthSubsampler
+
+_LOGGER = logging.getLogger(__name__)
+
+_SFM_COVERAGE_GRID_SIZE = 16
+
+
+def _sfm_depth_range_and_coverage(
+    points_world: np.ndarray,
+    cam2world: np.ndarray,
+    K: np.ndarray,
+    width: int,
+    height: int,
+):
+    """
+    Returns:
+        Log ratio of the 95th and 5th percentile depth of SfM points visible in the
+        view, and the fraction of cells of a coarse image grid containing at
+        least one of them.
+    """
+    w2c = np.linalg.inv(cam2world)
+    pts_camera = points_world @ w2c[:3, :3].T + w2c[:3, 3]
+    pts_camera = pts_camera[pts_camera[:, 2] > 0]
+    if pts_camera.shape[0] == 0:
+        return 0.0, 0.0
+
+    pts_image = pts_camera @ K.T
+    uv = pts_image[:, :2] / pts_image[:, 2:]
+    inside = np.all((uv >= 0) & (uv < np.array([width, height])), axis=1)
+    if inside.sum() < 2:
+        return 0.0, 0.0
+
+    depth_low, depth_high = np.percentile(pts_camera[inside, 2], [5, 95])
+    depth_range = float(np.log(depth_high / depth_low))
+
+    cells = (
+        uv[inside] / np.array([width, height]) * _SFM_COVERAGE_GRID_SIZE
+    ).astype(np.int64)
+    occupied = np.unique(cells[:, 1] * _SFM_COVERAGE_GRID_SIZE + cells[:, 0])
+    coverage = occupied.size / _SFM_COVERAGE_GRID_SIZE**2
+    return depth_range, coverage
+
+
+def _mean_color_gradient(image: np.ndarray, resolution: int) -> float:
+    """
+    Mean finite difference gradient magnitude of the grayscale uint8 image
+    `[H, W, 3]`, resized so that its longest side is at most `resolution`.
+    """
+    gray = torch.from_numpy(image).float().mean(dim=-1)[None, None] / 255.0
+    scale = resolution / max(gray.shape[-2:])
+    if scale < 1:
+        gray = F.interpolate(gray, scale_factor=scale, mode="area")
+    grad_y = gray[..., 1:, :-1] - gray[..., :-1, :-1]
+    grad_x = gray[..., :-1, 1:] - gray[..., :-1, :-1]
+    return torch.sqrt(grad_x**2 + grad_y**2).mean().item()
+
+
+def _normalize_to_unit_mean(values: np.ndarray) -> np.ndarray:
+    mean = values.mean()
+    if mean <= 0:
+        return np.ones_like(values)
+    return values / mean
+
+
+def _allocate(total: int, weights: np.ndarray, capacities: np.ndarray) -> np.ndarray:
+    """
+    Splits `total` proportionally to `weights`, capping each share at its capacity
+    and redistributing the excess among the remaining entries.
+    """
+    counts = np.zeros_like(weights)
+    free = capacities > 0
+    budget = float(total)
+    while free.any():
+        share = np.zeros_like(weights)
+        share[free] = budget * weights[free] / weights[free].sum()
+        over = free & (share >= capacities)
+        if not over.any():
+            counts[free] = share[free]
+            break
+        counts[over] = capacities[over]
+        budget -= capacities[over].sum()
+        free &= ~over
+    return np.floor(counts).astype(np.int64)
+
+
+def plan_point_budget(
+    parser,
+    config: BudgetSubsamplingConfig,
+    selected_views: Optional[Collection[str]] = None,
+) -> Dict[str, int]:
+    """
+    Runs a cheap pre-pass over the training views (no depth prediction, images are
+    only decoded at reduced resolution for the colour term) and assigns each of them
+    a number of points, so that the total matches `config.total_points`.
+
+    Args:
+        selected_views: If set, only these training images get points.
+
+    Returns:
+        Dict of image_name -> planned number of points.
+    """
+    dataset = type(parser).DatasetCls(parser, split="train")
+
+    image_names: List[str] = []
+    capacities = []
+    terms = []
+    for item, image_name in enumerate(dataset.image_names):
+        if selected_views is not None and image_name not in selected_views:
+            continue
+        camtoworld, K, (width, height) = dataset.camera(item)
+        depth_range, coverage = _sfm_depth_range_and_coverage(
+            parser.points[parser.point_indices[image_name]],
+            np.asarray(camtoworld, dtype=np.float64),
+            np.asarray(K, dtype=np.float64),
+            width,
+            height,
+        )
+        color_gradient = (
+            _mean_color_gradient(
+                dataset.load_thumbnail(item, config.color_gradient_resolution),
+                config.color_gradient_resolution,
+            )
+            if config.color_gradient_weight > 0
+            else 0.0
+        )
+        image_names.append(image_name)
+        capacities.append(height * width)
+        terms.append([depth_range, coverage, color_gradient])
+
+    terms_arr = np.array(terms, dtype=np.float64).reshape(-1, 3)
+    term_weights = np.array(
+        [
+            config.depth_range_weight,
+            config.sfm_coverage_weight,
+            config.color_gradient_weight,
+        ]
+    )
+    if term_weights.sum() > 0:
+        normalized = np.stack(
+            [_normalize_to_unit_mean(terms_arr[:, i]) for i in range(3)], axis=1
+        )
+        importance = normalized @ term_weights / term_weights.sum()
+    else:
+        importance = np.ones(len(image_names))
+    importance = np.clip(
+        _normalize_to_unit_mean(importance), *config.relative_importance_range
+    )
+
+    counts = _allocate(
+        config.total_points, importance, np.array(capacities, dtype=np.float64)
+    )
+    return dict(zip(image_names, counts.tolist()))
+
+
+def point_budget_summary(point_budget: Dict[str, int]) -> str:
+    counts = np.array(list(point_budget.values()))
+    if counts.size == 0:
+        return "Point budget: no training images."
+    return (
+        f"Point budget: {counts.sum()} points planned over {counts.size} images "
+        f"(min {counts.min()}, median {int(np.median(counts))}, max {counts.max()} per image)."
+    )
+
+
+@dataclass
+class BudgetDepthSubsampler(DepthSubsampler):
+    """
+    Samples a regular lattice with a fractional stride chosen so that roughly
+    `num_points` valid pixels are selected.
+    """
+
+    num_points: int
+
+    def get_mask(self, rgb, depth, depth_mask):
+        height, width = depth.shape
+        mask = torch.zeros((height, width), dtype=torch.bool, device=depth.device)
+        if self.num_points <= 0:
+            return mask.view(-1)
+
+        num_valid = int(depth_mask.sum()) if depth_mask is not None else depth.numel()
+        stride = max(math.sqrt(num_valid / self.num_points), 1.0)
+        rows = torch.arange(0, height, stride, device=depth.device).long()
+        cols = torch.arange(0, width, stride, device=depth.device).long()
+        mask[rows[:, None], cols[None, :]] = True
+        return mask.view(-1)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Literal, Optional, Tuple
 
 
 @dataclass
@@ -10,3 +10,99 @@ class AdaptiveSubsamplingConfig:
 
     # Range of subsample factors to choose from.
     factor_range: Tuple[int, int] = (5, 15)
+    # Depth quantiles used to reject outliers are estimated from at most this
+    # many randomly chosen depth values. If None, all valid depth values are used.
+    quantile_sample_size: Optional[int] = 100_000
+
+
+@dataclass
+class BudgetSubsamplingConfig:
+    """
+    Configures point budget driven subsampling. Before any depth is predicted,
+    each training view gets an importance score and the budget is split between
+    views proportionally to it.
+    """
+
+    # Target total number of points over all training images.
+    total_points: int = 1_000_000
+    # Weight of the depth range of SfM points visible in the view (log of the
+    # 95th to 5th percentile depth ratio).
+    depth_range_weight: float = 1.0
+    # Weight of the fraction of the image covered by visible SfM points.
+    sfm_coverage_weight: float = 1.0
+    # Weight of the mean colour gradient magnitude of the image.
+    color_gradient_weight: float = 1.0
+    # Longest image side used when estimating the colour gradient.
+    color_gradient_resolution: int = 256
+    # Importance relative to the mean over all views is clamped to this range.
+    relative_importance_range: Tuple[float, float] = (0.25, 4.0)
+
+
+@dataclass
+class EdgeAwareSubsamplingConfig:
+    """
+    Configures edge-aware subsampling, which samples densely around colour and
+    depth edges and sparsely in flat, textureless regions.
+    """
+
+    # Range of subsample factors to choose from. The smallest factor is used at
+    # the strongest edges, the largest in flat regions.
+    factor_range: Tuple[int, int] = (4, 20)
+    # Weight (in [0, 1]) of the colour gradient in the edge importance.
+    color_weight: float = 1.0
+    # Weight (in [0, 1]) of the (log) depth gradient in the edge importance.
+    depth_weight: float = 1.0
+    # Sigma of the Gaussian derivative filter used to estimate gradients.
+    gradient_sigma: float = 1.2
+    # Edges are dilated by twice this radius and smoothed with a Gaussian filter
+    # of this sigma, spreading edge importance to nearby pixels.
+    smoothing_sigma: float = 3.0
+    # Gradients are estimated on the image downscaled by this factor.
+    analysis_downscale: int = 2
+    # Gradient magnitudes at or above this quantile are treated as full strength edges.
+    saturation_quantile: float = 0.95
+
+
+@dataclass
+class BlueNoiseSubsamplingConfig:
+    """
+    Configures blue-noise subsampling, which thresholds a tileable blue-noise mask
+    with a sampling density map instead of sampling regular lattices. This avoids
+    aliasing between overlapping views.
+    """
+
+    # Average subsample factor, i.e. pixels are sampled with probability
+    # 1 / subsample_factor^2 where the density is not modulated.
+    subsample_factor: float = 10.0
+    # What modulates the sampling density. "depth" samples close regions more
+    # sparsely and distant ones more densely (like "adaptive" subsampling),
+    # "gradient" samples colour and depth edges more densely (like "edge_aware"
+    # subsampling, configured by --mdi.edge-aware-subsampling).
+    modulation: Literal["none", "depth", "gradient"] = "none"
+    # Range of local subsample factors used when the density is modulated.
+    factor_range: Tuple[int, int] = (5, 15)
+    # Side of the tileable blue-noise threshold mask in pixels.
+    tile_size: int = 64
+    # Seed of the random offsets of the blue-noise mask in each view.
+    seed: int = 0
+
+
+@dataclass
+class ViewSelectionConfig:
+    """
+    Configures selection of the training views depth is predicted for. Views are
+    picked greedily by the number of SfM points (or voxels containing them) they
+    see which no previously picked view sees, until enough are covered.
+    """
+
+    # Whether SfM points or the voxels containing them have to be covered.
+    # Covering voxels ignores differences in SfM point density.
+    coverage: Literal["points", "voxels"] = "points"
+    # Voxel side length as a fraction of the scene extent. Ignored unless coverage
+    # is "voxels".
+    voxel_size_wrt_scene_extent: float = 0.01
+    # Views are picked until this fraction of the SfM points (or voxels) seen by
+    # any training view is covered.
+    target_coverage: float = 0.95
+    # Maximum number of picked views. None for no limit.
+    max_views: Optional[int] = None
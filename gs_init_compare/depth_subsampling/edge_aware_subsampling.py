@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+import math
+
+import torch
+import torch.nn.functional as F
+
+from gs_init_compare.depth_prediction.utils.image_filtering import (
+    gaussian_filter2d,
+    spatial_gradient_first_order,
+)
+from gs_init_compare.depth_subsampling.adaptive_subsampling import get_sample_mask
+from gs_init_compare.depth_subsampling.config import EdgeAwareSubsamplingConfig
+from gs_init_compare.depth_subsampling.interface import DepthSubsampler
+
+_QUANTILE_MAX_SAMPLES = 100_000
+# Lower bounds of the gradient magnitude treated as a full strength edge, so that
+# noise in nearly flat images is not amplified. Roughly a 15% contrast step in
+# colour (in [0, 1] range) and a 6% relative step in depth.
+_MIN_COLOR_SATURATION = 0.05
+_MIN_LOG_DEPTH_SATURATION = 0.02
+
+
+def _gradient_intensity(
+    x: torch.Tensor, sigma: float, saturation_quantile: float, min_saturation: float
+) -> torch.Tensor:
+    """
+    Args:
+        `x`                   input tensor `[1, C, H, W]`
+        `sigma`               sigma of the Gaussian derivative filter
+        `saturation_quantile` quantile of the gradient magnitude mapped to 1
+        `min_saturation`      lower bound of the magnitude mapped to 1
+    Returns:
+        Gradient magnitude over all channels, scaled to `[0, 1]`. `[H, W]`
+    """
+    magnitude = (
+        spatial_gradient_first_order(x, sigma=sigma).square().sum(dim=(1, 2)).sqrt()
+    ).squeeze(0)
+    flat = magnitude.reshape(-1)
+    sample = flat[:: max(flat.numel() // _QUANTILE_MAX_SAMPLES, 1)]
+    saturation = torch.quantile(sample, saturation_quantile)
+    return torch.clamp(magnitude / saturation.clamp(min=min_saturation), 0, 1)
+
+
+def color_gradient_intensity_map(
+    rgb: torch.Tensor, sigma: float = 1.2, saturation_quantile: float = 0.95
+) -> torch.Tensor:
+    """
+    Args:
+        `rgb`   input RGB image `[H, W, 3]` in `[0, 1]` range
+        `sigma` sigma for gaussian kernel used to approximate gradient of the image
+    Returns:
+        Colour gradient intensity in `[0, 1]`. `[H, W]`
+    """
+    return _gradient_intensity(
+        rgb.permute(2, 0, 1)[None].float(),
+        sigma,
+        saturation_quantile,
+        _MIN_COLOR_SATURATION,
+    )
+
+
+def depth_gradient_intensity_map(
+    depth: torch.Tensor,
+    depth_mask: torch.Tensor,
+    sigma: float = 1.2,
+    saturation_quantile: float = 0.95,
+) -> torch.Tensor:
+    """
+    Gradient of log depth, so that relative depth changes are weighted equally
+    close to and far from the camera. Invalid depth is replaced by the median
+    valid depth.
+
+    Args:
+        `depth`      input depth map `[H, W]`
+        `depth_mask` boolean mask of valid depth values `[H, W]`
+    Returns:
+        Depth gradient intensity in `[0, 1]`. `[H, W]`
+    """
+    valid_depth = depth[depth_mask]
+    fill = valid_depth.median() if valid_depth.numel() > 0 else depth.new_tensor(1.0)
+    log_depth = torch.log(torch.where(depth_mask, depth, fill).clamp(min=1e-6))
+    return _gradient_intensity(
+        log_depth[None, None], sigma, saturation_quantile, _MIN_LOG_DEPTH_SATURATION
+    )
+
+
+def edge_importance_map(
+    rgb: torch.Tensor,
+    depth: torch.Tensor,
+    depth_mask: torch.Tensor,
+    config: EdgeAwareSubsamplingConfig,
+) -> torch.Tensor:
+    """
+    Combines colour and depth gradient intensities into a single importance map.
+    Each pixel takes the larger of the weighted intensities, so an edge present
+    in only one of the two modalities still counts fully. Edges are then dilated
+    and smoothed so that their surroundings are sampled densely too.
+
+    Returns:
+        Importance in `[0, 1]` at `1 / config.analysis_downscale` of the input
+        resolution. `[H', W']`
+    """
+    downscale = config.analysis_downscale
+    if downscale > 1:
+        rgb = F.avg_pool2d(rgb.permute(2, 0, 1)[None].float(), downscale)[0]
+        rgb = rgb.permute(1, 2, 0)
+        depth = F.avg_pool2d(depth[None, None].float(), downscale)[0, 0]
+        depth_mask = F.max_pool2d(
+            (~depth_mask)[None, None].float(), downscale
+        )[0, 0] == 0
+
+    importance = torch.zeros_like(depth, dtype=torch.float32)
+    if config.color_weight > 0:
+        importance = torch.maximum(
+            importance,
+            config.color_weight
+            * color_gradient_intensity_map(
+                rgb, config.gradient_sigma, config.saturation_quantile
+            ),
+        )
+    if config.depth_weight > 0:
+        importance = torch.maximum(
+            importance,
+            config.depth_weight
+            * depth_gradient_intensity_map(
+                depth, depth_mask, config.gradient_sigma, config.saturation_quantile
+            ),
+        )
+
+    if config.smoothing_sigma > 0:
+        radius = math.ceil(2 * config.smoothing_sigma)
+        importance = F.max_pool2d(
+            importance[None, None], 2 * radius + 1, stride=1, padding=radius
+        )
+        importance = gaussian_filter2d(importance, config.smoothing_sigma).squeeze()
+    return torch.clamp(importance, 0, 1)
+
+
+@dataclass
+class EdgeAwareDepthSubsampler(DepthSubsampler):
+    config: EdgeAwareSubsamplingConfig
+
+    def get_mask(self, rgb, depth, depth_mask):
+        importance = edge_importance_map(rgb, depth, depth_mask, self.config)
+        low, high = self.config.factor_range
+        # Round to the closest factor, strongest edges get the smallest one.
+        factor_map = high + 0.5 - (high - low) * importance
+        return get_sample_mask(factor_map, rgb.shape[:2])
@@ -4,11 +4,14 @@ import torch
 
 
 class DepthSubsampler(abc.ABC):
-    def get_mask(self, rgb: torch.Tensor, depth: torch.Tensor) -> torch.Tensor:
+    def get_mask(
+        self, rgb: torch.Tensor, depth: torch.Tensor, depth_mask: torch.Tensor
+    ) -> torch.Tensor:
         """
         Args:
-            `rgb`   input RGB image `[H, W, 3]`
-            `depth` input depth map `[H, W]`
+            `rgb`        input RGB image `[H, W, 3]`
+            `depth`      input depth map `[H, W]`
+            `depth_mask` boolean mask of valid depth values `[H, W]`
         Returns:
             Boolean sampling mask of same shape as flattened depth - [H * W].
             Indicates which points should be used.
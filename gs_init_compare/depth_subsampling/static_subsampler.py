@@ -9,11 +9,6 @@ class StaticDepthSubsampler(DepthSubsampler):
     subsample_factor: int
 
     def get_mask(self, rgb, depth, mask_from_predictor):
-        pixel_coords = torch.cartesian_prod(
-            torch.arange(depth.shape[0]), torch.arange(depth.shape[1])
-        )
-
-        return torch.logical_and(
-            (pixel_coords[:, 0] % self.subsample_factor) == 0,
-            (pixel_coords[:, 1] % self.subsample_factor) == 0,
-        )
+        mask = torch.zeros(depth.shape, dtype=torch.bool, device=depth.device)
+        mask[:: self.subsample_factor, :: self.subsample_factor] = True
+        return mask.view(-1)
@@ -0,0 +1,107 @@
+import logging
+from typing import List, Optional
+
+import numpy as np
+import scipy.sparse
+import torch
+
+from gs_init_compare.datasets.visibility import PointVisibility
+from gs_init_compare.depth_subsampling.config import ViewSelectionConfig
+from gs_init_compare.utils.spatial_hash import sparse_voxel_keys
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _voxel_incidence(
+    visibility: PointVisibility, points: np.ndarray, voxel_size: float
+) -> scipy.sparse.csr_matrix:
+    """Sparse `[I, V]` matrix with ones where a view sees an SfM point in a voxel."""
+    keys, in_grid = sparse_voxel_keys(torch.from_numpy(points).float(), voxel_size)
+    _, voxel_ids = np.unique(keys.numpy(), return_inverse=True)
+    entry_voxels = voxel_ids[visibility.indices]
+    entry_in_grid = in_grid.numpy()[visibility.indices]
+    incidence = scipy.sparse.csr_matrix(
+        (
+            np.ones(entry_in_grid.sum(), dtype=np.float32),
+            (visibility.image_of_entries()[entry_in_grid], entry_voxels[entry_in_grid]),
+        ),
+        shape=(len(visibility), int(voxel_ids.max(initial=-1)) + 1),
+    )
+    # Entries of several points in the same voxel are summed.
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+    return incidence
+
+
+def greedy_cover(
+    incidence: scipy.sparse.csr_matrix,
+    target_coverage: float,
+    max_views: Optional[int] = None,
+) -> List[int]:
+    """
+    Greedily picks views (rows of `incidence`) covering the most not yet covered
+    elements (columns), until `target_coverage` of the elements seen by any view
+    is covered, `max_views` are picked or no view covers anything new.
+
+    Returns:
+        Indices of the picked views, in the order they were picked.
+    """
+    num_views, num_elements = incidence.shape
+    views_of_element = incidence.T.tocsr()
+    num_coverable = int((np.diff(views_of_element.indptr) > 0).sum())
+    # Number of not yet covered elements each view sees.
+    gains = np.diff(incidence.indptr).astype(np.int64)
+    covered = np.zeros(num_elements, dtype=bool)
+    num_covered = 0
+
+    picked: List[int] = []
+    while num_covered < target_coverage * num_coverable and (
+        max_views is None or len(picked) < max_views
+    ):
+        view = int(np.argmax(gains))
+        if gains[view] == 0:
+            break
+        picked.append(view)
+        start, end = incidence.indptr[view : view + 2]
+        elements = incidence.indices[start:end]
+        newly_covered = elements[~covered[elements]]
+        covered[newly_covered] = True
+        num_covered += len(newly_covered)
+        gains -= np.bincount(
+            views_of_element[newly_covered].indices, minlength=num_views
+        )
+    return picked
+
+
+def select_views(parser, config: ViewSelectionConfig) -> List[str]:
+    """
+    Selects the training views whose SfM points (or voxels containing them) cover
+    `config.target_coverage` of those of all training views, see
+    `ViewSelectionConfig`.
+
+    Returns:
+        Names of the selected views, in training dataset order.
+    """
+    image_names = type(parser).DatasetCls(parser, split="train").image_names
+    visibility = PointVisibility.from_arrays(
+        image_names,
+        [parser.point_indices[name] for name in image_names],
+        num_points=len(parser.points),
+    )
+    if config.coverage == "points":
+        incidence = visibility.incidence_matrix()
+    else:
+        incidence = _voxel_incidence(
+            visibility,
+            parser.points,
+            parser.scene_scale * config.voxel_size_wrt_scene_extent,
+        )
+
+    picked = sorted(greedy_cover(incidence, config.target_coverage, config.max_views))
+    covered = np.asarray(incidence[picked].sum(axis=0)).ravel() > 0
+    coverable = np.asarray(incidence.sum(axis=0)).ravel() > 0
+    _LOGGER.info(
+        f"Selected {len(picked)} of {len(image_names)} views, covering "
+        f"{covered.sum()} of {coverable.sum()} SfM {config.coverage}."
+    )
+    return [image_names[i] for i in picked]
@@ -0,0 +1,33 @@
+from dataclasses import dataclass
+
+import torch
+
+from .interface import DepthSubsampler
+
+
+@dataclass
+class VoxelSpacingDepthSubsampler(DepthSubsampler):
+    """
+    Samples pixels on nested power of two grids, each pixel with the coarsest stride
+    at which samples at its depth are at most `spacing` apart in world space (and
+    more than `spacing / 2`, unless every pixel is sampled). Used to integrate depth
+    maps into a volume at a density tied to its voxel size instead of the image
+    resolution.
+    """
+
+    spacing: float
+    focal: float
+    """ Focal length in pixels. """
+
+    def get_mask(self, rgb, depth, depth_mask):
+        height, width = depth.shape
+        rows = torch.arange(height, device=depth.device)
+        cols = torch.arange(width, device=depth.device)
+        coords = rows[:, None] | cols[None, :]
+        # Largest power of two stride of a grid containing the pixel, the origin is
+        # on all grids.
+        level = torch.where(coords == 0, max(height, width), coords & -coords)
+
+        stride = (self.spacing * self.focal / depth.float()).nan_to_num(1.0)
+        stride = torch.exp2(torch.floor(torch.log2(stride.clamp(min=1.0))))
+        return ((level >= stride) & depth_mask).view(-1)
@@ -1,18 +1,21 @@
 import logging
 from pathlib import Path
 import sys
-from typing import List, Type
+from typing import Dict, List, Optional, Set, Type
 
 import torch
+from torch.utils.data import Subset
 from tqdm import tqdm
 
 from gs_init_compare.config import Config
-from gs_init_compare.datasets.colmap import Parser
+from gs_init_compare.datasets.colmap import Dataset, Parser
 from gs_init_compare.depth_prediction.predictors.depth_predictor_interface import (
     CameraIntrinsics,
     DepthPredictor,
 )
 from gs_init_compare.depth_prediction.utils.point_cloud_export import (
+    BackgroundWriter,
+    PlyWriter,
     export_point_cloud_to_ply,
 )
 from gs_init_compare.depth_prediction.points_from_depth import (
@@ -22,8 +25,29 @@ from gs_init_compare.depth_prediction.points_from_depth import (
 from gs_init_compare.depth_subsampling.adaptive_subsampling import (
     AdaptiveDepthSubsampler,
 )
+from gs_init_compare.depth_subsampling.blue_noise_subsampling import (
+    BlueNoiseDepthSubsampler,
+)
+from gs_init_compare.depth_subsampling.edge_aware_subsampling import (
+    EdgeAwareDepthSubsampler,
+)
+from gs_init_compare.depth_subsampling.budget import (
+    BudgetDepthSubsampler,
+    plan_point_budget,
+    point_budget_summary,
+)
+from gs_init_compare.depth_subsampling.view_selection import select_views
+from gs_init_compare.depth_fusion.consistency import DepthConsistencyFilter
+from gs_init_compare.depth_fusion.tsdf import TsdfVolume
 from gs_init_compare.point_cloud_postprocess.postprocess import postprocess_point_cloud
+from gs_init_compare.point_cloud_postprocess.voxel_downsample import (
+    voxel_density_spacing,
+)
+from gs_init_compare.point_cloud_postprocess.voxel_occupancy import VoxelOccupancy
 from gs_init_compare.depth_subsampling.static_subsampler import StaticDepthSubsampler
+from gs_init_compare.depth_subsampling.voxel_spacing_subsampling import (
+    VoxelSpacingDepthSubsampler,
+)
 from gs_init_compare.utils.cuda_memory import cuda_stats_msg
 
 
@@ -95,9 +119,28 @@ def add_noise_to_point_cloud(pts: torch.Tensor, noise_std: float):
     return pts + noise
 
 
-def get_subsampler(cfg: Config):
+def _append_to_ply(writer: PlyWriter, pts: torch.Tensor, rgbs: torch.Tensor):
+    writer.append(pts.cpu().numpy(), rgbs.cpu().numpy())
+
+
+def get_subsampler(cfg: Config, planned_num_points: Optional[int] = None):
+    """
+    Args:
+        `planned_num_points` number of points planned for the image, required for
+                             "budget" subsampling.
+    """
     if cfg.mdi.subsample_factor == "adaptive":
         return AdaptiveDepthSubsampler(cfg.mdi.adaptive_subsampling)
+    elif cfg.mdi.subsample_factor == "budget":
+        if planned_num_points is None:
+            raise ValueError("Budget subsampling requires a planned number of points.")
+        return BudgetDepthSubsampler(planned_num_points)
+    elif cfg.mdi.subsample_factor == "edge_aware":
+        return EdgeAwareDepthSubsampler(cfg.mdi.edge_aware_subsampling)
+    elif cfg.mdi.subsample_factor == "blue_noise":
+        return BlueNoiseDepthSubsampler(
+            cfg.mdi.blue_noise_subsampling, cfg.mdi.edge_aware_subsampling
+        )
     elif isinstance(cfg.mdi.subsample_factor, int):
         return StaticDepthSubsampler(cfg.mdi.subsample_factor)
     else:
@@ -107,6 +150,24 @@ def get_subsampler(cfg: Config):
 def pts_and_rgb_from_monocular_depth(
     config: Config, parser: Parser, device: str = "cuda"
 ):
+    """
+    Returns:
+        Points `[N, 3]`, their colours `[N, 3]`, footprints `[N]` and normals
+        `[N, 3]`, see `get_pts_from_depth`.
+    """
+    selected_views: Optional[Set[str]] = None
+    if config.mdi.select_views:
+        selected_views = set(select_views(parser, config.mdi.view_selection))
+
+    point_budget: Optional[Dict[str, int]] = None
+    if config.mdi.subsample_factor == "budget" and config.mdi.fusion != "tsdf":
+        point_budget = plan_point_budget(
+            parser, config.mdi.budget_subsampling, selected_views
+        )
+        for image_name, num_points in point_budget.items():
+            _LOGGER.info(f"Planned {num_points} points for image {image_name}")
+        print(point_budget_summary(point_budget))
+
     print(cuda_stats_msg(device, "Before loading model"))
     model = pick_model(config)(config, device)
     _LOGGER.info(f"Using depth predictor model: {model.name}")
@@ -117,10 +178,110 @@ def pts_and_rgb_from_monocular_depth(
 
     points_list: List[torch.Tensor] = []
     rgbs_list: List[torch.Tensor] = []
+    footprints_list: List[torch.Tensor] = []
+    normals_list: List[torch.Tensor] = []
+
+    # Point cloud exports are written on a background thread. The final point cloud
+    # is written while images are processed, unless it is fused or postprocessed.
+    export_writer = BackgroundWriter()
+    output_dir = None
+    final_ply_writer = None
+    if config.mdi.pts_output_dir is not None:
+        output_dir = Path(config.mdi.pts_output_dir) / dataset_name
+        output_dir.mkdir(exist_ok=True, parents=True)
+        filename = f"{model.name}_{config.mdi.subsample_factor}_{config.mdi.depth_alignment_strategy.value}"
+        if not config.mdi.postprocess.enabled and config.mdi.fusion == "concatenate":
+            final_ply_writer = PlyWriter(
+                output_dir / f"{filename}.ply", with_colors=True
+            )
+
+    tsdf_volume = None
+    occupancy = None
+    if config.mdi.fusion == "tsdf":
+        voxel_size = parser.scene_scale * config.mdi.tsdf.voxel_size_wrt_scene_extent
+        tsdf_volume = TsdfVolume(
+            voxel_size,
+            voxel_size * config.mdi.tsdf.truncation_voxels,
+            config.mdi.tsdf.max_chunk_elements,
+        )
+    elif config.mdi.redundancy_voxel_size_wrt_scene_extent is not None:
+        occupancy = VoxelOccupancy(
+            parser.scene_scale * config.mdi.redundancy_voxel_size_wrt_scene_extent
+        )
+
+    def accumulate(points, rgbs, footprints, normals, cam2world):
+        if tsdf_volume is not None:
+            tsdf_volume.integrate(points, rgbs, normals, cam2world[:3, 3])
+            return
+        if occupancy is not None:
+            # Drop points already covered by previously processed images.
+            keep = occupancy.add(points)
+            points, rgbs = points[keep], rgbs[keep]
+            footprints, normals = footprints[keep], normals[keep]
+        points_list.append(points)
+        rgbs_list.append(rgbs)
+        footprints_list.append(footprints)
+        normals_list.append(normals)
+        if final_ply_writer is not None:
+            export_writer.submit(_append_to_ply, final_ply_writer, points, rgbs)
+
+    # nerfbaselines datasets only have pinhole cameras.
+    unproject_distorted = config.mdi.unproject_distorted and isinstance(parser, Parser)
+    if unproject_distorted:
+        dataset = Dataset(parser, split="train", undistort=False)
+    else:
+        dataset = type(parser).DatasetCls(parser, split="train")
+    # Depth predicted on distorted images is cached separately.
+    depth_cache_name = dataset_name
+    if unproject_distorted:
+        depth_cache_name += "_distorted"
+    views = dataset
+    view_names = dataset.image_names
+    if selected_views is not None:
+        views = Subset(
+            dataset,
+            [i for i, name in enumerate(dataset.image_names) if name in selected_views],
+        )
+        view_names = [name for name in view_names if name in selected_views]
+
+    # With the consistency filter, a view's points are only accumulated once the
+    # aligned depth of its neighbouring views is known. Until then, they are kept
+    # on the CPU.
+    consistency_filter = None
+    deferred_views: Dict[str, tuple] = {}
+    if config.mdi.depth_consistency_filter:
+        consistency_filter = DepthConsistencyFilter(
+            parser.point_indices, config.mdi.depth_consistency, view_names
+        )
+
+    def accumulate_consistent(image_name, view=None):
+        """
+        Defers the points of the view, if any, and accumulates the points of all
+        deferred views whose neighbours were processed.
+        """
+        if view is None:
+            consistency_filter.skip_view(image_name)
+        else:
+            deferred_views[image_name] = view
+        for name in list(deferred_views):
+            points_device, *tensors, cam2world = deferred_views[name]
+            if not consistency_filter.is_ready(name):
+                tensors = [t.cpu() for t in tensors]
+                deferred_views[name] = (points_device, *tensors, cam2world)
+                continue
+            del deferred_views[name]
+            points, rgbs, footprints, normals = [t.to(points_device) for t in tensors]
+            keep = consistency_filter.consistent(name, points)
+            _LOGGER.info(
+                f"Depth consistency filter kept {int(keep.sum())} of "
+                f"{keep.shape[0]} points of image {name}"
+            )
+            accumulate(
+                points[keep], rgbs[keep], footprints[keep], normals[keep], cam2world
+            )
 
-    dataset = type(parser).DatasetCls(parser, split="train")
     progress_bar = tqdm(
-        dataset,
+        views,
         desc="Calculating init points from monocular depth",
     )
     print("Running monocular depth initialization...")
@@ -129,7 +290,12 @@ def pts_and_rgb_from_monocular_depth(
         cam2world = data["camtoworld"]
         image_name = data["image_name"]
         K = data["K"]
-        intrinsics = CameraIntrinsics(K)
+        intrinsics = CameraIntrinsics(K, parser.exif_focals_35mm.get(image_name))
+        distortion = (
+            parser.camera_distortion(dataset.indices[image_id])
+            if unproject_distorted
+            else None
+        )
 
         # Check that the image is actually 0-255
         assert data["image"].max() > 1
@@ -137,16 +303,33 @@ def pts_and_rgb_from_monocular_depth(
 
         with torch.no_grad():
             predicted_depth = predict_depth_or_get_cached_depth(
-                model, image, intrinsics, image_id, config, dataset_name
+                model, image, intrinsics, image_id, config, depth_cache_name
+            )
+
+        if tsdf_volume is not None:
+            # The volume is integrated at a density tied to its voxel size.
+            subsampler = VoxelSpacingDepthSubsampler(
+                tsdf_volume.voxel_size / config.mdi.tsdf.samples_per_voxel,
+                float(torch.sqrt(K[0, 0] * K[1, 1])),
+            )
+        else:
+            subsampler = get_subsampler(
+                config, point_budget[image_name] if point_budget is not None else None
             )
 
         try:
-            points, adaptive_ds_mask, valid_point_indices = get_pts_from_depth(
+            (
+                points,
+                adaptive_ds_mask,
+                valid_point_indices,
+                footprints,
+                normals,
+            ) = get_pts_from_depth(
                 predicted_depth,
                 image,
                 image_name,
                 parser,
-                get_subsampler(config),
+                subsampler,
                 cam2world,
                 K,
                 config.mdi.depth_alignment_strategy,
@@ -158,6 +341,9 @@ def pts_and_rgb_from_monocular_depth(
                     if config.mdi.pts_output_dir and config.mdi.pts_output_per_image
                     else None
                 ),
+                debug_export_writer=export_writer,
+                depth_consistency_filter=consistency_filter,
+                distortion=distortion,
             )
 
             if config.mdi.noise_std_scene_frac is not None:
@@ -169,6 +355,8 @@ def pts_and_rgb_from_monocular_depth(
             _LOGGER.warning(
                 f"Low depth alignment confidence for image {image_name}: {e}"
             )
+            if consistency_filter is not None:
+                accumulate_consistent(image_name)
             continue
         progress_bar.set_description(
             f"Last processed '{image_name}'",
@@ -177,38 +365,66 @@ def pts_and_rgb_from_monocular_depth(
 
         if points is None:
             _LOGGER.warning(f"Failed to get points for image {image_name}")
+            if consistency_filter is not None:
+                accumulate_consistent(image_name)
             continue
 
         rgbs = image.view([-1, 3])[adaptive_ds_mask]
         # valid point indices are for a downsampled and flattened array
-        rgbs = rgbs[valid_point_indices]
-        points_list.append(points)
-        rgbs_list.append(rgbs.float())
+        rgbs = rgbs[valid_point_indices].float()
+        if consistency_filter is not None:
+            accumulate_consistent(
+                image_name,
+                (points.device, points, rgbs, footprints, normals, cam2world),
+            )
+        else:
+            accumulate(points, rgbs, footprints, normals, cam2world)
 
-    pts = torch.cat(points_list, dim=0).float()
-    rgbs = torch.cat(rgbs_list, dim=0).float()
+    export_writer.close()
+    if final_ply_writer is not None:
+        final_ply_writer.close()
+        _LOGGER.info(f"Saved point cloud to {final_ply_writer.path}")
+
+    if tsdf_volume is not None:
+        pts, rgbs, normals = tsdf_volume.extract_points(
+            config.mdi.tsdf.min_weight, config.mdi.tsdf.min_views
+        )
+        footprints = torch.full_like(pts[:, 0], tsdf_volume.voxel_size)
+    else:
+        pts = torch.cat(points_list, dim=0).float()
+        rgbs = torch.cat(rgbs_list, dim=0).float()
+        footprints = torch.cat(footprints_list, dim=0).float()
+        normals = torch.cat(normals_list, dim=0).float()
 
     print("Num points before postprocess:", pts.shape[0])
-    pts, rgbs = postprocess_point_cloud(
-        pts, rgbs, parser.scene_scale, config.mdi.postprocess
+    pts, rgbs, footprints, normals = postprocess_point_cloud(
+        pts, rgbs, parser.scene_scale, config.mdi.postprocess, footprints, normals
     )
     print("Num points after postprocess:", pts.shape[0])
 
-    if config.mdi.pts_output_dir is not None:
-        output_dir = Path(config.mdi.pts_output_dir) / dataset_name
-        output_dir.mkdir(exist_ok=True, parents=True)
-        filename = f"{model.name}_{config.mdi.subsample_factor}_{config.mdi.depth_alignment_strategy.value}"
-        export_point_cloud_to_ply(
-            pts.cpu().numpy(),
-            rgbs.cpu().numpy(),
-            output_dir,
-            filename,
-            outlier_std_dev=None,
+    if config.mdi.footprint_clamp_voxel_size_wrt_scene_extent is not None:
+        footprints = torch.minimum(
+            footprints,
+            voxel_density_spacing(
+                pts,
+                parser.scene_scale
+                * config.mdi.footprint_clamp_voxel_size_wrt_scene_extent,
+            ),
         )
+
+    if output_dir is not None:
+        if final_ply_writer is None:
+            export_point_cloud_to_ply(
+                pts.cpu().numpy(),
+                rgbs.cpu().numpy(),
+                output_dir,
+                filename,
+                outlier_std_dev=None,
+            )
         export_point_cloud_to_ply(
             parser.points, parser.points_rgb / 255.0, output_dir, "sfm"
         )
         if config.mdi.pts_only:
             sys.exit(0)
 
-    return pts, rgbs
+    return pts, rgbs, footprints, normals
@@ -6,3 +6,8 @@ class PointCloudPostprocessConfig:
     voxel_subsample: bool = False
     voxel_size_wrt_scene_extent: float = 2e-3
     outlier_removal: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        """Whether postprocessing changes the point cloud."""
+        return self.voxel_subsample or self.outlier_removal
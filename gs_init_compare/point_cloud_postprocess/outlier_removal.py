@@ -0,0 +1,52 @@
+from typing import NamedTuple, Optional
+
+import torch
+
+from gs_init_compare.utils.spatial_hash import (
+    DEFAULT_MAX_CHUNK_ELEMENTS,
+    KnnResult,
+    grid_knn,
+)
+
+
+class OutlierRemovalResult(NamedTuple):
+    # Mask of points kept `[N]`.
+    inliers: torch.Tensor
+    # Neighbours of all input points (including themselves) used for the decision,
+    # only set if requested.
+    knn: Optional[KnnResult]
+
+
+def remove_statistical_outliers(
+    pts: torch.Tensor,
+    nb_neighbors: int = 20,
+    std_ratio: float = 2.5,
+    return_knn: bool = False,
+    max_chunk_elements: int = DEFAULT_MAX_CHUNK_ELEMENTS,
+) -> OutlierRemovalResult:
+    """
+    Statistical outlier removal with the same criterion as Open3D's
+    `remove_statistical_outlier`: a point is kept if the mean distance to its
+    `nb_neighbors` nearest neighbours (including itself) is positive and below the
+    mean of these distances over all points plus `std_ratio` standard deviations.
+
+    Runs on the points' device, neighbours are searched in bounded chunks using
+    `grid_knn`.
+
+    Args:
+        pts: Points `[N, 3]`.
+        return_knn: Whether to return the computed neighbours, e.g. for reuse by later
+            stages. Their indices refer to the input points.
+    """
+    if pts.shape[0] == 0:
+        return OutlierRemovalResult(
+            torch.zeros(0, dtype=torch.bool, device=pts.device), None
+        )
+
+    knn = grid_knn(pts, min(nb_neighbors, pts.shape[0]), max_chunk_elements)
+    mean_distances = knn.distances.double().mean(dim=1)
+    valid = mean_distances > 0
+    valid_distances = mean_distances[valid]
+    threshold = valid_distances.mean() + std_ratio * valid_distances.std()
+    inliers = valid & (mean_distances < threshold)
+    return OutlierRemovalResult(inliers, knn if return_knn else None)
@@ -1,8 +1,10 @@
-import numpy as np
+from typing import Optional
+
 import torch
-import open3d as o3d
 
 from .config import PointCloudPostprocessConfig
+from .outlier_removal import remove_statistical_outliers
+from .voxel_downsample import voxel_downsample
 
 
 def postprocess_point_cloud(
@@ -10,25 +12,28 @@ def postprocess_point_cloud(
     rgbs: torch.Tensor,
     scene_scale: float,
     config: PointCloudPostprocessConfig,
+    footprints: Optional[torch.Tensor] = None,
+    normals: Optional[torch.Tensor] = None,
 ):
-    point_cloud = o3d.geometry.PointCloud()
-    point_cloud.points = o3d.utility.Vector3dVector(pts.cpu().numpy())
-    point_cloud.colors = o3d.utility.Vector3dVector(rgbs.cpu().numpy())
+    """
+    Returns:
+        Postprocessed points, colours, footprints and normals (`None` if not given).
+    """
+    if not config.enabled:
+        return pts, rgbs, footprints, normals
+
     if config.voxel_subsample:
         voxel_size = scene_scale * config.voxel_size_wrt_scene_extent
-        point_cloud = point_cloud.voxel_down_sample(voxel_size)
+        pts, rgbs, footprints, normals = voxel_downsample(
+            pts, rgbs, voxel_size, footprints, normals
+        )
 
     if config.outlier_removal:
-        point_cloud, _ = point_cloud.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.5)
+        inliers, _ = remove_statistical_outliers(pts, nb_neighbors=20, std_ratio=2.5)
+        pts, rgbs = pts[inliers], rgbs[inliers]
+        if footprints is not None:
+            footprints = footprints[inliers]
+        if normals is not None:
+            normals = normals[inliers]
 
-    pts = torch.tensor(
-        np.asarray(point_cloud.points),
-        device=pts.device,
-        dtype=pts.dtype,
-    )
-    rgbs = torch.tensor(
-        np.asarray(point_cloud.colors),
-        device=rgbs.device,
-        dtype=rgbs.dtype,
-    )
-    return pts, rgbs
+    return pts, rgbs, footprints, normals
@@ -0,0 +1,70 @@
+from typing import Optional, Tuple
+
+import torch
+
+from gs_init_compare.utils.spatial_hash import voxel_coords, voxel_keys
+
+
+def voxel_downsample(
+    pts: torch.Tensor,
+    rgbs: torch.Tensor,
+    voxel_size: float,
+    footprints: Optional[torch.Tensor] = None,
+    normals: Optional[torch.Tensor] = None,
+) -> Tuple[
+    torch.Tensor, torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]
+]:
+    """
+    Replaces the points in each occupied voxel by their mean position and colour,
+    like Open3D's `voxel_down_sample`, but on the tensors' device.
+
+    Args:
+        pts: Point positions `[N, 3]`.
+        rgbs: Point colours `[N, 3]`.
+        voxel_size: Voxel side length.
+        footprints: Optional per-point footprint sizes `[N]`. Merged points get the
+            mean footprint, but at least the voxel size.
+        normals: Optional consistently oriented unit normals `[N, 3]`. Merged points
+            get the normalized mean normal.
+
+    Returns:
+        Downsampled positions, colours, footprints and normals (if given), `[M, 3]`,
+        `[M, 3]`, `[M]` and `[M, 3]`, ordered by voxel.
+    """
+    if pts.shape[0] == 0:
+        return pts, rgbs, footprints, normals
+
+    keys = voxel_keys(voxel_coords(pts, voxel_size))
+    unique_keys, inverse = torch.unique(keys, return_inverse=True)
+    num_voxels = unique_keys.shape[0]
+
+    def voxel_mean(values: torch.Tensor) -> torch.Tensor:
+        return values.new_zeros((num_voxels, values.shape[1])).scatter_reduce_(
+            0,
+            inverse[:, None].expand(-1, values.shape[1]),
+            values,
+            reduce="mean",
+            include_self=False,
+        )
+
+    if footprints is not None:
+        footprints = voxel_mean(footprints[:, None]).squeeze(1).clamp(min=voxel_size)
+    if normals is not None:
+        normals = torch.nn.functional.normalize(voxel_mean(normals), dim=-1)
+    return voxel_mean(pts), voxel_mean(rgbs), footprints, normals
+
+
+def voxel_density_spacing(pts: torch.Tensor, voxel_size: float) -> torch.Tensor:
+    """
+    Estimates the spacing of points lying on surfaces from the number of points `n`
+    in their voxel as `voxel_size / sqrt(n)`. Unlike per-view footprints, this
+    accounts for points of overlapping views.
+
+    Returns:
+        Per-point spacing `[N]`.
+    """
+    if pts.shape[0] == 0:
+        return pts.new_zeros(0)
+    keys = voxel_keys(voxel_coords(pts, voxel_size))
+    _, inverse, counts = torch.unique(keys, return_inverse=True, return_counts=True)
+    return voxel_size * counts[inverse].to(pts.dtype).rsqrt()
@@ -0,0 +1,63 @@
+"""
+Online pruning of points falling into voxels already occupied by previously added
+points, used to drop redundant points of overlapping views as they are produced.
+"""
+
+from typing import List
+
+import torch
+
+from gs_init_compare.utils.spatial_hash import sparse_voxel_keys
+
+
+class VoxelOccupancy:
+    """
+    Sparse set of occupied voxels of a grid anchored at the origin, which is updated
+    as the points of each view are added.
+
+    Occupied voxel keys are kept in sorted runs of geometrically decreasing size, the
+    last runs are merged whenever a new run would be similarly large. Adding `N`
+    points to `M` occupied voxels thus takes `O(N log^2 M)` lookups plus amortized
+    `O(log M)` re-sorting per occupied voxel.
+    """
+
+    def __init__(self, voxel_size: float):
+        self.voxel_size = voxel_size
+        self._runs: List[torch.Tensor] = []
+
+    @property
+    def num_occupied(self) -> int:
+        return sum(run.shape[0] for run in self._runs)
+
+    def _occupied(self, keys: torch.Tensor) -> torch.Tensor:
+        occupied = torch.zeros_like(keys, dtype=torch.bool)
+        for run in self._runs:
+            idx = torch.searchsorted(run, keys).clamp_(max=run.shape[0] - 1)
+            occupied |= run[idx] == keys
+        return occupied
+
+    def add(self, pts: torch.Tensor) -> torch.Tensor:
+        """
+        Marks the voxels of `pts` as occupied.
+
+        Args:
+            pts: Points `[N, 3]` of a single view.
+
+        Returns:
+            Mask `[N]` of points whose voxel was not occupied before adding `pts`.
+            Points outside the grid (more than 2^20 voxels from the origin) are kept.
+        """
+        keys, in_grid = sparse_voxel_keys(pts, self.voxel_size)
+        keep = ~self._occupied(keys) | ~in_grid
+        new_keys = torch.unique(keys[keep & in_grid])
+        if new_keys.shape[0] == 0:
+            return keep
+
+        self._runs.append(new_keys)
+        while (
+            len(self._runs) > 1
+            and self._runs[-2].shape[0] <= 2 * self._runs[-1].shape[0]
+        ):
+            last = self._runs.pop()
+            self._runs[-1] = torch.sort(torch.cat([self._runs[-1], last])).values
+        return keep
@@ -27,6 +27,7 @@ from typing_extensions import assert_never
 
 from gs_init_compare.config import Config
 from gs_init_compare.datasets.colmap import Dataset, Parser
+from gs_init_compare.datasets.device_dataset import DeviceDataset
 from gs_init_compare.datasets.traj import (
     generate_ellipse_path_z,
     generate_interpolated_path,
@@ -43,6 +44,7 @@ from gs_init_compare.utils.runner_utils import (
     AppearanceOptModule,
     CameraOptModule,
     knn,
+    quats_from_normals,
     rgb_to_sh,
     set_random_seed,
 )
@@ -66,14 +68,20 @@ def create_splats_with_optimizers(
     world_rank: int = 0,
     world_size: int = 1,
 ) -> Tuple[torch.nn.ParameterDict, Dict[str, torch.optim.Optimizer]]:
+    footprints = normals = None
     if init_type == "sfm":
-        points = torch.from_numpy(parser.points).float()
-        rgbs = torch.from_numpy(parser.points_rgb / 255.0).float()
+        points = torch.from_numpy(parser.points).to(device, torch.float32)
+        rgbs = torch.from_numpy(parser.points_rgb / 255.0).to(device, torch.float32)
     elif init_type == "random":
-        points = init_extent * scene_scale * (torch.rand((init_num_pts, 3)) * 2 - 1)
-        rgbs = torch.rand((init_num_pts, 3))
+        points = init_extent * scene_scale * (
+            torch.rand((init_num_pts, 3), device=device) * 2 - 1
+        )
+        rgbs = torch.rand((init_num_pts, 3), device=device)
     elif init_type == "monocular_depth":
-        points, rgbs = pts_and_rgb_from_monocular_depth(config, parser, device)
+        points, rgbs, footprints, normals = pts_and_rgb_from_monocular_depth(
+            config, parser, device
+        )
+        points, rgbs = points.to(device), rgbs.to(device)
         # Force garbage collection to free up memory
         # Without this, AppleDepthPro CUDA memory is not released
         gc.collect()
@@ -82,19 +90,32 @@ def create_splats_with_optimizers(
 
     print(cuda_stats_msg(device, "After loading points and rgbs"))
 
-    # Initialize the GS size to be the average dist of the 3 nearest neighbors
-    dist2_avg = (knn(points, 4)[:, 1:] ** 2).mean(dim=-1)  # [N,]
-    dist_avg = torch.sqrt(dist2_avg)
-    scales = torch.log(dist_avg * init_scale).unsqueeze(-1).repeat(1, 3)  # [N, 3]
-
-    # Distribute the GSs to different ranks (also works for single rank)
-    points = points[world_rank::world_size]
-    rgbs = rgbs[world_rank::world_size]
-    scales = scales[world_rank::world_size]
+    if footprints is not None and config.mdi.initial_scale == "footprint":
+        # Initialize the GS size to be the image footprint of the points
+        dist_avg = footprints.to(points)
+    else:
+        # Initialize the GS size to be the average dist of the 3 nearest neighbors
+        dists = knn(points, 4, device=config.init_knn_device, eps=config.init_knn_eps)
+        dist2_avg = (dists[:, 1:] ** 2).mean(dim=-1)  # [N,]
+        dist_avg = torch.sqrt(dist2_avg)
+
+    # Distribute the GSs to different ranks (also works for single rank) before
+    # creating the per-GS parameters, only neighbour distances need all points
+    shard = slice(world_rank, None, world_size)
+    points = points[shard].contiguous()
+    rgbs = rgbs[shard]
+    dist_avg = dist_avg[shard]
+    init_discs = normals is not None and config.mdi.initial_orientation == "normal"
 
     N = points.shape[0]
-    quats = torch.rand((N, 4))  # [N, 4]
-    opacities = torch.logit(torch.full((N,), init_opacity))  # [N,]
+    scales = torch.log(dist_avg * init_scale).unsqueeze(-1).repeat(1, 3)  # [N, 3]
+    if init_discs:
+        # Flatten the GSs along their local z axis, which is aligned to the normal
+        scales[:, 2] += math.log(config.mdi.disc_thickness)
+        quats = quats_from_normals(normals[shard].to(points))
+    else:
+        quats = torch.rand((N, 4), device=device)  # [N, 4]
+    opacities = torch.logit(torch.full((N,), init_opacity, device=device))  # [N,]
 
     params = [
         # name, value, lr
@@ -106,18 +127,18 @@ def create_splats_with_optimizers(
 
     if feature_dim is None:
         # color is SH coefficients.
-        colors = torch.zeros((N, (sh_degree + 1) ** 2, 3))  # [N, K, 3]
-        colors[:, 0, :] = rgb_to_sh(rgbs)
-        params.append(("sh0", torch.nn.Parameter(colors[:, :1, :]), 2.5e-3))
-        params.append(("shN", torch.nn.Parameter(colors[:, 1:, :]), 2.5e-3 / 20))
+        sh0 = rgb_to_sh(rgbs).unsqueeze(1)  # [N, 1, 3]
+        shN = torch.zeros((N, (sh_degree + 1) ** 2 - 1, 3), device=device)
+        params.append(("sh0", torch.nn.Parameter(sh0), 2.5e-3))
+        params.append(("shN", torch.nn.Parameter(shN), 2.5e-3 / 20))
     else:
         # features will be used for appearance and view-dependent shading
-        features = torch.rand(N, feature_dim)  # [N, feature_dim]
+        features = torch.rand(N, feature_dim, device=device)  # [N, feature_dim]
         params.append(("features", torch.nn.Parameter(features), 2.5e-3))
         colors = torch.logit(rgbs)  # [N, 3]
         params.append(("colors", torch.nn.Parameter(colors), 2.5e-3))
 
-    splats = torch.nn.ParameterDict({n: v for n, v, _ in params}).to(device)
+    splats = torch.nn.ParameterDict({n: v for n, v, _ in params})
     # Scale learning rate based on batch size, reference:
     # https://www.cs.princeton.edu/~smalladi/blog/2024/01/22/SDEs-ScalingRules/
     # Note that this would not make the training exactly equivalent, see
@@ -169,6 +190,8 @@ class Runner:
             factor=cfg.data_factor,
             normalize=cfg.normalize_world_space,
             test_every=cfg.test_every,
+            cache_dir=cfg.parser_cache_dir,
+            cache_images=cfg.cache_images,
         )
         self.trainset = Dataset(
             self.parser,
@@ -405,6 +428,16 @@ class Runner:
                 )
             )
 
+        self.device_trainset = (
+            DeviceDataset.create_if_fits(
+                self.trainset,
+                device,
+                cfg.batch_size,
+                cfg.device_dataset_max_memory_fraction,
+            )
+            if cfg.device_dataset
+            else None
+        )
         trainloader = torch.utils.data.DataLoader(
             self.trainset,
             batch_size=cfg.batch_size,
@@ -413,7 +446,8 @@ class Runner:
             persistent_workers=True,
             pin_memory=True,
         )
-        trainloader_iter = iter(trainloader)
+        # The DataLoader workers are only started if the device dataset isn't used.
+        trainloader_iter = iter(trainloader) if self.device_trainset is None else None
 
         # Training loop.
         global_tic = time.time()
@@ -429,17 +463,25 @@ class Runner:
                 self.viewer.lock.acquire()
                 tic = time.time()
 
-            try:
-                data = next(trainloader_iter)
-            except StopIteration:
-                trainloader_iter = iter(trainloader)
-                data = next(trainloader_iter)
+            if self.device_trainset is not None:
+                data = self.device_trainset.next_batch()
+            else:
+                try:
+                    data = next(trainloader_iter)
+                except StopIteration:
+                    trainloader_iter = iter(trainloader)
+                    data = next(trainloader_iter)
 
             cam_to_worlds = cam_to_worlds_gt = data["camtoworld"].to(
                 device
             )  # [1, 4, 4]
             Ks = data["K"].to(device)  # [1, 3, 3]
-            pixels = data["image"].to(device) / 255.0  # [1, H, W, 3]
+            # Images of the device dataset are already normalized.
+            pixels = (
+                data["image"]
+                if self.device_trainset is not None
+                else data["image"].to(device) / 255.0
+            )  # [1, H, W, 3]
             num_train_rays_per_step = (
                 pixels.shape[0] * pixels.shape[1] * pixels.shape[2]
             )
@@ -3,12 +3,13 @@ from typing import Optional
 
 import numpy as np
 import torch
-from sklearn.neighbors import NearestNeighbors
 from torch import Tensor
 import torch.nn.functional as F
 import matplotlib.pyplot as plt
 from matplotlib import colormaps
 
+from gs_init_compare.utils.spatial_hash import grid_knn
+
 
 class CameraOptModule(torch.nn.Module):
     """Camera pose optimization module."""
@@ -139,11 +140,41 @@ def rotation_6d_to_matrix(d6: Tensor) -> Tensor:
     return torch.stack((b1, b2, b3), dim=-2)
 
 
-def knn(x: Tensor, K: int = 4) -> Tensor:
-    x_np = x.cpu().numpy()
-    model = NearestNeighbors(n_neighbors=K, metric="euclidean").fit(x_np)
-    distances, _ = model.kneighbors(x_np)
-    return torch.from_numpy(distances).to(x)
+def knn(
+    x: Tensor, K: int = 4, device: Optional[str] = None, eps: float = 0.0
+) -> Tensor:
+    """
+    Distances of each point to its K nearest neighbours (including itself) in
+    ascending order `[N, K]`, on the device and with the dtype of `x`.
+
+    Args:
+        device: Device to run the search on, defaults to the device of `x`. On CPU
+            the search uses all torch intra-op threads.
+        eps: Allowed relative error of the distances, 0 for exact search.
+    """
+    search_device = x.device if device is None else device
+    distances, _ = grid_knn(x.to(search_device), K, eps=eps)
+    return distances.to(x)
+
+
+def quats_from_normals(normals: Tensor) -> Tensor:
+    """
+    Quaternions (wxyz) of rotations mapping the local z axis to unit `normals`
+    `[N, 3]` (up to sign, which does not matter for symmetric Gaussians).
+    Zero normals give the identity.
+    """
+    # Flip normals to the upper hemisphere, where the shortest arc from z is stable.
+    normals = torch.where(normals[:, 2:] < 0, -normals, normals)
+    quats = torch.stack(
+        [
+            1 + normals[:, 2],
+            -normals[:, 1],
+            normals[:, 0],
+            torch.zeros_like(normals[:, 0]),
+        ],
+        dim=-1,
+    )
+    return F.normalize(quats, dim=-1)
 
 
 def rgb_to_sh(rgb: Tensor) -> Tensor:
@@ -0,0 +1,474 @@
+"""
+Voxel hashing of point clouds and an exact k-nearest neighbour search built on it.
+
+Points are hashed to Morton codes of their voxel on a fine grid and sorted by code.
+This implicitly forms an octree: the points of any cell, at any level, are a contiguous
+range of the sorted points found by binary search. All work is done with torch
+operations on the points' device, so it runs on GPU or on the CPU intra-op threads.
+"""
+
+import math
+from typing import NamedTuple, Optional, Tuple
+
+import torch
+
+# Upper bound on the number of distance evaluations per batch in `grid_knn`.
+DEFAULT_MAX_CHUNK_ELEMENTS = 2**24
+# Bits per axis of Morton codes, 3 * 21 bits fit into int64.
+MORTON_BITS = 21
+# Number of query cells whose neighbourhoods are looked up at once in `grid_knn`.
+_CELLS_PER_CHUNK = 2**16
+# Ratio by which `grid_knn` shrinks the Morton window bounds to estimate the k-th
+# neighbour distances, trading smaller blocks for more re-searched points.
+_WINDOW_BOUND_RATIO = 1.5
+
+
+def voxel_coords(
+    pts: torch.Tensor, voxel_size: float, origin: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """
+    Integer voxel coordinates of points, `[N, 3]` int64. Unless `origin` is given,
+    the grid is anchored half a voxel below the minimum bound (matching Open3D), so
+    all coordinates are non-negative.
+    """
+    if origin is None:
+        origin = pts.min(dim=0).values - voxel_size / 2
+    return torch.floor((pts - origin) / voxel_size).long()
+
+
+def voxel_keys(coords: torch.Tensor) -> torch.Tensor:
+    """
+    Linearizes non-negative voxel coordinates `[N, 3]` into unique int64 keys `[N]`.
+    Falls back to ranks of unique coordinate rows if the grid does not fit into int64.
+    """
+    extent = coords.max(dim=0).values + 1
+    if extent.double().prod() < torch.iinfo(torch.int64).max:
+        return (coords[:, 0] * extent[1] + coords[:, 1]) * extent[2] + coords[:, 2]
+    _, keys = torch.unique(coords, dim=0, return_inverse=True)
+    return keys
+
+
+# Sparse voxel coordinates are offset by this, so the grid is centered on the origin.
+_SPARSE_COORD_OFFSET = 2 ** (MORTON_BITS - 1)
+
+
+def sparse_voxel_keys(
+    pts: torch.Tensor, voxel_size: float
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Keys of the voxels of points on a fixed grid anchored at the origin, with 21 bit
+    coordinates packed into int64. Unlike `voxel_keys`, keys of different point sets
+    are comparable, so they can be used to hash voxels across batches of points.
+
+    Returns:
+        Keys `[N]` and a mask `[N]` of points inside the grid (less than 2^20 voxels
+        from the origin), the keys of other points are meaningless.
+    """
+    coords = torch.floor(pts / voxel_size) + _SPARSE_COORD_OFFSET
+    in_grid = ((coords >= 0) & (coords < 2**MORTON_BITS)).all(dim=-1)
+    coords = coords.clamp(0, 2**MORTON_BITS - 1).long()
+    keys = (coords[..., 0] << 2 * MORTON_BITS) | (coords[..., 1] << MORTON_BITS)
+    return keys | coords[..., 2], in_grid
+
+
+def sparse_voxel_centers(keys: torch.Tensor, voxel_size: float) -> torch.Tensor:
+    """Centers `[N, 3]` of voxels with keys `[N]` from `sparse_voxel_keys`."""
+    mask = 2**MORTON_BITS - 1
+    coords = torch.stack(
+        [keys >> 2 * MORTON_BITS, keys >> MORTON_BITS & mask, keys & mask], dim=-1
+    )
+    return (coords - _SPARSE_COORD_OFFSET + 0.5) * voxel_size
+
+
+# Bits of the lowest axis of 21 bit Morton codes.
+_DILATED_MASK = 0x1249249249249249
+
+
+def _spread_bits(values: torch.Tensor) -> torch.Tensor:
+    """Moves the lower 21 bits of each value to every third bit."""
+    values = values & 0x1FFFFF
+    values = (values | values << 32) & 0x1F00000000FFFF
+    values = (values | values << 16) & 0x1F0000FF0000FF
+    values = (values | values << 8) & 0x100F00F00F00F00F
+    values = (values | values << 4) & 0x10C30C30C30C30C3
+    values = (values | values << 2) & _DILATED_MASK
+    return values
+
+
+def morton_codes(coords: torch.Tensor) -> torch.Tensor:
+    """Interleaves non-negative 21 bit voxel coordinates `[..., 3]` into int64 codes."""
+    return (
+        _spread_bits(coords[..., 0]) << 2
+        | _spread_bits(coords[..., 1]) << 1
+        | _spread_bits(coords[..., 2])
+    )
+
+
+def _round_up_bucket(sizes: torch.Tensor) -> torch.Tensor:
+    """Rounds sizes up to powers of sqrt(2), bounding padding to ~41%."""
+    exponents = torch.ceil(2 * torch.log2(sizes.clamp(min=1).double()))
+    return torch.ceil(torch.pow(2.0, exponents / 2)).long()
+
+
+class MortonOctree:
+    """
+    Points sorted by the Morton codes of their voxels on a `2^21`-per-axis grid over
+    their bounding cube. A cell at `level` groups `2^level` voxels per axis; its points
+    share the code bits above `3 * level` and are thus contiguous in sorted order.
+
+    Attributes:
+        order: Permutation sorting the points by code `[N]`.
+        sorted_pts: Points in sorted order `[N, 3]`.
+        sorted_codes: Sorted codes `[N]`.
+        sorted_voxels: Voxel coordinates of the sorted points `[N, 3]`.
+        voxel_size: Side of the finest voxels.
+    """
+
+    # Cells at this level are half of the bounding cube, so the 3x3x3 block of cells
+    # around any cell covers all points.
+    MAX_LEVEL = MORTON_BITS - 1
+
+    def __init__(self, pts: torch.Tensor):
+        origin = pts.min(dim=0).values
+        extent = float((pts.max(dim=0).values - origin).max())
+        self.origin = origin
+        self.voxel_size = max(extent, 1e-12) / (2**MORTON_BITS - 1)
+        voxels = voxel_coords(pts, self.voxel_size, origin).clamp(
+            0, 2**MORTON_BITS - 1
+        )
+        self.sorted_codes, self.order = torch.sort(morton_codes(voxels))
+        self.sorted_pts = pts[self.order]
+        self.sorted_voxels = voxels[self.order]
+        self._cells = {}
+
+    def level_for_radius(self, radius: torch.Tensor) -> torch.Tensor:
+        """Finest levels whose cells are at least `radius` wide."""
+        level = torch.ceil(torch.log2(radius.double() / self.voxel_size).clamp(min=0))
+        return torch.nan_to_num(level, posinf=self.MAX_LEVEL).clamp(
+            max=self.MAX_LEVEL
+        ).long()
+
+    def cells(self, level: int):
+        """
+        Occupied cells at `level`, cached per level.
+
+        Returns:
+            Sorted codes of the cells, indices of their first sorted points and their
+            numbers of points, `[C]` each.
+        """
+        if level not in self._cells:
+            codes, counts = torch.unique_consecutive(
+                self.sorted_codes >> (3 * level), return_counts=True
+            )
+            self._cells[level] = (codes, torch.cumsum(counts, 0) - counts, counts)
+        return self._cells[level]
+
+    def block_ranges(self, voxels: torch.Tensor, level: torch.Tensor):
+        """
+        Ranges of sorted points in the 3x3x3 blocks of cells at `level` `[B]` around
+        the cells containing `voxels` `[B, 3]`. Any point within one cell size of a
+        point in the center cell lies in its block. Fastest if sorted by level.
+
+        Returns:
+            Starts and lengths of the ranges, `[B, 27]` each.
+        """
+        cells = voxels >> level[:, None]
+        # Codes of the neighbouring cells per axis by dilated integer arithmetic,
+        # `[B, 3, 3]` for offsets -1, 0, 1 and the three axes.
+        spread = _spread_bits(cells)
+        axis_codes = torch.stack(
+            [
+                (spread - 1) & _DILATED_MASK,
+                spread,
+                ((spread | ~_DILATED_MASK) + 1) & _DILATED_MASK,
+            ],
+            dim=1,
+        )
+        num_cells = (2**MORTON_BITS >> level)[:, None, None]
+        steps = torch.arange(-1, 2, device=voxels.device)[None, :, None]
+        axis_valid = (cells[:, None, :] + steps >= 0) & (
+            cells[:, None, :] + steps < num_cells
+        )
+        codes = (
+            axis_codes[:, :, None, None, 0] << 2
+            | axis_codes[:, None, :, None, 1] << 1
+            | axis_codes[:, None, None, :, 2]
+        ).view(-1, 27)
+        valid = (
+            axis_valid[:, :, None, None, 0]
+            & axis_valid[:, None, :, None, 1]
+            & axis_valid[:, None, None, :, 2]
+        ).view(-1, 27)
+
+        # Look up the cells in runs of equal levels, a single run if sorted by level.
+        starts, lengths = [], []
+        run_levels, run_lengths = torch.unique_consecutive(level, return_counts=True)
+        for lvl, run_codes, run_valid in zip(
+            run_levels.tolist(),
+            codes.split(run_lengths.tolist()),
+            valid.split(run_lengths.tolist()),
+        ):
+            cell_codes, cell_starts, cell_counts = self.cells(lvl)
+            pos = torch.searchsorted(cell_codes, run_codes).clamp(
+                max=cell_codes.shape[0] - 1
+            )
+            found = run_valid & (cell_codes[pos] == run_codes)
+            starts.append(cell_starts[pos])
+            lengths.append(torch.where(found, cell_counts[pos], 0))
+        return torch.cat(starts), torch.cat(lengths)
+
+    def block_clearance(self, queries: torch.Tensor, level: torch.Tensor):
+        """
+        Distances of sorted points `queries` `[B]` to the boundary of the 3x3x3 blocks
+        of cells at `level` `[B]` around them, ignoring sides beyond the bounding
+        cube. All points within that distance lie in the block.
+        """
+        cells = self.sorted_voxels[queries] >> level[:, None]
+        cell_size = self.voxel_size * torch.pow(2.0, level.double())[:, None]
+        local = (self.sorted_pts[queries] - self.origin).double()
+        below = torch.where(cells > 0, local - (cells - 1) * cell_size, math.inf)
+        num_cells = (2**MORTON_BITS >> level)[:, None]
+        above = torch.where(
+            cells + 2 < num_cells, (cells + 2) * cell_size - local, math.inf
+        )
+        return torch.minimum(below, above).min(dim=1).values
+
+
+class KnnResult(NamedTuple):
+    # Euclidean distances to the neighbours in ascending order `[N, K]`.
+    distances: torch.Tensor
+    # Indices of the neighbours `[N, K]`.
+    indices: torch.Tensor
+
+
+def _window_knn_bounds(
+    octree: MortonOctree, k: int, max_chunk_elements: int
+) -> torch.Tensor:
+    """
+    Upper bounds of the k-th neighbour distances of the sorted points, given by the
+    k-th nearest point among the `2k + 1` points around each point in Morton order.
+    """
+    num_pts = octree.sorted_pts.shape[0]
+    window = min(num_pts, 2 * k + 1)
+    offsets = torch.arange(window, device=octree.sorted_pts.device)
+    chunk_size = max(1, max_chunk_elements // window)
+    bounds = []
+    for chunk_start in range(0, num_pts, chunk_size):
+        queries = torch.arange(
+            chunk_start,
+            min(num_pts, chunk_start + chunk_size),
+            device=octree.sorted_pts.device,
+        )
+        window_starts = (queries - window // 2).clamp(0, num_pts - window)
+        candidates = octree.sorted_pts[window_starts[:, None] + offsets]
+        dists = torch.linalg.vector_norm(
+            candidates - octree.sorted_pts[queries][:, None], dim=-1
+        )
+        bounds.append(torch.kthvalue(dists, k, dim=1).values)
+    return torch.cat(bounds)
+
+
+def _knn_batch(
+    octree: MortonOctree,
+    queries: torch.Tensor,
+    query_starts: torch.Tensor,
+    query_counts: torch.Tensor,
+    seg_starts: torch.Tensor,
+    seg_lengths: torch.Tensor,
+    num_q: int,
+    num_c: int,
+    k: int,
+    distances: torch.Tensor,
+    indices: torch.Tensor,
+):
+    """
+    Dense neighbour search for a batch of query cells padded to `num_q` queries and
+    `num_c` candidates. Writes results of the sorted points to `distances`/`indices`.
+    """
+    device = seg_starts.device
+    num_cells, num_segments = seg_starts.shape
+
+    # Concatenate the candidate ranges of each cell into a padded [B, num_c] matrix.
+    flat_lengths = seg_lengths.view(-1)
+    segment = torch.repeat_interleave(
+        torch.arange(flat_lengths.numel(), device=device), flat_lengths
+    )
+    within = torch.arange(segment.numel(), device=device) - (
+        torch.cumsum(flat_lengths, 0) - flat_lengths
+    )[segment]
+    row_offsets = (torch.cumsum(seg_lengths, dim=1) - seg_lengths).view(-1)
+    candidates = torch.full((num_cells, num_c), -1, dtype=torch.long, device=device)
+    candidates[segment // num_segments, row_offsets[segment] + within] = (
+        seg_starts.view(-1)[segment] + within
+    )
+
+    query_slots = torch.arange(num_q, device=device)
+    query_valid = query_slots < query_counts[:, None]
+    query_idx = queries[
+        (query_starts[:, None] + query_slots).clamp(max=queries.shape[0] - 1)
+    ]
+
+    dists = torch.cdist(
+        octree.sorted_pts.index_select(0, query_idx.view(-1)).view(num_cells, num_q, 3),
+        octree.sorted_pts.index_select(0, candidates.clamp(min=0).view(-1)).view(
+            num_cells, num_c, 3
+        ),
+        compute_mode="donot_use_mm_for_euclid_dist",
+    )
+    dists.masked_fill_((candidates < 0)[:, None, :], math.inf)
+    knn_dists, knn_slots = torch.topk(dists, k, dim=-1, largest=False, sorted=True)
+    knn_idx = torch.gather(candidates[:, None, :].expand(-1, num_q, -1), 2, knn_slots)
+
+    query_idx = query_idx[query_valid]
+    distances[query_idx] = knn_dists[query_valid]
+    indices[query_idx] = knn_idx[query_valid]
+
+
+def _search_blocks(
+    octree: MortonOctree,
+    queries: torch.Tensor,
+    levels: torch.Tensor,
+    k: int,
+    distances: torch.Tensor,
+    indices: torch.Tensor,
+    max_chunk_elements: int,
+):
+    """
+    Searches the k nearest neighbours of sorted points `queries` `[Q]` in the 3x3x3
+    blocks of cells at `levels` `[Q]` around them, writing results of the sorted
+    points to `distances` and `indices`.
+    """
+    device = queries.device
+    num_queries = queries.shape[0]
+
+    # Group queries by their cell at their level, groups share the candidates.
+    cell_codes = octree.sorted_codes[queries] >> (3 * levels)
+    group_order = torch.argsort(cell_codes, stable=True)
+    group_order = group_order[torch.argsort(levels[group_order], stable=True)]
+    queries, levels, cell_codes = (
+        queries[group_order],
+        levels[group_order],
+        cell_codes[group_order],
+    )
+    is_group_start = torch.ones(num_queries, dtype=torch.bool, device=device)
+    is_group_start[1:] = (levels[1:] != levels[:-1]) | (
+        cell_codes[1:] != cell_codes[:-1]
+    )
+    group_starts = torch.nonzero(is_group_start).squeeze(1)
+    group_counts = torch.diff(
+        group_starts, append=torch.tensor([num_queries], device=device)
+    )
+
+    for chunk_start in range(0, group_starts.shape[0], _CELLS_PER_CHUNK):
+        starts = group_starts[chunk_start : chunk_start + _CELLS_PER_CHUNK]
+        counts = group_counts[chunk_start : chunk_start + _CELLS_PER_CHUNK]
+        seg_starts, seg_lengths = octree.block_ranges(
+            octree.sorted_voxels[queries[starts]], levels[starts]
+        )
+
+        # Batch cells padded to the same numbers of queries and candidates.
+        q_pad = _round_up_bucket(counts)
+        c_pad = _round_up_bucket(seg_lengths.sum(dim=1)).clamp(min=k)
+        # Pad sizes never exceed 2^31, so each bucket has a unique combined id.
+        buckets, bucket_of_cell = torch.unique(
+            q_pad * 2**31 + c_pad, return_inverse=True
+        )
+        cell_order = torch.argsort(bucket_of_cell, stable=True)
+        bucket_sizes = torch.bincount(bucket_of_cell, minlength=len(buckets)).tolist()
+
+        for (num_q, num_c), bucket_cells in zip(
+            (divmod(bucket, 2**31) for bucket in buckets.tolist()),
+            cell_order.split(bucket_sizes),
+        ):
+            cells_per_batch = max(1, max_chunk_elements // (num_q * num_c))
+            for batch in bucket_cells.split(cells_per_batch):
+                _knn_batch(
+                    octree,
+                    queries,
+                    starts[batch],
+                    counts[batch],
+                    seg_starts[batch],
+                    seg_lengths[batch],
+                    num_q,
+                    num_c,
+                    k,
+                    distances,
+                    indices,
+                )
+
+
+def grid_knn(
+    pts: torch.Tensor,
+    k: int,
+    max_chunk_elements: int = DEFAULT_MAX_CHUNK_ELEMENTS,
+    eps: float = 0.0,
+) -> KnnResult:
+    """
+    Exact (or, with `eps > 0`, approximate) k-nearest neighbours of each point among all points (including itself),
+    like `sklearn.neighbors.NearestNeighbors.kneighbors` on the fitted points.
+
+    The k-th distance of each point is first estimated from its neighbours in Morton
+    order. Each point is then compared against the 3x3x3 block of octree cells at the
+    finest level whose cells are at least as wide as the estimate, so cell sizes adapt
+    to the local point density. Points whose k-th neighbour found might lie outside
+    the block are searched again on the level given by the smaller of that
+    neighbour's distance and the window bound, which is guaranteed to contain all k
+    nearest neighbours.
+
+    Args:
+        pts: Points `[N, 3]`.
+        k: Number of neighbours, at most N.
+        max_chunk_elements: Upper bound on distances evaluated at once, which bounds
+            the memory used.
+        eps: Allowed relative error. The i-th distance returned is at most `1 + eps`
+            times the true i-th neighbour distance, which lets more points skip the
+            second search.
+    """
+    num_pts = pts.shape[0]
+    if not 0 < k <= num_pts:
+        raise ValueError(f"Expected 0 < k <= {num_pts}, got k={k}")
+    if eps < 0:
+        raise ValueError(f"Expected eps >= 0, got eps={eps}")
+    device = pts.device
+
+    octree = MortonOctree(pts)
+    bounds = _window_knn_bounds(octree, k, max_chunk_elements)
+    levels = octree.level_for_radius(bounds / _WINDOW_BOUND_RATIO)
+
+    sorted_distances = torch.empty((num_pts, k), dtype=pts.dtype, device=device)
+    sorted_indices = torch.empty((num_pts, k), dtype=torch.long, device=device)
+    queries = torch.arange(num_pts, device=device)
+    _search_blocks(
+        octree,
+        queries,
+        levels,
+        k,
+        sorted_distances,
+        sorted_indices,
+        max_chunk_elements,
+    )
+
+    kth_distances = sorted_distances[:, -1]
+    # All points outside the block are at least the clearance away, so if the k-th
+    # neighbour found is within `1 + eps` of it, so is every neighbour found of the
+    # true one of the same rank.
+    uncertain = kth_distances > (1 + eps) * octree.block_clearance(queries, levels)
+    if uncertain.any():
+        _search_blocks(
+            octree,
+            queries[uncertain],
+            # Both the window bound and the k-th neighbour found bound the true one.
+            octree.level_for_radius(
+                torch.minimum(kth_distances[uncertain], bounds[uncertain])
+            ),
+            k,
+            sorted_distances,
+            sorted_indices,
+            max_chunk_elements,
+        )
+
+    distances = torch.empty_like(sorted_distances)
+    indices = torch.empty_like(sorted_indices)
+    distances[octree.order] = sorted_distances
+    indices[octree.order] = octree.order[sorted_indices]
+    return KnnResult(distances, indices)